@@ -0,0 +1,192 @@
+"""
+Offline micro-benchmarks of the featurization and inference hot paths on
+synthetic LEI data (see benchmarks.synthetic). Results are stored as JSON, so
+that the results of two commits can be compared:
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import numpy
+import typer
+from typer import echo
+
+from benchmarks.synthetic import packaged_elf_code_list, synthetic_lei_data
+from lenu.data.lei import COL_ELF, COL_LEGALNAME
+from lenu.ml.cnames import harmonize, tokenize
+from lenu.ml.features import ELFAbbreviationTransformer
+from lenu.ml.models import ELFAbbreviationClassifier
+from lenu.ml.pipelines import DefaultPipeline, ELFDetectionModel
+
+# results that are more than this factor slower than the baseline are flagged
+REGRESSION_THRESHOLD = 1.1
+
+
+def measure(func, items, repeat) -> dict:
+    """
+    Run func repeat times (after one warm-up run).
+
+    :param items: number of items func processes per run
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "items": items,
+        "repeat": repeat,
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "items_per_s": items / min(times),
+    }
+
+
+def measure_latency(func, inputs) -> dict:
+    """
+    Call func once per input (after one warm-up call) and report percentiles
+    of the latency per call.
+    """
+    func(inputs[0])
+    latencies = []
+    for x in inputs:
+        start = time.perf_counter()
+        func(x)
+        latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+    return {
+        "items": len(inputs),
+        "repeat": 1,
+        "best_s": min(latencies),
+        "median_s": p50,
+        "p95_s": p95,
+        "p99_s": p99,
+        "items_per_s": len(inputs) / sum(latencies),
+    }
+
+
+def run_benchmarks(records: int, jurisdiction: str, repeat: int) -> dict:
+    elf_code_list = packaged_elf_code_list()
+    elf_abbreviations = elf_code_list.get_abbreviations()
+
+    all_names = list(synthetic_lei_data(records, elf_code_list)[COL_LEGALNAME])
+    jurisdiction_data = synthetic_lei_data(
+        records, elf_code_list, jurisdictions=[jurisdiction], seed=1
+    )
+    X = jurisdiction_data[[COL_LEGALNAME]].to_numpy(dtype=object)
+    y = jurisdiction_data[COL_ELF].to_numpy(dtype=object)
+
+    transformer = ELFAbbreviationTransformer(elf_abbreviations, jurisdiction)
+    classifier = ELFAbbreviationClassifier(elf_abbreviations).fit(jurisdiction_data, y)
+    model = ELFDetectionModel(
+        jurisdiction, DefaultPipeline(elf_abbreviations, jurisdiction).fit(X, y)
+    )
+
+    results = {}
+
+    def run(name, result):
+        results[name] = result
+        echo(f"{name:<32} {result['items_per_s']:>12,.0f} items/s")
+
+    run(
+        "cnames.harmonize",
+        measure(lambda: [harmonize(n) for n in all_names], len(all_names), repeat),
+    )
+    run(
+        "cnames.tokenize",
+        measure(lambda: [tokenize(n) for n in all_names], len(all_names), repeat),
+    )
+    run(
+        "ELFAbbreviationTransformer",
+        measure(lambda: transformer.transform(X[:, 0]), len(X), repeat),
+    )
+    run(
+        "ELFAbbreviationClassifier",
+        measure(lambda: classifier.predict(jurisdiction_data), len(X), repeat),
+    )
+    run(
+        "DefaultPipeline.fit",
+        measure(
+            lambda: DefaultPipeline(elf_abbreviations, jurisdiction).fit(X, y),
+            len(X),
+            repeat,
+        ),
+    )
+    run(
+        "ELFDetectionModel.detect",
+        measure_latency(model.detect, list(X[:1000, 0])),
+    )
+    run(
+        "ELFDetectionModel.detect_batch",
+        measure(lambda: model.detect_batch(X[:, 0]), len(X), repeat),
+    )
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    echo("")
+    echo(f"Compared to {baseline.get('commit')} (time per item relative to baseline):")
+    if results["records"] != baseline.get("records"):
+        echo(f"Note: the baseline was run with {baseline.get('records')} records")
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        ratio = baseline["benchmarks"][name]["items_per_s"] / result["items_per_s"]
+        flag = "  <-- slower" if ratio > REGRESSION_THRESHOLD else ""
+        echo(f"{name:<32} {ratio:>8.2f}x{flag}")
+
+
+def main(
+    output: Path = typer.Option(
+        Path("benchmark-results.json"), help="JSON result file"
+    ),
+    records: int = typer.Option(20_000, help="Number of synthetic LEI records"),
+    jurisdiction: str = typer.Option("DE", help="Jurisdiction of the model benchmarks"),
+    repeat: int = typer.Option(5, help="Number of timed runs per benchmark"),
+    baseline: Optional[Path] = typer.Option(
+        None, "--compare", exists=True, help="JSON result file to compare with"
+    ),
+):
+    results = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "records": records,
+        "jurisdiction": jurisdiction,
+        "benchmarks": run_benchmarks(records, jurisdiction, repeat),
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    echo(f"Results stored to {output}")
+
+    if baseline is not None:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,151 @@
+"""
+Synthetic LEI records for the benchmarks, generated offline from the ELF Code
+list that is shipped with lenu: legal names of realistic length with
+diacritics, ending with an abbreviation of their ELF Code, for all
+jurisdictions with abbreviations. A few large jurisdictions get most of the
+records, like in the golden copy.
+"""
+import random
+from typing import List, Optional
+
+import pandas  # type: ignore
+
+from lenu import data
+from lenu.data.elf_codes import ELF_CODE_FILE_NAME, ELFCodeList, load_elf_code_list
+from lenu.data.lei import (
+    COL_ELF,
+    COL_JURISDICTION,
+    COL_LAST_UPDATE,
+    COL_LEGALNAME,
+    COL_REGION,
+)
+
+try:
+    from importlib import resources
+except ImportError:
+    # backport for python < 3.9
+    import importlib_resources as resources  # type: ignore
+
+# jurisdictions with the most LEI records, in this order
+LARGE_JURISDICTIONS = ["US-DE", "DE", "GB", "IT", "FR", "ES", "NL", "LU", "CN", "IN"]
+
+WORDS = [
+    "Müller",
+    "Schröder",
+    "Société",
+    "Générale",
+    "Crédit",
+    "Øresund",
+    "Ærø",
+    "Çelik",
+    "Łódź",
+    "Škoda",
+    "Ibérica",
+    "Nord",
+    "Alpha",
+    "Atlantic",
+    "Capital",
+    "Holding",
+    "Holdings",
+    "Trading",
+    "Investments",
+    "Immobilien",
+    "Beteiligungs",
+    "Verwaltungs",
+    "Logistics",
+    "Energy",
+    "Solar",
+    "Green",
+    "Partners",
+    "Services",
+    "International",
+    "Global",
+    "Fund",
+    "Europe",
+    "&",
+    "-",
+    "(Europe)",
+    "de",
+    "l'Habitat",
+    "and",
+    "Co.",
+    "2",
+    "III",
+]
+
+
+def packaged_elf_code_list() -> ELFCodeList:
+    with resources.path(data, ELF_CODE_FILE_NAME) as elf_resource:
+        return load_elf_code_list(elf_resource)
+
+
+def synthetic_lei_data(
+    n_records: int,
+    elf_code_list: ELFCodeList,
+    jurisdictions: Optional[List[str]] = None,
+    seed: int = 0,
+) -> pandas.DataFrame:
+    """
+    :param jurisdictions: jurisdictions of the records (with abbreviations in
+        the ELF Code list), all jurisdictions with abbreviations for None
+    :return: LEI records with the columns of the golden copy used by lenu and
+        the derived "Jurisdiction" column
+    """
+    rng = random.Random(seed)
+    elf_abbreviations = elf_code_list.get_abbreviations()
+    available = elf_abbreviations.jurisdictions()
+    if jurisdictions is None:
+        jurisdictions = [j for j in LARGE_JURISDICTIONS if j in available] + sorted(
+            j for j in available if j not in LARGE_JURISDICTIONS
+        )
+    missing = [j for j in jurisdictions if j not in available]
+    if missing:
+        raise ValueError(f"No ELF Code abbreviations for jurisdictions {missing}")
+    # Zipf-like distribution of the records over the jurisdictions
+    weights = [1.0 / rank for rank in range(1, len(jurisdictions) + 1)]
+
+    abbreviations = {
+        j: [
+            (abbr, elf_code)
+            for abbr in elf_abbreviations.abbreviations_for_jurisdiction(j)
+            for elf_code in elf_abbreviations.elf_codes_for_abbreviation(j, abbr)
+        ]
+        for j in jurisdictions
+    }
+
+    records = []
+    for i, jurisdiction in enumerate(
+        rng.choices(jurisdictions, weights=weights, k=n_records)
+    ):
+        abbr, elf_code = rng.choice(abbreviations[jurisdiction])
+        words = rng.choices(WORDS, k=rng.randint(1, 5))
+        if rng.random() < 0.9:
+            # the others have no abbreviation in their name
+            words.append(abbr.upper() if rng.random() < 0.1 else abbr)
+        if jurisdiction.startswith("US-"):
+            legal_jurisdiction, region = "US", jurisdiction
+        else:
+            legal_jurisdiction, region = jurisdiction, None
+        records.append(
+            (
+                f"{rng.getrandbits(80):020X}",
+                " ".join(words),
+                legal_jurisdiction,
+                region,
+                elf_code,
+                f"2023-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}T00:00:00Z",
+                jurisdiction,
+            )
+        )
+    return pandas.DataFrame(
+        records,
+        columns=[
+            "LEI",
+            COL_LEGALNAME,
+            COL_JURISDICTION,
+            COL_REGION,
+            COL_ELF,
+            COL_LAST_UPDATE,
+            "Jurisdiction",
+        ],
+    )
@@ -1,20 +1,34 @@
 from pathlib import Path
 import sys
 from logging import getLogger
-from typing import Optional
+from typing import TYPE_CHECKING, List, Optional
 
+import pandas  # type: ignore
+import requests
 import typer
 from typer import Typer, echo
 
 from lenu.data import DataRepo
-
-from lenu.ml.pipelines import ModelRepo
+from lenu.data.download import DEFAULT_CONNECTIONS
+from lenu.ml import DEFAULT_MIN_SAMPLES
+from lenu.profiling import Profiler
 from lenu.util import typer_log_config
 from lenu.modelhub import (
-    get_available_lenu_models_from_huggingface,
+    ONNX_EXPORT_INFO,
+    ModelManifest,
+    export_onnx,
     get_model_from_huggingface,
+    list_onnx_exports,
+    load_onnx_model,
+    onnx_export_dir,
 )
 
+# scikit-learn (lenu.ml.pipelines, lenu.ml.eval) and torch (used by
+# lenu.modelhub) are only imported by the commands that need them, to keep
+# the start of the other commands fast
+if TYPE_CHECKING:
+    from lenu.ml.pipelines import ModelRepo
+
 
 logger = getLogger(__name__)
 
@@ -22,14 +36,38 @@ DEFAULT_DATA_DIR = "./data"
 DEFAULT_MODEL_DIR = "./models"
 
 
-app = Typer(callback=typer_log_config)
+app = Typer()
+
+
+@app.callback()
+def main(
+    ctx: typer.Context,
+    enable_logging: bool = False,
+    loglevel: str = "INFO",
+    profile: Optional[Path] = typer.Option(
+        None,
+        help="Store wall time, CPU time and peak memory of each stage to this file",
+    ),
+    profile_format: str = typer.Option("json", help="json or prometheus"),
+):
+    typer_log_config(enable_logging, loglevel)
+
+    if profile is not None:
+        if profile_format not in ("json", "prometheus"):
+            raise typer.BadParameter(f"Unknown profile format {profile_format}")
+        profiler = Profiler()
+        ctx.with_resource(profiler.activate())
+        ctx.call_on_close(lambda: profiler.write(profile, profile_format))
 
 
 @app.command()
 def download(
     data_dir: Path = typer.Option(
         DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
-    )
+    ),
+    connections: int = typer.Option(
+        DEFAULT_CONNECTIONS, help="Number of parallel connections"
+    ),
 ):
     """
     Download latest LEI data from gleif.org
@@ -41,10 +79,56 @@ def download(
         "Downloading latest LEI data and ELF Codes for training from https://gleif.org ..."
     )
     echo(f"This may take a few minutes. Data will be downloaded to {str(data_dir)}")
-    data_repo.download_latest()
+    data_repo.download_latest(connections=connections)
     echo("Download finished.")
 
 
+@app.command()
+def build_cache(
+    data_dir: Path = typer.Option(
+        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
+    )
+):
+    """
+    Convert the latest LEI data into a columnar cache (partitioned by Jurisdiction).
+    """
+    data_repo = DataRepo.from_data_dir(data_dir)
+
+    if not data_repo.ready():
+        logger.error("LEI data is not ready yet, Please use `lenu download`")
+        sys.exit(1)
+
+    echo(f"Converting {data_repo.latest_lei_file()} into a columnar cache ...")
+    echo("This may take a few minutes, but speeds up every subsequent training.")
+    data_repo.build_lei_cache()
+    echo(f"Cache stored to {str(data_repo.lei_cache_dir())}")
+
+
+@app.command()
+def update(
+    data_dir: Path = typer.Option(
+        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
+    )
+):
+    """
+    Update the LEI data with the latest delta file from gleif.org (requires pyarrow).
+    """
+    data_repo = DataRepo.from_data_dir(data_dir)
+
+    if not data_repo.lei_cache_ready():
+        logger.error(
+            "LEI cache is not ready yet, "
+            "Please use `lenu download` or `lenu build-cache`"
+        )
+        sys.exit(1)
+
+    if data_repo.update_lei_cache():
+        echo(f"LEI data is up to date ({data_repo.lei_cache_publish_date()}).")
+    else:
+        echo("No delta file covers all changes, Please use `lenu download`.")
+        sys.exit(1)
+
+
 @app.command()
 def train(
     jurisdiction: str,
@@ -54,14 +138,42 @@ def train(
     models_dir: Path = typer.Option(
         DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
     ),
+    compact: bool = typer.Option(
+        False, help="Use categorical and Arrow string dtypes to reduce memory usage"
+    ),
+    update: bool = typer.Option(
+        False,
+        help="Update the existing model with LEI records changed since its training",
+    ),
+    out_of_core: bool = typer.Option(
+        False,
+        help="Train chunk by chunk with hashed features to bound memory usage",
+    ),
 ):
     """
     Train an ELF Detection model for a Jurisdiction.
     """
-    data_repo = DataRepo.from_data_dir(data_dir)
+    if update and out_of_core:
+        raise typer.BadParameter("--update can not be combined with --out-of-core")
+
+    from lenu.ml.pipelines import ModelRepo
+
+    data_repo = DataRepo.from_data_dir(data_dir, compact=compact)
     model_repo = ModelRepo.from_models_dir(models_dir)
 
-    if data_repo.ready():
+    if data_repo.ready() and update:
+        try:
+            records = model_repo.update_pipeline(jurisdiction, data_repo)
+        except ValueError as e:
+            logger.error(f"{e}, Please use `lenu train {jurisdiction}`")
+            sys.exit(1)
+        echo(f"Model updated with {records} records. Model stored to {str(models_dir)}")
+    elif data_repo.ready() and out_of_core:
+        echo(f"Training model for {jurisdiction} out of core based on scikit-learn ...")
+        echo("This may take a few minutes.")
+        model_repo.train_out_of_core(jurisdiction, data_repo)
+        echo(f"Training finished. Model stored to {str(models_dir)}")
+    elif data_repo.ready():
         echo(f"Training model for {jurisdiction} based on scikit-learn ...")
         echo(f"This may take a few minutes.")
         model_repo.train_pipeline(jurisdiction, data_repo)
@@ -70,6 +182,119 @@ def train(
         logger.error("LEI data is not ready yet, Please use `lenu download`")
 
 
+@app.command()
+def train_all(
+    jurisdictions: Optional[List[str]] = typer.Argument(
+        None, help="Jurisdictions to train. All with enough samples if omitted."
+    ),
+    data_dir: Path = typer.Option(
+        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+    models_dir: Path = typer.Option(
+        DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+    workers: Optional[int] = typer.Option(
+        None, help="Number of training processes (default: number of CPUs)"
+    ),
+    min_samples: int = typer.Option(
+        DEFAULT_MIN_SAMPLES,
+        help="Minimum number of samples if no jurisdictions are given",
+    ),
+    compact: bool = typer.Option(
+        False, help="Use categorical and Arrow string dtypes to reduce memory usage"
+    ),
+):
+    """
+    Train ELF Detection models for many Jurisdictions, loading the LEI data only once.
+    """
+    from lenu.ml.pipelines import ModelRepo
+
+    data_repo = DataRepo.from_data_dir(data_dir, compact=compact)
+    model_repo = ModelRepo.from_models_dir(models_dir)
+
+    if not data_repo.ready():
+        logger.error("LEI data is not ready yet, Please use `lenu download`")
+        sys.exit(1)
+
+    echo("Training models based on scikit-learn ...")
+    echo("This may take a while.")
+    trained = model_repo.train_many(
+        data_repo,
+        jurisdictions=jurisdictions or None,
+        n_workers=workers,
+        min_samples=min_samples,
+    )
+    echo(f"Trained {len(trained)} models: {' '.join(trained)}")
+    echo(f"Models stored to {str(models_dir)}")
+
+
+@app.command()
+def evaluate(
+    jurisdiction: str,
+    data_dir: Path = typer.Option(
+        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+    folds: int = typer.Option(10, help="Number of cross validation folds"),
+    test_size: float = typer.Option(0.3, help="Share of test records per fold"),
+    workers: Optional[int] = typer.Option(
+        None, help="Number of folds evaluated in parallel (default: number of CPUs)"
+    ),
+    compact: bool = typer.Option(
+        False, help="Use categorical and Arrow string dtypes to reduce memory usage"
+    ),
+):
+    """
+    Cross validate the ELF Detection model for a Jurisdiction.
+    """
+    from lenu.ml.eval import evaluate_jurisdiction
+    from lenu.ml.pipelines import (
+        DefaultPipeline,
+        filter_inactive_elf_codes,
+        filter_infrequent_elf_codes,
+    )
+
+    data_repo = DataRepo.from_data_dir(data_dir, compact=compact)
+
+    if not data_repo.ready():
+        logger.error("LEI data is not ready yet, Please use `lenu download`")
+        sys.exit(1)
+
+    elf_code_list = data_repo.load_elf_code_list()
+    jurisdiction_data = filter_inactive_elf_codes(
+        filter_infrequent_elf_codes(data_repo.load_lei_cdf_data(jurisdiction)),
+        elf_code_list,
+    )
+    echo(f"Evaluating model for {jurisdiction} with {folds} folds ...")
+    results = evaluate_jurisdiction(
+        jurisdiction_data,
+        DefaultPipeline(elf_code_list.get_abbreviations(), jurisdiction),
+        n_splits=folds,
+        test_size=test_size,
+        n_jobs=workers or -1,
+    )
+    # one row per score (and time in seconds), one column per fold
+    table = pandas.concat([results.T, results.agg(["mean", "std"]).T], axis=1)
+    echo(table.to_string(float_format="{:.4f}".format))
+
+
+@app.command()
+def convert_models(
+    models_dir: Path = typer.Option(
+        DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+    keep: bool = typer.Option(False, help="Keep the converted .joblib files"),
+):
+    """
+    Convert models stored as .joblib files into the compact model directory format.
+    """
+    from lenu.ml.pipelines import ModelRepo
+
+    model_repo = ModelRepo.from_models_dir(models_dir)
+
+    converted = model_repo.convert_models(keep=keep)
+    echo(f"Converted {len(converted)} models: {' '.join(converted)}")
+
+
 @app.command()
 def list(
     models_dir: Path = typer.Option(
@@ -79,6 +304,8 @@ def list(
     """
     List available ELF Detection models.
     """
+    from lenu.ml.pipelines import ModelRepo
+
     model_repo = ModelRepo.from_models_dir(models_dir)
 
     local_models = model_repo.list()
@@ -90,7 +317,14 @@ def list(
             echo(m)
         echo("")
 
-    remote_models = get_available_lenu_models_from_huggingface()
+    onnx_exports = list_onnx_exports(models_dir)
+    if onnx_exports:
+        echo("=== LENU ELF Detection Transformer models exported to ONNX locally ===")
+        for m in onnx_exports:
+            echo(m)
+        echo("")
+
+    remote_models = ModelManifest(models_dir).models()
     if remote_models:
         echo(
             "=== LENU ELF Detection Transformer models available on https://huggingface.co/Sociovestix (recommended) ==="
@@ -103,55 +337,114 @@ def list(
 
 
 @app.command()
-def elf(
-    jurisdiction_or_model: str,
-    legal_name: str,
-    data_dir: Path = typer.Option(
-        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
-    ),
+def refresh_models(
     models_dir: Path = typer.Option(
         DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
-    ),
+    )
 ):
     """
-    Detect ELF codes for a Jurisdiction and legal name. Example: `lenu elf DE "Siemens AG"`
+    Refresh the local list of models available on https://huggingface.co/Sociovestix.
     """
-    data_repo = DataRepo.from_data_dir(data_dir)
-
-    if not data_repo.ready():
-        logger.error("LEI data is not ready yet, Please use `lenu download`")
+    try:
+        models = ModelManifest(models_dir).refresh()
+    except requests.RequestException as e:
+        logger.error(f"Could not refresh the list of models: {e}")
         sys.exit(1)
+    echo(f"{len(models)} models available on https://huggingface.co/Sociovestix")
+
+
+def load_onnx_export(repo_name: str, models_dir: Path, err=False):
+    export_dir = onnx_export_dir(models_dir, repo_name)
+    if not export_dir.joinpath(ONNX_EXPORT_INFO).exists():
+        return None
+    try:
+        elf_model = load_onnx_model(export_dir)
+    except ImportError:
+        echo(f"Ignoring ONNX export of {repo_name}, onnxruntime is missing", err=err)
+        return None
+    echo(f"Using ONNX export of ELF Detection model {repo_name}", err=err)
+    return elf_model
 
-    model_repo = ModelRepo.from_models_dir(models_dir)
 
-    huggingface_models = get_available_lenu_models_from_huggingface()
+def load_elf_model(jurisdiction_or_model: str, model_repo: "ModelRepo", err=False):
+    """
+    Load, in this order of preference, a locally trained model for a
+    jurisdiction, a local ONNX export (see `lenu export`) or a model from
+    https://huggingface.co/Sociovestix. Messages are echoed to stderr with err=True.
+    """
+    manifest = ModelManifest(model_repo.models_dir)
     fallback_model = f"Sociovestix/lenu_{jurisdiction_or_model}"
 
     try:
         elf_model = model_repo.get_model(jurisdiction_or_model)
-        echo("Using locally trained ELF Detection model: " + jurisdiction_or_model)
-        if fallback_model in huggingface_models:
-            echo("We recommend using Transformer based model though: " + fallback_model)
-    except ValueError as ve:
-        if jurisdiction_or_model in huggingface_models:
+        echo(
+            "Using locally trained ELF Detection model: " + jurisdiction_or_model,
+            err=err,
+        )
+        if fallback_model in manifest.cached_models():
             echo(
-                f"Using recommended ELF Detection model from https://huggingface.co/{jurisdiction_or_model}"
+                "We recommend using Transformer based model though: " + fallback_model,
+                err=err,
+            )
+    except ValueError:
+        onnx_model = load_onnx_export(
+            jurisdiction_or_model, model_repo.models_dir, err
+        ) or load_onnx_export(fallback_model, model_repo.models_dir, err)
+        huggingface_models = [] if onnx_model else manifest.models()
+        if onnx_model is not None:
+            elf_model = onnx_model
+        elif jurisdiction_or_model in huggingface_models:
+            echo(
+                f"Using recommended ELF Detection model from https://huggingface.co/{jurisdiction_or_model}",
+                err=err,
             )
             elf_model = get_model_from_huggingface(jurisdiction_or_model)
         elif fallback_model in huggingface_models:
             echo(
-                f"ELF Detection model for given jurisdiction {jurisdiction_or_model} not locally available."
+                f"ELF Detection model for given jurisdiction {jurisdiction_or_model} not locally available.",
+                err=err,
+            )
+            echo(
+                f"Using recommended model: https://huggingface.co/{fallback_model}",
+                err=err,
             )
-            echo(f"Using recommended model: https://huggingface.co/{fallback_model}")
             elf_model = get_model_from_huggingface(fallback_model)
         else:
             echo(
-                f"ELF Detection model for provided jurisdiction '{jurisdiction_or_model}' does neither exist locally, nor is it available on https://huggingface.co/Sociovestix"
+                f"ELF Detection model for provided jurisdiction '{jurisdiction_or_model}' does neither exist locally, nor is it available on https://huggingface.co/Sociovestix",
+                err=err,
             )
-            echo("")
-            echo("You may train a scikit-learn based model locally. Example:")
-            echo(f"lenu train DE")
+            echo("", err=err)
+            echo("You may train a scikit-learn based model locally. Example:", err=err)
+            echo(f"lenu train DE", err=err)
             sys.exit(1)
+    return elf_model
+
+
+@app.command()
+def elf(
+    jurisdiction_or_model: str,
+    legal_name: str,
+    data_dir: Path = typer.Option(
+        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+    models_dir: Path = typer.Option(
+        DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+):
+    """
+    Detect ELF codes for a Jurisdiction and legal name. Example: `lenu elf DE "Siemens AG"`
+    """
+    from lenu.ml.pipelines import ModelRepo
+
+    data_repo = DataRepo.from_data_dir(data_dir)
+
+    if not data_repo.ready():
+        logger.error("LEI data is not ready yet, Please use `lenu download`")
+        sys.exit(1)
+
+    model_repo = ModelRepo.from_models_dir(models_dir)
+    elf_model = load_elf_model(jurisdiction_or_model, model_repo)
 
     elf_probabilities = elf_model.detect(legal_name, top=3)
 
@@ -173,6 +466,170 @@ def elf(
     echo(res)
 
 
+@app.command()
+def elf_batch(
+    jurisdiction_or_model: str,
+    input_file: Path = typer.Argument(
+        ..., exists=True, dir_okay=False, help="CSV file with legal names"
+    ),
+    output_file: Optional[Path] = typer.Argument(
+        None, dir_okay=False, help="CSV file for the results (default: stdout)"
+    ),
+    column: Optional[str] = typer.Option(
+        None, help="Column with legal names (default: first column)"
+    ),
+    top: int = typer.Option(3, help="Number of ELF Codes per legal name"),
+    chunksize: int = typer.Option(10_000, help="Number of names processed at once"),
+    models_dir: Path = typer.Option(
+        DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+):
+    """
+    Detect ELF codes for all legal names in a CSV file.
+    Example: `lenu elf-batch DE names.csv results.csv`
+    """
+    from lenu.ml.pipelines import ModelRepo
+
+    model_repo = ModelRepo.from_models_dir(models_dir)
+    elf_model = load_elf_model(jurisdiction_or_model, model_repo, err=True)
+
+    reader = pandas.read_csv(
+        input_file,
+        dtype=str,
+        na_values=[""],
+        keep_default_na=False,
+        chunksize=chunksize,
+    )
+    output = (
+        open(output_file, "w", encoding="utf-8", newline="")
+        if output_file
+        else sys.stdout
+    )
+    try:
+        for i, chunk in enumerate(reader):
+            names = chunk[column or chunk.columns[0]].fillna("")
+            res = elf_model.detect_batch(names, top=top)
+            res.insert(0, names.name, names.values)
+            res.to_csv(output, header=i == 0, index=False)
+    finally:
+        if output_file:
+            output.close()
+
+
+@app.command()
+def serve(
+    jurisdictions_or_models: List[str] = typer.Argument(
+        ..., help="Jurisdictions or models to serve, e.g. DE Sociovestix/lenu_AT"
+    ),
+    host: str = typer.Option("127.0.0.1"),
+    port: int = typer.Option(8000),
+    max_batch_size: int = typer.Option(
+        64, help="Maximum number of legal names detected at once"
+    ),
+    max_latency_ms: float = typer.Option(
+        10.0, help="Maximum time a request waits for others to fill a batch"
+    ),
+    data_dir: Path = typer.Option(
+        DEFAULT_DATA_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+    models_dir: Path = typer.Option(
+        DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+):
+    """
+    Serve ELF Detection models over HTTP. Example: `lenu serve DE AT --port 8000`
+    """
+    from lenu.ml.pipelines import ModelRepo
+    from lenu.serve import DetectionServer, MicroBatcher
+
+    data_repo = DataRepo.from_data_dir(data_dir)
+
+    if not data_repo.ready():
+        logger.error("LEI data is not ready yet, Please use `lenu download`")
+        sys.exit(1)
+
+    model_repo = ModelRepo.from_models_dir(models_dir)
+    batchers = {
+        jurisdiction_or_model: MicroBatcher(
+            load_elf_model(jurisdiction_or_model, model_repo),
+            max_batch_size=max_batch_size,
+            max_latency=max_latency_ms / 1000,
+        )
+        for jurisdiction_or_model in jurisdictions_or_models
+    }
+    elf_local_names = (
+        data_repo.load_elf_code_list()
+        .get_names()["Entity Legal Form name Local name"]
+        .dropna()
+        .to_dict()
+    )
+
+    server = DetectionServer((host, port), batchers, elf_local_names)
+    echo(f"Serving ELF Detection on http://{host}:{port}/detect")
+    echo(
+        "Example: curl -d "
+        '\'{"jurisdiction": "%s", "legal_names": ["Hans Müller KG"]}\' '
+        "http://%s:%s/detect" % (jurisdictions_or_models[0], host, port)
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@app.command()
+def export(
+    jurisdiction_or_model: str,
+    quantize: bool = typer.Option(False, help="Quantize the weights to int8"),
+    names_file: Optional[Path] = typer.Option(
+        None,
+        exists=True,
+        dir_okay=False,
+        help="CSV file with legal names (first column) for the accuracy check",
+    ),
+    models_dir: Path = typer.Option(
+        DEFAULT_MODEL_DIR, exists=True, dir_okay=True, resolve_path=True
+    ),
+):
+    """
+    Export a Transformer model from https://huggingface.co/Sociovestix to ONNX for
+    faster detection. Example: `lenu export DE --quantize`
+
+    The export is used by `lenu elf`, `lenu elf-batch` and `lenu serve` instead of
+    the PyTorch model, but not if a locally trained model exists for the
+    Jurisdiction (see `lenu list`).
+    """
+    repo_name = (
+        jurisdiction_or_model
+        if "/" in jurisdiction_or_model
+        else f"Sociovestix/lenu_{jurisdiction_or_model}"
+    )
+    legal_names = None
+    if names_file:
+        legal_names = (
+            pandas.read_csv(names_file, dtype=str, keep_default_na=False)
+            .iloc[:, 0]
+            .tolist()
+        )
+
+    try:
+        info = export_onnx(repo_name, models_dir, quantize, legal_names)
+    except ImportError:
+        logger.error(
+            "ONNX export requires onnx and onnxruntime: pip install lenu[onnx]"
+        )
+        sys.exit(1)
+
+    drift = info["drift"]
+    echo(f"Exported {repo_name} to {onnx_export_dir(models_dir, repo_name)}")
+    echo(f"Accuracy check on {drift['legal_names']} legal names:")
+    echo(f"  max. score difference:  {drift['max_abs_score_diff']:.6f}")
+    echo(f"  mean score difference:  {drift['mean_abs_score_diff']:.6f}")
+    echo(f"  same best ELF Code for: {drift['top1_agreement']:.2%}")
+
+
 @app.command()
 def abbreviations(
     jurisdiction: str,
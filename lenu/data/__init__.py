@@ -1,22 +1,36 @@
 from pathlib import Path
+import json
 import os
-import urllib
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 import shutil
 
 from lenu import data
-from lenu.data.elf_codes import load_elf_code_list, ELFAbbreviations, ELF_CODE_FILE_NAME, ELFCodeList
+from lenu.data.elf_codes import (
+    load_elf_code_list_index,
+    ELFAbbreviations,
+    ELF_CODE_FILE_NAME,
+    ELFCodeListIndex,
+)
 from lenu.data.lei import (
-    load_lei_cdf_data,
     COL_LEGALNAME,
     COL_JURISDICTION,
     COL_ELF,
-    get_legal_jurisdiction,
+    COL_REGION,
+    COL_LAST_UPDATE,
+    load_lei_cdf_data_streaming,
+    convert_lei_cdf_to_parquet,
+    load_lei_parquet_data,
+    iter_lei_cdf_data,
+    iter_lei_parquet_data,
+    apply_lei_cdf_delta_to_parquet,
 )
 from lenu.data.goldencopyfiles import (
     GoldenCopyFilePublications,
     GoldenCopyFilePublication,
 )
+from lenu.data.download import download_file, DEFAULT_CONNECTIONS
+from lenu.profiling import profile_stage
 
 from logging import getLogger
 
@@ -29,14 +43,62 @@ except ImportError:
 
 logger = getLogger(__name__)
 
+LEI_CACHE_DIR_NAME = "lei-cache"
+# files starting with "_" are ignored by pyarrow when reading the dataset
+LEI_CACHE_MANIFEST = "_manifest.json"
+# increase when the layout of the cache changes, older caches need to be rebuilt
+LEI_CACHE_FORMAT = 2
+
+# columns of the golden copy that are needed for training
+LEI_COLUMNS = [
+    "LEI",
+    COL_LEGALNAME,
+    COL_JURISDICTION,
+    COL_ELF,
+    COL_REGION,
+    # watermark of incremental model updates (see ModelRepo.update_pipeline)
+    COL_LAST_UPDATE,
+]
+
+# delta files of a golden copy publication and the period of changes they cover
+LEI_DELTA_FILES = [
+    ("IntraDay", timedelta(hours=8)),
+    ("LastDay", timedelta(days=1)),
+    ("LastWeek", timedelta(days=7)),
+    ("LastMonth", timedelta(days=31)),
+]
+
 
 class DataRepoNotReady(Exception):
     pass
 
 
+def _utc(date: datetime) -> datetime:
+    # publish dates are compared as naive UTC datetimes
+    if date.tzinfo is None:
+        return date
+    return date.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def publish_date_from_filename(filename) -> Optional[datetime]:
+    # e.g. 20231001-0800-gleif-goldencopy-lei2-golden-copy.csv.zip
+    try:
+        return datetime.strptime(filename[:13], "%Y%m%d-%H%M")
+    except ValueError:
+        return None
+
+
 class DataRepo:
-    def __init__(self, data_dir: Path):
+    def __init__(self, data_dir: Path, compact: bool = False):
+        """
+        :param data_dir: directory of the LEI data and ELF Code list
+        :param compact: load LEI data with compact dtypes (categoricals and
+            Arrow strings) instead of python str objects, see compact_lei_data.
+            The ELF Code list is always loaded as a compiled index (see
+            load_elf_code_list_index), compact does not apply to it.
+        """
         self.data_dir = data_dir
+        self.compact = compact
 
     def latest_lei_file(self) -> Optional[Path]:
         lei_files = list(
@@ -52,45 +114,254 @@ class DataRepo:
     def ready(self) -> bool:
         return bool(self.latest_lei_file()) and bool(self.elf_code_list_file())
 
+    def lei_cache_dir(self) -> Path:
+        return self.data_dir.joinpath(LEI_CACHE_DIR_NAME)
+
+    def _lei_cache_source(self) -> dict:
+        lei_file = self.latest_lei_file()
+        stat = lei_file.stat()  # type: ignore
+        return {
+            "format": LEI_CACHE_FORMAT,
+            "source": lei_file.name,  # type: ignore
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "columns": LEI_COLUMNS,
+        }
+
+    def _lei_cache_manifest(self) -> Optional[dict]:
+        manifest_file = self.lei_cache_dir().joinpath(LEI_CACHE_MANIFEST)
+        if not manifest_file.exists():
+            return None
+        with open(manifest_file) as f:
+            return json.load(f)
+
+    def _write_lei_cache_manifest(self, cache_dir: Path, manifest: dict):
+        tmp_file = cache_dir.joinpath(LEI_CACHE_MANIFEST + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_file, cache_dir.joinpath(LEI_CACHE_MANIFEST))
+
+    def lei_cache_ready(self) -> bool:
+        """
+        True if the columnar LEI cache exists and was built from the latest
+        LEI golden copy file.
+        """
+        if not self.latest_lei_file():
+            return False
+        manifest = self._lei_cache_manifest()
+        if manifest is None:
+            return False
+        try:
+            import pyarrow  # type: ignore # noqa: F401
+        except ImportError:
+            return False
+        source = self._lei_cache_source()
+        return {key: manifest.get(key) for key in source} == source
+
+    def _use_lei_cache(self) -> bool:
+        """
+        lei_cache_ready, with a warning if there is a cache that can not be used
+        """
+        if self.lei_cache_ready():
+            return True
+        manifest = self._lei_cache_manifest()
+        if manifest is not None and self.latest_lei_file():
+            source = self._lei_cache_source()
+            changed = [key for key in source if manifest.get(key) != source[key]]
+            reason = (
+                "it was built by another version of lenu or from other LEI data "
+                f"(different {', '.join(changed)}), Please use `lenu build-cache`"
+                if changed
+                else "pyarrow is not installed"
+            )
+            logger.warning(
+                f"The LEI cache {self.lei_cache_dir()} is not used, {reason}. "
+                "Reading the LEI data from the CSV file instead, which is much slower."
+            )
+        return False
+
+    def lei_cache_publish_date(self) -> Optional[datetime]:
+        """
+        Publication date of the golden copy (or of the last delta file applied
+        by update_lei_cache) the LEI cache corresponds to.
+        """
+        manifest = self._lei_cache_manifest()
+        if not manifest:
+            return None
+        if manifest.get("publish_date"):
+            return datetime.fromisoformat(manifest["publish_date"])
+        return publish_date_from_filename(manifest["source"])
+
+    def build_lei_cache(self) -> None:
+        """
+        Convert the latest LEI golden copy file into a parquet dataset that is
+        partitioned by jurisdiction. Requires pyarrow.
+        """
+        lei_file = self.latest_lei_file()
+        if lei_file is None:
+            raise DataRepoNotReady()
+
+        cache_dir = self.lei_cache_dir()
+        tmp_dir = cache_dir.with_name(cache_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        logger.info(f"Converting {lei_file} into {cache_dir}")
+        convert_lei_cdf_to_parquet(
+            url=lei_file, target_dir=tmp_dir, usecols=LEI_COLUMNS
+        )
+        publish_date = publish_date_from_filename(lei_file.name)
+        self._write_lei_cache_manifest(
+            tmp_dir,
+            {
+                **self._lei_cache_source(),
+                "publish_date": publish_date.isoformat() if publish_date else None,
+            },
+        )
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        tmp_dir.rename(cache_dir)
+
+    def update_lei_cache(self) -> bool:
+        """
+        Bring the LEI cache up to the latest golden copy publication by
+        applying the smallest delta file that covers all changes since the
+        publication the cache is at. Requires pyarrow.
+
+        :return: False if no delta file covers these changes, then the full
+            golden copy needs to be downloaded again
+        """
+        if not self.lei_cache_ready():
+            raise DataRepoNotReady()
+        publish_date = self.lei_cache_publish_date()
+        if publish_date is None:
+            return False
+
+        bundle = GoldenCopyFilePublications().fetch_latest().lei2
+        latest_publish_date = _utc(bundle.publish_date)
+        if latest_publish_date <= publish_date:
+            logger.info(f"LEI data is up to date ({publish_date})")
+            return True
+
+        for delta_type, period in LEI_DELTA_FILES:
+            delta_file = getattr(bundle.delta_files, delta_type)
+            if delta_file is not None and latest_publish_date - period <= publish_date:
+                break
+        else:
+            logger.info(f"No delta file covers the changes since {publish_date}")
+            return False
+
+        file_ref = delta_file.csv
+        target = self.data_dir.joinpath(os.path.basename(file_ref.url))
+        logger.info(f"Applying {delta_type} delta file {target.name}")
+        download_file(file_ref.url, target, expected_size=file_ref.size)
+        try:
+            records = apply_lei_cdf_delta_to_parquet(
+                target, self.lei_cache_dir(), usecols=LEI_COLUMNS
+            )
+        finally:
+            target.unlink()
+        logger.info(f"Updated {records} records")
+
+        self._write_lei_cache_manifest(
+            self.lei_cache_dir(),
+            {
+                **self._lei_cache_manifest(),  # type: ignore
+                "publish_date": latest_publish_date.isoformat(),
+            },
+        )
+        return True
+
     def load_lei_cdf_data(self, jurisdiction):
+        """
+        Load LEI data of a jurisdiction (or a list of jurisdictions, or all
+        jurisdictions for None) including the derived "Jurisdiction" column.
+        """
         if not self.ready():
             raise DataRepoNotReady()
 
-        logger.info(f"Loading LEI data into memory ({self.latest_lei_file()})")
-        lei_data = load_lei_cdf_data(
-            url=self.latest_lei_file(),
-            usecols=[
-                "LEI",
-                COL_LEGALNAME,
-                COL_JURISDICTION,
-                COL_ELF,
-                "Entity.LegalAddress.Region",
-            ],
-        ).assign(Jurisdiction=lambda d: d.apply(get_legal_jurisdiction, axis=1))
-        jurisdiction_data = lei_data[lei_data["Jurisdiction"] == jurisdiction]
-        return jurisdiction_data
-
-    def load_elf_code_list(self) -> ELFCodeList:
+        with profile_stage("load_lei_cdf_data"):
+            if self._use_lei_cache():
+                logger.info(
+                    f"Loading LEI data for {jurisdiction} from {self.lei_cache_dir()}"
+                )
+                return load_lei_parquet_data(
+                    self.lei_cache_dir(),
+                    jurisdiction,
+                    usecols=LEI_COLUMNS,
+                    compact=self.compact,
+                )
+
+            logger.info(
+                f"Streaming LEI data for {jurisdiction} ({self.latest_lei_file()})"
+            )
+            return load_lei_cdf_data_streaming(
+                url=self.latest_lei_file(),
+                jurisdictions=jurisdiction,
+                usecols=LEI_COLUMNS,
+                compact=self.compact,
+            )
+
+    def iter_lei_cdf_data(self, jurisdiction, usecols=None, chunksize=100_000):
+        """
+        Like load_lei_cdf_data, but yields the records in DataFrames of at most
+        chunksize records (only the given columns, all LEI_COLUMNS for None).
+        """
         if not self.ready():
             raise DataRepoNotReady()
+        usecols = LEI_COLUMNS if usecols is None else usecols
+
+        if self._use_lei_cache():
+            return iter_lei_parquet_data(
+                self.lei_cache_dir(), jurisdiction, usecols=usecols, chunksize=chunksize
+            )
+        # the derived "Jurisdiction" column needs the legal jurisdiction and region
+        usecols = list(dict.fromkeys(list(usecols) + [COL_JURISDICTION, COL_REGION]))
+        return iter_lei_cdf_data(
+            self.latest_lei_file(),
+            jurisdictions=jurisdiction,
+            usecols=usecols,
+            chunksize=chunksize,
+        )
+
+    def load_elf_code_list(self) -> ELFCodeListIndex:
+        elf_code_list_file = self.elf_code_list_file()
+        if not self.ready() or elf_code_list_file is None:
+            raise DataRepoNotReady()
 
-        logger.info(f"Loading ELF Code list ({self.elf_code_list_file()})")
-        return load_elf_code_list(self.elf_code_list_file())
+        logger.info(f"Loading ELF Code list ({elf_code_list_file})")
+        return load_elf_code_list_index(elf_code_list_file)
 
     def load_elf_abbreviations(self) -> ELFAbbreviations:
         elf_code_list = self.load_elf_code_list()
         elf_abbreviations = elf_code_list.get_abbreviations()
         return elf_abbreviations
 
-    def download_latest(self) -> None:
+    def download_latest(self, connections=DEFAULT_CONNECTIONS) -> None:
+        """
+        Download the latest LEI golden copy (unless it is already there) and
+        provide the ELF Code list.
+
+        :param connections: number of parallel connections for the download
+        """
         publications = GoldenCopyFilePublications()
         publication: GoldenCopyFilePublication = publications.fetch_latest()
 
-        lei_data_url = publication.lei2.full_file.csv.url
-        filename = os.path.basename(lei_data_url)
+        file_ref = publication.lei2.full_file.csv
+        filename = os.path.basename(file_ref.url)
 
         logger.info(f"Downloading {filename} to {self.data_dir}")
-        urllib.request.urlretrieve(lei_data_url, self.data_dir.joinpath(filename))
+        download_file(
+            file_ref.url,
+            self.data_dir.joinpath(filename),
+            expected_size=file_ref.size,
+            connections=connections,
+        )
+
+        if not self.lei_cache_ready():
+            try:
+                self.build_lei_cache()
+            except ImportError:
+                logger.info("pyarrow is not installed, LEI data will be read from CSV")
 
         logger.info(f"Provide ELF Code list to {self.data_dir}")
         elf_target = self.data_dir.joinpath(ELF_CODE_FILE_NAME)
@@ -98,9 +369,9 @@ class DataRepo:
             shutil.copy(elf_resource, elf_target)
 
     @staticmethod
-    def from_data_dir(data_dir: Path) -> "DataRepo":
+    def from_data_dir(data_dir: Path, compact: bool = False) -> "DataRepo":
         if not data_dir.exists() or not data_dir.is_dir():
             raise ValueError(
                 f"Given data_dir {str(data_dir)} does not exist or is not a directory."
             )
-        return DataRepo(data_dir)
+        return DataRepo(data_dir, compact=compact)
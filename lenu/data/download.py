@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_PART_SIZE = 16 << 20
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _probe(url):
+    """
+    :return: size of the file (or None if unknown), whether range requests are
+        supported, and the validator (ETag or Last-Modified) of the file
+    """
+    response = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    response.raise_for_status()
+    size = response.headers.get("Content-Length")
+    return (
+        int(size) if size is not None else None,
+        response.headers.get("Accept-Ranges") == "bytes",
+        response.headers.get("ETag") or response.headers.get("Last-Modified"),
+    )
+
+
+def _download_range(url, part_file: Path, start, end):
+    response = requests.get(
+        url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=TIMEOUT
+    )
+    with response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise DownloadError(f"Range request for {url} was not honoured")
+
+        received = 0
+        with open(part_file, "r+b") as f:
+            f.seek(start)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                received += len(chunk)
+    if received != end - start + 1:
+        raise DownloadError(
+            f"Received {received} instead of {end - start + 1} bytes for {url}"
+        )
+
+
+def _download_stream(url, part_file: Path):
+    with requests.get(url, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        with open(part_file, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+
+class _DownloadState:
+    """
+    Completed parts of a download, stored next to the partial file so that an
+    interrupted download can be resumed.
+    """
+
+    def __init__(self, state_file: Path, source: dict):
+        self.state_file = state_file
+        self.source = source
+        self.done: set = set()
+        self._lock = threading.Lock()
+
+    def resume(self) -> bool:
+        try:
+            state = json.loads(self.state_file.read_text())
+        except (OSError, ValueError):
+            return False
+        if state["source"] != self.source:
+            return False
+        self.done = set(state["done"])
+        return True
+
+    def complete(self, part):
+        with self._lock:
+            self.done.add(part)
+            tmp_file = self.state_file.with_suffix(".tmp")
+            tmp_file.write_text(
+                json.dumps({"source": self.source, "done": sorted(self.done)})
+            )
+            os.replace(tmp_file, self.state_file)
+
+
+def download_file(
+    url,
+    target: Path,
+    expected_size: Optional[int] = None,
+    connections=DEFAULT_CONNECTIONS,
+    part_size=DEFAULT_PART_SIZE,
+) -> Path:
+    """
+    Download url to target with parallel HTTP range requests.
+
+    Data is written to target.part and the completed parts are tracked in
+    target.part.json, so that a download that was interrupted continues where
+    it stopped. Once complete, the size is verified and the file is renamed to
+    target. Nothing is downloaded if target already exists with the expected size.
+
+    :param expected_size: size in bytes the file must have (e.g. FileRef.size)
+    :raises DownloadError: if the download is incomplete or has the wrong size
+    """
+    if target.exists() and (
+        expected_size is None or target.stat().st_size == expected_size
+    ):
+        logger.info(f"{target} already exists, skipping download")
+        return target
+
+    part_file = target.with_name(target.name + ".part")
+    state_file = target.with_name(target.name + ".part.json")
+
+    size, accepts_ranges, validator = _probe(url)
+    if expected_size is not None and size is not None and size != expected_size:
+        raise DownloadError(
+            f"{url} has {size} bytes, but {expected_size} bytes were expected"
+        )
+
+    if size is None or not accepts_ranges:
+        logger.info(f"Downloading {url} (no range requests supported)")
+        _download_stream(url, part_file)
+    else:
+        state = _DownloadState(
+            state_file, {"url": url, "size": size, "validator": validator}
+        )
+        if part_file.exists() and state.resume():
+            logger.info(f"Resuming download of {url}")
+        else:
+            state.done = set()
+            with open(part_file, "wb") as f:
+                f.truncate(size)
+
+        ranges = {
+            part: (start, min(start + part_size, size) - 1)
+            for part, start in enumerate(range(0, size, part_size))
+        }
+
+        def download_part(part):
+            _download_range(url, part_file, *ranges[part])
+            state.complete(part)
+
+        missing = [part for part in ranges if part not in state.done]
+        logger.info(
+            f"Downloading {len(missing)} of {len(ranges)} parts of {url} "
+            f"with {connections} connections"
+        )
+        with ThreadPoolExecutor(connections) as executor:
+            futures = [executor.submit(download_part, part) for part in missing]
+        # the other parts are still completed, a retry only needs the failed ones
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise DownloadError(
+                f"{len(errors)} parts of {url} failed, download again to resume"
+            ) from errors[0]
+
+    downloaded_size = part_file.stat().st_size
+    if expected_size is not None and downloaded_size != expected_size:
+        part_file.unlink()
+        state_file.unlink(missing_ok=True)
+        raise DownloadError(
+            f"Downloaded {downloaded_size} bytes of {url}, "
+            f"but {expected_size} bytes were expected"
+        )
+
+    os.replace(part_file, target)
+    state_file.unlink(missing_ok=True)
+    return target
@@ -1,18 +1,31 @@
-from functools import lru_cache
+import glob
+import hashlib
+import json
+import logging
+import os
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-import numpy
 import pandas  # type: ignore
 
+logger = logging.getLogger(__name__)
+
 ELF_CODE_FILE_NAME = "2023-09-28-elf-code-list-v1.5.csv"
 
+# compiled ELF Code lists (see load_elf_code_list_index) are stored next to the
+# ELF Code list file as <name of the file><infix><hash of the file>.json
+ELF_CODE_INDEX_INFIX = ".index-"
+# increase when the content of the index changes
+ELF_CODE_INDEX_FORMAT = 1
+
 
 def get_jurisdiction(elf_code_list):
     # We picked region code if we have one, otherwise Country Code
-    return elf_code_list.apply(
-        lambda x: x["Country sub-division code (ISO 3166-2)"]
-        if pandas.notnull(x["Country sub-division code (ISO 3166-2)"])
-        else x["Country Code (ISO 3166-1)"],
-        axis=1,
+    return (
+        elf_code_list["Country sub-division code (ISO 3166-2)"]
+        .astype(object)
+        .fillna(elf_code_list["Country Code (ISO 3166-1)"].astype(object))
     )
 
 
@@ -45,23 +58,208 @@ def expand_us_states(elf_code_list):
     )
 
 
+class ELFAbbreviationMatcher:
+    """
+    Finds all abbreviations (of a jurisdiction) that match a legal name, in the
+    same sense as ELFAbbreviations.matches, in time proportional to the name length.
+
+    With use_endswith, the abbreviations are stored as reversed strings in a trie
+    that is walked backwards from the end of the name. Otherwise, an Aho-Corasick
+    automaton finds all abbreviations that occur anywhere in the name.
+    """
+
+    def __init__(self, abbreviations, use_lowercasing=True, use_endswith=True):
+        self.use_lowercasing = use_lowercasing
+        self.use_endswith = use_endswith
+
+        # node 0 is the root; each node has transitions, a failure link (only
+        # used for Aho-Corasick) and the indices of the abbreviations ending there
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+
+        for i, abbr in enumerate(abbreviations):
+            if use_lowercasing:
+                abbr = abbr.lower()
+            self._insert(" " + abbr if use_endswith else abbr, i)
+
+        if not use_endswith:
+            self._build_failure_links()
+
+    def _insert(self, key, index):
+        node = 0
+        for char in reversed(key) if self.use_endswith else key:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(index)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                # inherit the matches of the longest proper suffix
+                self._output[next_node] = (
+                    self._output[next_node] + self._output[self._fail[next_node]]
+                )
+
+    def match(self, legal_name) -> List[int]:
+        """
+        :return: sorted indices of all abbreviations that match the legal name
+        """
+        if self.use_lowercasing:
+            legal_name = legal_name.lower()
+
+        goto, output = self._goto, self._output
+        matches = list(output[0])
+        node = 0
+        if self.use_endswith:
+            for char in reversed(legal_name):
+                next_node = goto[node].get(char)
+                if next_node is None:
+                    break
+                node = next_node
+                matches.extend(output[node])
+        else:
+            fail = self._fail
+            for char in legal_name:
+                while node and char not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(char, 0)
+                matches.extend(output[node])
+        return sorted(set(matches))
+
+
+# ELF Codes by abbreviation (both sorted) by jurisdiction
+ElfCodesByAbbreviation = Dict[str, Dict[str, List[str]]]
+
+
+def _elf_codes_by_abbreviation(elf_abbreviations_list) -> ElfCodesByAbbreviation:
+    columns = ["Jurisdiction", "Abbreviation", "ELF Code"]
+    rows = (
+        elf_abbreviations_list[columns]
+        .astype(object)
+        .dropna()
+        .drop_duplicates()
+        .sort_values(columns)
+    )
+    elf_codes: ElfCodesByAbbreviation = {}
+    for jurisdiction, abbreviation, elf_code in rows.itertuples(index=False):
+        elf_codes.setdefault(jurisdiction, {}).setdefault(abbreviation, []).append(
+            elf_code
+        )
+    return elf_codes
+
+
 class ELFAbbreviations:
+    """
+    Abbreviations of legal forms and their ELF Codes by jurisdiction.
+
+    The abbreviations of the US federal ELF Codes are stored once and added
+    to the abbreviations of a US state when it is used.
+    """
+
     def __init__(self, elf_abbreviations_list):
-        self._abbr_by_jurisdiction = elf_abbreviations_list.groupby("Jurisdiction")[
-            "Abbreviation"
-        ].apply(lambda abbreviations: list(numpy.unique(abbreviations)))
-        self._elf_by_jur_and_abbr = elf_abbreviations_list.groupby(
-            ["Jurisdiction", "Abbreviation"]
-        )["ELF Code"].apply(lambda elf_codes: list(numpy.unique(elf_codes)))
+        """
+        :param elf_abbreviations_list: DataFrame with the columns
+            "Jurisdiction", "Abbreviation" and "ELF Code"
+        """
+        self._init(_elf_codes_by_abbreviation(elf_abbreviations_list), {}, [])
+
+    @classmethod
+    def from_elf_codes(
+        cls,
+        elf_codes: ElfCodesByAbbreviation,
+        us_federal: Dict[str, List[str]],
+        us_states: List[str],
+    ) -> "ELFAbbreviations":
+        """
+        :param elf_codes: see _elf_codes_by_abbreviation
+        :param us_federal: ELF Codes by abbreviation of the US federal ELF
+            Codes, which apply to all us_states
+        """
+        elf_abbreviations = cls.__new__(cls)
+        elf_abbreviations._init(elf_codes, us_federal, us_states)
+        return elf_abbreviations
 
-    def abbreviations_for_jurisdiction(self, jurisdiction):
-        return self._abbr_by_jurisdiction.get(jurisdiction, [])
+    def _init(self, elf_codes, us_federal, us_states):
+        self._elf_codes: ElfCodesByAbbreviation = elf_codes
+        self._us_federal: Dict[str, List[str]] = us_federal
+        self._us_states = set(us_states) if us_federal else set()
+        # abbreviations of US states including the federal ones
+        self._with_federal: ElfCodesByAbbreviation = {}
+        self._matchers: Dict[Tuple[str, bool, bool], ELFAbbreviationMatcher] = {}
 
-    def elf_codes_for_abbreviation(self, jurisdiction, abbreviation):
-        return self._elf_by_jur_and_abbr.get((jurisdiction, abbreviation), [])
+    def __getstate__(self):
+        # matchers are rebuilt on demand and are not worth storing with a model
+        state = self.__dict__.copy()
+        state["_matchers"] = {}
+        state["_with_federal"] = {}
+        return state
+
+    def __setstate__(self, state):
+        if "_abbr_by_jurisdiction" in state:
+            # stored by an earlier version, as grouped pandas Series
+            elf_codes: ElfCodesByAbbreviation = {}
+            for (jurisdiction, abbreviation), codes in state[
+                "_elf_by_jur_and_abbr"
+            ].items():
+                elf_codes.setdefault(jurisdiction, {})[abbreviation] = list(codes)
+            self._init(elf_codes, {}, [])
+        else:
+            self.__dict__.update(state)
+
+    def _abbreviations(self, jurisdiction) -> Dict[str, List[str]]:
+        if jurisdiction not in self._us_states:
+            return self._elf_codes.get(jurisdiction, {})
+        if jurisdiction not in self._with_federal:
+            state = self._elf_codes.get(jurisdiction, {})
+            self._with_federal[jurisdiction] = {
+                abbreviation: sorted(
+                    set(state.get(abbreviation, []))
+                    | set(self._us_federal.get(abbreviation, []))
+                )
+                for abbreviation in sorted(set(state) | set(self._us_federal))
+            }
+        return self._with_federal[jurisdiction]
+
+    def jurisdictions(self) -> List[str]:
+        return sorted(set(self._elf_codes) | self._us_states)
+
+    def abbreviations_for_jurisdiction(self, jurisdiction) -> List[str]:
+        return list(self._abbreviations(jurisdiction))
+
+    def elf_codes_for_abbreviation(self, jurisdiction, abbreviation) -> List[str]:
+        return self._abbreviations(jurisdiction).get(abbreviation, [])
+
+    def matcher(
+        self, jurisdiction, use_lowercasing=True, use_endswith=True
+    ) -> ELFAbbreviationMatcher:
+        """
+        Matcher for the abbreviations of a jurisdiction. Indices returned by the
+        matcher refer to abbreviations_for_jurisdiction(jurisdiction).
+        """
+        key = (jurisdiction, use_lowercasing, use_endswith)
+        if key not in self._matchers:
+            self._matchers[key] = ELFAbbreviationMatcher(
+                self.abbreviations_for_jurisdiction(jurisdiction),
+                use_lowercasing=use_lowercasing,
+                use_endswith=use_endswith,
+            )
+        return self._matchers[key]
 
     @staticmethod
-    @lru_cache(maxsize=None)
     def matches(legal_name, abbr, use_lowercasing=True, use_endswith=True):
         if use_lowercasing:
             abbr = abbr.lower()
@@ -86,29 +284,120 @@ class ELFCodeList:
         ]
 
     def get_abbreviations(self) -> ELFAbbreviations:
-        elf_code_list = expand_us_states(self.elf_code_list)
+        return self.build_index().get_abbreviations()
 
-        elf_abbreviations = elf_code_list.assign(
-            Jurisdiction=get_jurisdiction(elf_code_list)
-        )[["Jurisdiction", "ELF Code", "Abbreviations Local language"]].dropna()
+    def get_inactive_elf_codes(self):
+        return list(self.elf_code_list[
+            self.elf_code_list['ELF Status ACTV/INAC'] == 'INAC'
+        ]['ELF Code'].unique())
+
+    def build_index(self) -> "ELFCodeListIndex":
+        elf_code_list = self.elf_code_list
+
+        # In US we have ELF Codes on federal level and ELF Codes on State level,
+        # the federal ELF Codes apply to all states (see expand_us_states)
+        us = elf_code_list[elf_code_list["Country Code (ISO 3166-1)"] == "US"]
+        us_states = us["Country sub-division code (ISO 3166-2)"].dropna().unique()
 
         elf_abbreviations = (
-            elf_abbreviations.assign(
+            elf_code_list.assign(Jurisdiction=get_jurisdiction(elf_code_list))[
+                ["Jurisdiction", "ELF Code", "Abbreviations Local language"]
+            ]
+            .dropna()
+            .assign(
                 Abbreviation=lambda d: d["Abbreviations Local language"].str.split(";")
             )
             .explode("Abbreviation")
-            .drop_duplicates(["Jurisdiction", "ELF Code", "Abbreviation"])
+        )
+        elf_codes = _elf_codes_by_abbreviation(elf_abbreviations)
+        # the jurisdiction of the federal ELF Codes is the country code
+        us_federal = elf_codes.pop("US", {})
+
+        names = self.get_names()["Entity Legal Form name Local name"]
+        return ELFCodeListIndex(
+            elf_codes=elf_codes,
+            us_federal=us_federal,
+            us_states=sorted(us_states),
+            names={
+                elf_code: None if pandas.isnull(name) else name
+                for elf_code, name in names.items()
+            },
+            inactive_elf_codes=self.get_inactive_elf_codes(),
         )
 
-        return ELFAbbreviations(elf_abbreviations)
+
+class ELFCodeListIndex:
+    """
+    Compiled ELF Code list with the same methods as ELFCodeList, which can be
+    stored as JSON and loaded in a few milliseconds (see load_elf_code_list_index).
+    """
+
+    def __init__(
+        self,
+        elf_codes: ElfCodesByAbbreviation,
+        us_federal: Dict[str, List[str]],
+        us_states: List[str],
+        names: Dict[str, Optional[str]],
+        inactive_elf_codes: List[str],
+    ):
+        """
+        :param elf_codes: ELF Codes by abbreviation by jurisdiction, see
+            ELFAbbreviations.from_elf_codes for us_federal and us_states
+        :param names: local name by ELF Code
+        """
+        self.elf_codes = elf_codes
+        self.us_federal = us_federal
+        self.us_states = us_states
+        self.names = names
+        self.inactive_elf_codes = inactive_elf_codes
+        self._abbreviations: Optional[ELFAbbreviations] = None
+
+    def get_names(self):
+        names = pandas.Series(self.names, dtype=object)
+        return pandas.DataFrame(
+            {"Entity Legal Form name Local name": names}
+        ).rename_axis("ELF Code")
+
+    def get_abbreviations(self) -> ELFAbbreviations:
+        if self._abbreviations is None:
+            self._abbreviations = ELFAbbreviations.from_elf_codes(
+                self.elf_codes, self.us_federal, self.us_states
+            )
+        return self._abbreviations
 
     def get_inactive_elf_codes(self):
-        return list(self.elf_code_list[
-            self.elf_code_list['ELF Status ACTV/INAC'] == 'INAC'
-        ]['ELF Code'].unique())
+        return list(self.inactive_elf_codes)
+
+    def to_dict(self) -> dict:
+        return {
+            "format": ELF_CODE_INDEX_FORMAT,
+            "elf_codes": self.elf_codes,
+            "us_federal": self.us_federal,
+            "us_states": self.us_states,
+            "names": self.names,
+            "inactive_elf_codes": self.inactive_elf_codes,
+        }
+
+    @staticmethod
+    def from_dict(index: dict) -> "ELFCodeListIndex":
+        return ELFCodeListIndex(
+            elf_codes=index["elf_codes"],
+            us_federal=index["us_federal"],
+            us_states=index["us_states"],
+            names=index["names"],
+            inactive_elf_codes=index["inactive_elf_codes"],
+        )
+
+
+# low-cardinality columns that are represented as pandas categoricals in compact mode
+ELF_CATEGORICAL_COLUMNS = [
+    "Country Code (ISO 3166-1)",
+    "Country sub-division code (ISO 3166-2)",
+    "ELF Status ACTV/INAC",
+]
 
 
-def load_elf_code_list(url) -> ELFCodeList:
+def load_elf_code_list(url, compact=False) -> ELFCodeList:
     elf_code_list = pandas.read_csv(
         url,
         low_memory=False,
@@ -117,4 +406,45 @@ def load_elf_code_list(url) -> ELFCodeList:
         na_values=[""],
         keep_default_na=False,
     )
+    if compact:
+        elf_code_list = elf_code_list.astype(
+            {col: "category" for col in ELF_CATEGORICAL_COLUMNS}
+        )
     return ELFCodeList(elf_code_list)
+
+
+def elf_code_index_file(elf_code_list_file: Path) -> Path:
+    digest = hashlib.sha1(elf_code_list_file.read_bytes()).hexdigest()[:16]
+    return elf_code_list_file.with_name(
+        f"{elf_code_list_file.name}{ELF_CODE_INDEX_INFIX}{digest}.json"
+    )
+
+
+def load_elf_code_list_index(elf_code_list_file: Path) -> ELFCodeListIndex:
+    """
+    Load the compiled ELF Code list of an ELF Code list file. It is built
+    and stored next to the file if the file is new or has changed.
+    """
+    index_file = elf_code_index_file(elf_code_list_file)
+    if index_file.exists():
+        with open(index_file) as f:
+            index = json.load(f)
+        if index.get("format") == ELF_CODE_INDEX_FORMAT:
+            return ELFCodeListIndex.from_dict(index)
+
+    logger.info(f"Compiling ELF Code list {elf_code_list_file}")
+    elf_code_list_index = load_elf_code_list(elf_code_list_file).build_index()
+    try:
+        tmp_file = index_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(elf_code_list_index.to_dict(), f)
+        os.replace(tmp_file, index_file)
+        # indexes of previous versions of the file, not of other ELF Code lists
+        for stale_file in index_file.parent.glob(
+            glob.escape(elf_code_list_file.name) + ELF_CODE_INDEX_INFIX + "*.json"
+        ):
+            if stale_file != index_file:
+                stale_file.unlink()
+    except OSError as e:
+        logger.warning(f"Could not store the compiled ELF Code list: {e}")
+    return elf_code_list_index
@@ -1,10 +1,50 @@
+import zipfile
+
+import numpy
 import pandas  # type: ignore
+from pandas.api.types import union_categoricals  # type: ignore
+
+from lenu.profiling import profile_stage
 
 # some columns names as constants for quick reuse
 COL_LEGALNAME = "Entity.LegalName"
 COL_LEGALNAME_LANG = "Entity.LegalName.xmllang"
 COL_JURISDICTION = "Entity.LegalJurisdiction"
 COL_ELF = "Entity.LegalForm.EntityLegalFormCode"
+COL_REGION = "Entity.LegalAddress.Region"
+COL_LAST_UPDATE = "Registration.LastUpdateDate"
+
+# position of a record in the golden copy, stored in the parquet dataset so that
+# load_lei_parquet_data returns the same index as the CSV loaders
+ROW_COLUMN = "__row__"
+
+
+# low-cardinality columns that are represented as pandas categoricals in compact mode
+CATEGORICAL_COLUMNS = [COL_JURISDICTION, COL_ELF, COL_REGION, "Jurisdiction"]
+# high-cardinality columns that are represented as Arrow strings in compact mode
+STRING_COLUMNS = ["LEI", COL_LEGALNAME]
+
+
+def compact_string_dtype():
+    # Arrow-backed strings need pyarrow, otherwise we keep python str objects
+    try:
+        import pyarrow  # type: ignore # noqa: F401
+    except ImportError:
+        return object
+    return pandas.StringDtype("pyarrow")
+
+
+def compact_lei_data(lei_data):
+    """
+    Convert LEI data into a compact in-memory representation: categoricals for
+    low-cardinality columns (jurisdictions, ELF codes, regions) and Arrow-backed
+    strings for LEIs and legal names.
+    """
+    dtypes = {col: "category" for col in CATEGORICAL_COLUMNS if col in lei_data}
+    dtypes.update(
+        {col: compact_string_dtype() for col in STRING_COLUMNS if col in lei_data}
+    )
+    return lei_data.astype(dtypes)
 
 
 def load_lei_cdf_data(url, usecols=None):
@@ -29,3 +69,282 @@ def get_legal_jurisdiction(lei):
             return lei["Entity.LegalJurisdiction"]
     else:
         return lei["Entity.LegalJurisdiction"]
+
+
+def derive_legal_jurisdiction(lei_data):
+    """
+    Vectorized version of get_legal_jurisdiction for a whole DataFrame: the
+    ISO-3166-2 region for US entities (if given), the legal jurisdiction otherwise.
+    """
+    use_region = (lei_data[COL_JURISDICTION] == "US") & lei_data[COL_REGION].notnull()
+    return lei_data[COL_REGION].where(use_region, lei_data[COL_JURISDICTION])
+
+
+def iter_lei_cdf_data(url, jurisdictions=None, usecols=None, chunksize=100_000):
+    """
+    Read a zipped LEI CDF file chunk by chunk and yield DataFrames that have the
+    derived "Jurisdiction" column assigned and are filtered to the given
+    jurisdiction(s). Memory usage is bounded by the chunksize and the size of the
+    selected jurisdictions rather than by the size of the whole file.
+    """
+    if isinstance(jurisdictions, str):
+        jurisdictions = [jurisdictions]
+
+    reader = pandas.read_csv(
+        url,
+        compression="zip",
+        dtype=str,
+        na_values=[""],
+        keep_default_na=False,
+        usecols=usecols,
+        chunksize=chunksize,
+    )
+    with reader:
+        while True:
+            # the stages must not be open while the chunk is handed to the caller
+            with profile_stage("read_csv"):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+            with profile_stage("derive_legal_jurisdiction"):
+                chunk = chunk.assign(Jurisdiction=derive_legal_jurisdiction(chunk))
+            if jurisdictions is not None:
+                chunk = chunk[chunk["Jurisdiction"].isin(jurisdictions)]
+            yield chunk
+
+
+def load_lei_cdf_data_streaming(
+    url, jurisdictions=None, usecols=None, chunksize=100_000, compact=False
+):
+    """
+    Like load_lei_cdf_data, but only keeps the records of the given
+    jurisdiction(s) while streaming through the file (see iter_lei_cdf_data).
+    With compact=True, each chunk is converted by compact_lei_data.
+    """
+    chunks = []
+    for chunk in iter_lei_cdf_data(
+        url, jurisdictions=jurisdictions, usecols=usecols, chunksize=chunksize
+    ):
+        if compact:
+            with profile_stage("compact_lei_data"):
+                chunk = compact_lei_data(chunk)
+        chunks.append(chunk)
+    if not chunks:
+        # no records of the jurisdictions, but the same columns as otherwise
+        lei_data = pandas.read_csv(
+            url, compression="zip", dtype=str, usecols=usecols, nrows=0
+        ).assign(Jurisdiction=pandas.Series(dtype=object))
+        return compact_lei_data(lei_data) if compact else lei_data
+    with profile_stage("concat"):
+        if compact:
+            # categories differ between chunks, they have to be aligned for concat
+            for col in CATEGORICAL_COLUMNS:
+                if col in chunks[0]:
+                    categories = union_categoricals([c[col] for c in chunks]).categories
+                    chunks = [
+                        c.assign(**{col: c[col].cat.set_categories(categories)})
+                        for c in chunks
+                    ]
+        return pandas.concat(chunks)
+
+
+def convert_lei_cdf_to_parquet(url, target_dir, usecols, block_size=64 << 20):
+    """
+    Convert a zipped LEI CDF golden copy file into a parquet dataset that is
+    partitioned by the derived "Jurisdiction" column (see get_legal_jurisdiction).
+
+    The CSV is parsed block-wise by pyarrow's multi-threaded reader, so the whole
+    golden copy never needs to be held in memory. Requires pyarrow.
+    """
+    import pyarrow  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    import pyarrow.csv as pacsv  # type: ignore
+    import pyarrow.dataset as pads  # type: ignore
+
+    read_options = pacsv.ReadOptions(use_threads=True, block_size=block_size)
+    # legal names can contain (quoted) line breaks
+    parse_options = pacsv.ParseOptions(newlines_in_values=True)
+    convert_options = pacsv.ConvertOptions(
+        include_columns=usecols,
+        column_types={col: pyarrow.string() for col in usecols},
+        # same semantics as load_lei_cdf_data: only empty strings become null
+        null_values=[""],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=True,
+    )
+
+    with zipfile.ZipFile(url) as zf, zf.open(zf.namelist()[0]) as csv_file:
+        reader = pacsv.open_csv(
+            csv_file,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+        schema = reader.schema.append(
+            pyarrow.field(ROW_COLUMN, pyarrow.int64())
+        ).append(pyarrow.field("Jurisdiction", pyarrow.string()))
+
+        def batches():
+            row = 0
+            for batch in reader:
+                rows = pyarrow.array(
+                    numpy.arange(row, row + batch.num_rows, dtype=numpy.int64)
+                )
+                row += batch.num_rows
+                legal_jurisdiction = batch.column(COL_JURISDICTION)
+                region = batch.column(COL_REGION)
+                jurisdiction = pc.if_else(
+                    pc.and_(pc.equal(legal_jurisdiction, "US"), pc.is_valid(region)),
+                    region,
+                    legal_jurisdiction,
+                )
+                batch = pyarrow.RecordBatch.from_arrays(
+                    batch.columns + [rows, jurisdiction], schema=schema
+                )
+                yield batch.filter(pc.is_valid(jurisdiction))
+
+        pads.write_dataset(
+            batches(),
+            str(target_dir),
+            schema=schema,
+            format="parquet",
+            partitioning=pads.partitioning(
+                pyarrow.schema([("Jurisdiction", pyarrow.string())]), flavor="hive"
+            ),
+            max_partitions=4096,
+        )
+
+
+def load_lei_parquet_data(cache_dir, jurisdictions=None, usecols=None, compact=False):
+    """
+    Load the records of the given jurisdiction(s) from a parquet dataset written by
+    convert_lei_cdf_to_parquet. Only the matching partitions are read.
+    With compact=True, the columns are converted on the Arrow side already, so
+    that no intermediate python str objects are created (see compact_lei_data).
+    """
+    import pyarrow.dataset as pads  # type: ignore
+
+    if isinstance(jurisdictions, str):
+        jurisdictions = [jurisdictions]
+
+    with profile_stage("read_parquet"):
+        dataset = pads.dataset(str(cache_dir), format="parquet", partitioning="hive")
+        table = dataset.to_table(
+            columns=_parquet_columns(usecols),
+            filter=None
+            if jurisdictions is None
+            else pads.field("Jurisdiction").isin(jurisdictions),
+        )
+    with profile_stage("to_pandas"):
+        return _lei_parquet_to_pandas(table, compact)
+
+
+def _parquet_columns(usecols):
+    if usecols is None:
+        return None
+    return list(usecols) + [ROW_COLUMN, "Jurisdiction"]
+
+
+def _lei_parquet_to_pandas(table, compact=False):
+    """
+    Convert LEI records read from the parquet dataset into a DataFrame like
+    the one of the CSV loaders: in the order of the golden copy, indexed by
+    the row number, and with NaN (not None) for missing values.
+    """
+    import pyarrow  # type: ignore
+
+    if not compact:
+        lei_data = table.to_pandas()
+        lei_data = lei_data.where(lei_data.notnull(), numpy.nan)
+    else:
+        for i, name in enumerate(table.column_names):
+            if name in CATEGORICAL_COLUMNS:
+                table = table.set_column(i, name, table.column(i).dictionary_encode())
+        lei_data = table.to_pandas(
+            types_mapper={pyarrow.string(): pandas.StringDtype("pyarrow")}.get
+        )
+    return lei_data.set_index(ROW_COLUMN).rename_axis(None).sort_index()
+
+
+def iter_lei_parquet_data(
+    cache_dir, jurisdictions=None, usecols=None, chunksize=100_000
+):
+    """
+    Like load_lei_parquet_data, but yields DataFrames of at most chunksize
+    records instead of loading all matching records at once.
+    """
+    import pyarrow.dataset as pads  # type: ignore
+
+    if isinstance(jurisdictions, str):
+        jurisdictions = [jurisdictions]
+
+    dataset = pads.dataset(str(cache_dir), format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(
+        columns=_parquet_columns(usecols),
+        filter=None
+        if jurisdictions is None
+        else pads.field("Jurisdiction").isin(jurisdictions),
+        batch_size=chunksize,
+    ):
+        if batch.num_rows > 0:
+            yield _lei_parquet_to_pandas(batch)
+
+
+def apply_lei_cdf_delta_to_parquet(url, cache_dir, usecols):
+    """
+    Upsert the records of a zipped LEI CDF delta file into a parquet dataset
+    written by convert_lei_cdf_to_parquet, with the LEI as key. Only the
+    partitions of jurisdictions with new, changed or moved records are
+    rewritten. Requires pyarrow.
+
+    :return: number of records in the delta file
+    """
+    import pyarrow  # type: ignore
+    import pyarrow.compute as pc  # type: ignore
+    import pyarrow.dataset as pads  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    delta = load_lei_cdf_data(url, usecols=usecols).drop_duplicates("LEI", keep="last")
+    delta = delta.assign(Jurisdiction=derive_legal_jurisdiction(delta))
+    delta_leis = pyarrow.array(delta["LEI"], type=pyarrow.string())
+
+    dataset = pads.dataset(str(cache_dir), format="parquet", partitioning="hive")
+    # records can move between jurisdictions, their old partitions change as well
+    previous = dataset.to_table(
+        columns=["LEI", ROW_COLUMN, "Jurisdiction"],
+        filter=pads.field("LEI").isin(delta_leis),
+    ).to_pandas()
+    jurisdictions = set(previous["Jurisdiction"])
+    jurisdictions.update(delta["Jurisdiction"].dropna())
+
+    # changed records keep their row number, new records are appended
+    rows = delta["LEI"].map(previous.set_index("LEI")[ROW_COLUMN])
+    last_row = pc.max(dataset.to_table(columns=[ROW_COLUMN]).column(0)).as_py()
+    new = rows.isnull()
+    rows[new] = numpy.arange(new.sum()) + (-1 if last_row is None else last_row) + 1
+    delta[ROW_COLUMN] = rows.astype(numpy.int64)
+
+    columns = list(usecols) + [ROW_COLUMN]
+    for jurisdiction in sorted(jurisdictions):
+        kept = dataset.to_table(
+            columns=columns,
+            filter=(pads.field("Jurisdiction") == jurisdiction)
+            & ~pads.field("LEI").isin(delta_leis),
+        )
+        upserted = pyarrow.Table.from_pandas(
+            delta.loc[delta["Jurisdiction"] == jurisdiction, columns],
+            schema=kept.schema,
+            preserve_index=False,
+        )
+
+        partition_dir = cache_dir.joinpath(f"Jurisdiction={jurisdiction}")
+        partition_dir.mkdir(exist_ok=True)
+        # files starting with "_" are ignored when reading the dataset
+        tmp_file = partition_dir.joinpath("_part-0.parquet.tmp")
+        pq.write_table(pyarrow.concat_tables([kept, upserted]), tmp_file)
+        for old_file in partition_dir.glob("*.parquet"):
+            if old_file.name != "part-0.parquet":
+                old_file.unlink()
+        tmp_file.replace(partition_dir.joinpath("part-0.parquet"))
+
+    return len(delta)
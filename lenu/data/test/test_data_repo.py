@@ -0,0 +1,234 @@
+import json
+import logging
+import shutil
+import zipfile
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pandas  # type: ignore
+import pytest  # type: ignore
+
+from lenu.data import LEI_CACHE_MANIFEST, LEI_COLUMNS, LEI_DELTA_FILES, DataRepo
+from lenu.data.elf_codes import ELF_CODE_FILE_NAME
+from lenu.data.lei import convert_lei_cdf_to_parquet, load_lei_parquet_data
+from lenu.profiling import Profiler
+
+LEI_FILE_NAME = "20231001-0800-gleif-goldencopy-lei2-golden-copy.csv.zip"
+
+
+RECORDS = [
+    ["LEI1", "Hallo GmbH", "DE", "2HBR", "", "2023-01-01T00:00:00Z"],
+    ["LEI2", "Hello OHG", "DE", "8Z6G", "", "2023-01-02T00:00:00Z"],
+    ["LEI3", "Acme Inc.", "US", "XTIQ", "US-DE", "2023-01-03T00:00:00Z"],
+]
+
+
+def write_lei_file(path, records):
+    lei_data = pandas.DataFrame(records, columns=LEI_COLUMNS)
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr(path.name[:-4], lei_data.to_csv(index=False))
+    return path
+
+
+@pytest.fixture
+def data_repo(tmp_path):
+    write_lei_file(tmp_path.joinpath(LEI_FILE_NAME), RECORDS)
+    # only needs to exist
+    tmp_path.joinpath(ELF_CODE_FILE_NAME).write_text("")
+    return DataRepo(tmp_path)
+
+
+def publication(publish_date, delta_files):
+    """
+    The parts of a GoldenCopyFilePublication that update_lei_cache uses
+
+    :param delta_files: URL and local file by delta type, missing types are None
+    """
+
+    def file_ref(delta_type):
+        if delta_type not in delta_files:
+            return None
+        url, path = delta_files[delta_type]
+        return SimpleNamespace(csv=SimpleNamespace(url=url, size=path.stat().st_size))
+
+    return SimpleNamespace(
+        lei2=SimpleNamespace(
+            publish_date=publish_date,
+            delta_files=SimpleNamespace(
+                **{
+                    delta_type: file_ref(delta_type)
+                    for delta_type, _ in LEI_DELTA_FILES
+                }
+            ),
+        )
+    )
+
+
+def set_cache_publish_date(data_repo, publish_date):
+    manifest_file = data_repo.lei_cache_dir().joinpath(LEI_CACHE_MANIFEST)
+    manifest = json.loads(manifest_file.read_text())
+    manifest_file.write_text(
+        json.dumps({**manifest, "publish_date": publish_date.isoformat()})
+    )
+
+
+class TestLEICache:
+    def test_outdated_cache(self, data_repo, caplog):
+        pytest.importorskip("pyarrow")
+        data_repo.build_lei_cache()
+        with caplog.at_level(logging.WARNING):
+            expected = data_repo.load_lei_cdf_data("DE")
+        assert data_repo.lei_cache_ready()
+        assert not caplog.records
+
+        # e.g. built by a previous version of lenu
+        manifest_file = data_repo.lei_cache_dir().joinpath(LEI_CACHE_MANIFEST)
+        manifest = json.loads(manifest_file.read_text())
+        manifest_file.write_text(
+            json.dumps({**manifest, "format": 1, "columns": LEI_COLUMNS[:-1]})
+        )
+        with caplog.at_level(logging.WARNING):
+            lei_data = data_repo.load_lei_cdf_data("DE")
+            chunks = list(data_repo.iter_lei_cdf_data("DE"))
+
+        assert not data_repo.lei_cache_ready()
+        # read from the CSV file instead
+        pandas.testing.assert_frame_equal(lei_data, expected)
+        assert pandas.concat(chunks)["LEI"].tolist() == ["LEI1", "LEI2"]
+        assert len(caplog.records) == 2
+        assert "(different format, columns)" in caplog.records[0].message
+        assert "`lenu build-cache`" in caplog.records[0].message
+
+    def test_no_cache(self, data_repo, caplog):
+        with caplog.at_level(logging.WARNING):
+            lei_data = data_repo.load_lei_cdf_data(["US-DE"])
+
+        assert lei_data["LEI"].tolist() == ["LEI3"]
+        assert not caplog.records
+
+
+class TestLoadProfiling:
+    def profiled_stages(self, data_repo):
+        profiler = Profiler()
+        with profiler.activate():
+            data_repo.load_lei_cdf_data("DE")
+        return [s["stage"] for s in profiler.report()["stages"]]
+
+    def test_csv_stages(self, data_repo):
+        data_repo.compact = True
+        assert self.profiled_stages(data_repo) == [
+            "load_lei_cdf_data",
+            "load_lei_cdf_data/read_csv",
+            "load_lei_cdf_data/derive_legal_jurisdiction",
+            "load_lei_cdf_data/compact_lei_data",
+            "load_lei_cdf_data/concat",
+        ]
+
+    def test_parquet_stages(self, data_repo):
+        pytest.importorskip("pyarrow")
+        data_repo.build_lei_cache()
+        assert self.profiled_stages(data_repo) == [
+            "load_lei_cdf_data",
+            "load_lei_cdf_data/read_parquet",
+            "load_lei_cdf_data/to_pandas",
+        ]
+
+
+class TestLEICacheUpdate:
+    # publish date of LEI_FILE_NAME
+    CACHED = datetime(2023, 10, 1, 8, 0)
+
+    @pytest.fixture
+    def golden_copy(self, data_repo, tmp_path, monkeypatch):
+        """
+        Delta files published 16 hours after LEI_FILE_NAME, and the golden copy
+        after these changes
+        """
+        pytest.importorskip("pyarrow")
+        data_repo.build_lei_cache()
+
+        files = tmp_path.joinpath("gleif")
+        files.mkdir()
+        changes = [
+            # renamed
+            ["LEI2", "Hello Welt OHG", "DE", "8Z6G", "", "2023-10-01T12:00:00Z"],
+            # new
+            ["LEI4", "Bar KG", "DE", "8Z6G", "", "2023-10-01T13:00:00Z"],
+        ]
+        delta_files = {
+            # only changes of the last 8 hours, some are missing
+            "IntraDay": write_lei_file(files.joinpath("intraday.csv.zip"), changes[1:]),
+            "LastDay": write_lei_file(files.joinpath("lastday.csv.zip"), changes),
+            # would be applied if the cache was older than a day
+            "LastWeek": write_lei_file(files.joinpath("lastweek.csv.zip"), changes),
+        }
+        latest = publication(
+            # the API returns time zone aware dates
+            (self.CACHED + timedelta(hours=16)).replace(tzinfo=timezone.utc),
+            {
+                delta_type: (f"https://gleif.example/{path.name}", path)
+                for delta_type, path in delta_files.items()
+            },
+        )
+        downloads = []
+
+        def download_file(url, target, expected_size=None, **kwargs):
+            path = files.joinpath(url.rsplit("/", 1)[-1])
+            assert expected_size == path.stat().st_size
+            shutil.copy(path, target)
+            downloads.append(path.name)
+
+        monkeypatch.setattr(
+            "lenu.data.GoldenCopyFilePublications.fetch_latest", lambda self: latest
+        )
+        monkeypatch.setattr("lenu.data.download_file", download_file)
+
+        full_file = write_lei_file(
+            files.joinpath("full.csv.zip"),
+            [RECORDS[0], changes[0], RECORDS[2]] + changes[1:],
+        )
+        return downloads, full_file
+
+    def test_update(self, data_repo, golden_copy, tmp_path):
+        downloads, full_file = golden_copy
+        assert data_repo.lei_cache_publish_date() == self.CACHED
+
+        assert data_repo.update_lei_cache()
+
+        # the smallest delta file that covers the 16 hours
+        assert downloads == ["lastday.csv.zip"]
+        assert data_repo.lei_cache_publish_date() == self.CACHED + timedelta(hours=16)
+        assert data_repo.lei_cache_ready()
+        # the downloaded delta file is removed
+        assert not tmp_path.joinpath("lastday.csv.zip").exists()
+        # same records (and index) as the converted golden copy of that date
+        convert_lei_cdf_to_parquet(full_file, tmp_path.joinpath("full"), LEI_COLUMNS)
+        pandas.testing.assert_frame_equal(
+            data_repo.load_lei_cdf_data(None),
+            load_lei_parquet_data(tmp_path.joinpath("full"), usecols=LEI_COLUMNS),
+        )
+
+        # up to date, nothing is applied anymore
+        updated = data_repo.load_lei_cdf_data(None)
+        assert data_repo.update_lei_cache()
+        assert downloads == ["lastday.csv.zip"]
+        pandas.testing.assert_frame_equal(data_repo.load_lei_cdf_data(None), updated)
+
+    def test_update_older_cache(self, data_repo, golden_copy):
+        downloads, _ = golden_copy
+        set_cache_publish_date(data_repo, self.CACHED - timedelta(days=2))
+
+        assert data_repo.update_lei_cache()
+
+        assert downloads == ["lastweek.csv.zip"]
+        assert data_repo.lei_cache_publish_date() == self.CACHED + timedelta(hours=16)
+
+    def test_no_delta_file_covers_changes(self, data_repo, golden_copy):
+        downloads, _ = golden_copy
+        # the cache is older than the LastWeek delta file reaches back
+        publish_date = self.CACHED - timedelta(days=7)
+        set_cache_publish_date(data_repo, publish_date)
+
+        assert not data_repo.update_lei_cache()
+        assert downloads == []
+        assert data_repo.lei_cache_publish_date() == publish_date
@@ -0,0 +1,97 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest  # type: ignore
+
+from lenu.data.download import DownloadError, download_file
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.content with support for range requests. Range requests
+    starting at an offset in server.failing_offsets fail.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _headers(self, status, length):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, len(self.server.content))
+
+    def do_GET(self):
+        content = self.server.content
+        if "Range" not in self.headers:
+            self._headers(200, len(content))
+            self.wfile.write(content)
+            return
+
+        start, end = map(int, self.headers["Range"][len("bytes=") :].split("-"))
+        self.server.requested.append(start)
+        if start in self.server.failing_offsets:
+            self.send_error(500)
+            return
+        self._headers(206, end - start + 1)
+        self.wfile.write(content[start : end + 1])
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    server.content = os.urandom(10_000)
+    server.failing_offsets = set()
+    server.requested = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/lei.csv.zip"
+
+
+class TestDownloadFile:
+    def test_parallel_download(self, server, tmp_path):
+        target = tmp_path.joinpath("lei.csv.zip")
+        download_file(url(server), target, expected_size=10_000, part_size=1024)
+
+        assert target.read_bytes() == server.content
+        assert sorted(server.requested) == list(range(0, 10_000, 1024))
+        assert [p.name for p in tmp_path.iterdir()] == ["lei.csv.zip"]
+
+    def test_resume_after_failure(self, server, tmp_path):
+        target = tmp_path.joinpath("lei.csv.zip")
+        server.failing_offsets = {3072}
+        with pytest.raises(DownloadError):
+            download_file(url(server), target, part_size=1024, connections=1)
+        assert not target.exists()
+
+        server.failing_offsets = set()
+        server.requested = []
+        download_file(url(server), target, part_size=1024, connections=1)
+
+        assert target.read_bytes() == server.content
+        # only the failed part is requested again
+        assert server.requested == [3072]
+
+    def test_skip_existing_file(self, server, tmp_path):
+        target = tmp_path.joinpath("lei.csv.zip")
+        target.write_bytes(server.content)
+
+        download_file(url(server), target, expected_size=10_000)
+        assert server.requested == []
+
+    def test_size_mismatch(self, server, tmp_path):
+        target = tmp_path.joinpath("lei.csv.zip")
+        with pytest.raises(DownloadError):
+            download_file(url(server), target, expected_size=12_345)
+        assert list(tmp_path.iterdir()) == []
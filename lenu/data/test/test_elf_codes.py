@@ -0,0 +1,126 @@
+import pandas  # type: ignore
+
+from lenu.data.elf_codes import (
+    ELFAbbreviations,
+    ELFAbbreviationMatcher,
+    elf_code_index_file,
+    load_elf_code_list_index,
+)
+
+
+class TestELFAbbreviationMatcher:
+    abbreviations = ["AG", "GmbH", "GmbH & Co. KG", "KG", "mbH", "OHG mbH", "e.V."]
+    names = [
+        "Hallo GmbH",
+        "Hello OHG mbH",
+        "Müller GmbH & Co. KG",
+        "Kg Holding AG",
+        "GMBH",
+        " GmbH",
+        "Verein e.V.",
+        "Agrar Genossenschaft eG",
+        "",
+    ]
+
+    def test_matcher_is_equivalent_to_matches(self):
+        for use_lowercasing in [True, False]:
+            for use_endswith in [True, False]:
+                matcher = ELFAbbreviationMatcher(
+                    self.abbreviations, use_lowercasing, use_endswith
+                )
+                for name in self.names:
+                    expected = [
+                        i
+                        for i, abbr in enumerate(self.abbreviations)
+                        if ELFAbbreviations.matches(
+                            name, abbr, use_lowercasing, use_endswith
+                        )
+                    ]
+                    assert matcher.match(name) == expected, (
+                        name,
+                        use_lowercasing,
+                        use_endswith,
+                    )
+
+    def test_matcher_for_jurisdiction(self):
+        elf_abbr = ELFAbbreviations(
+            pandas.DataFrame(
+                [
+                    {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+                    {"Jurisdiction": "DE", "ELF Code": "40DB", "Abbreviation": "OHG"},
+                    {"Jurisdiction": "AT", "ELF Code": "AXSB", "Abbreviation": "GmbH"},
+                ]
+            )
+        )
+
+        assert elf_abbr.matcher("DE").match("Hallo OHG") == [1]
+        assert elf_abbr.matcher("AT").match("Hallo OHG") == []
+        assert elf_abbr.matcher("XX").match("Hallo OHG") == []
+
+
+ELF_CODE_LIST = "\n".join(
+    [
+        ",".join(
+            [
+                "ELF Code",
+                "Country Code (ISO 3166-1)",
+                "Country sub-division code (ISO 3166-2)",
+                "Entity Legal Form name Local name",
+                "Abbreviations Local language",
+                "ELF Status ACTV/INAC",
+            ]
+        ),
+        "2HBR,DE,,Gesellschaft mit beschränkter Haftung,GmbH,ACTV",
+        "8Z6G,DE,,Kommanditgesellschaft,KG,ACTV",
+        "OLD1,DE,,Alte Gesellschaft,,INAC",
+        "XTIQ,US,,National Association,N.A.;NA,ACTV",
+        "4FSX,US,US-DE,Limited Liability Company,LLC;L.L.C.,ACTV",
+        "T91T,US,US-NY,Corporation,,ACTV",
+        "",
+    ]
+)
+
+
+class TestELFCodeListIndex:
+    def test_compiled_index(self, tmp_path):
+        elf_code_list_file = tmp_path.joinpath("elf-code-list.csv")
+        elf_code_list_file.write_text(ELF_CODE_LIST)
+
+        index = load_elf_code_list_index(elf_code_list_file)
+        assert elf_code_index_file(elf_code_list_file).exists()
+        # the stored index is used the next time
+        for index in [index, load_elf_code_list_index(elf_code_list_file)]:
+            elf_abbr = index.get_abbreviations()
+            # federal abbreviations apply to all states, "US" is no jurisdiction
+            assert elf_abbr.jurisdictions() == ["DE", "US-DE", "US-NY"]
+            assert elf_abbr.abbreviations_for_jurisdiction("US-DE") == [
+                "L.L.C.",
+                "LLC",
+                "N.A.",
+                "NA",
+            ]
+            assert elf_abbr.abbreviations_for_jurisdiction("US-NY") == ["N.A.", "NA"]
+            assert elf_abbr.elf_codes_for_abbreviation("US-NY", "NA") == ["XTIQ"]
+            assert elf_abbr.abbreviations_for_jurisdiction("US") == []
+
+            assert index.get_inactive_elf_codes() == ["OLD1"]
+            names = index.get_names()["Entity Legal Form name Local name"]
+            assert names["8Z6G"] == "Kommanditgesellschaft"
+            assert len(names) == 6
+
+        # a changed file replaces the index
+        previous_index_file = elf_code_index_file(elf_code_list_file)
+        elf_code_list_file.write_text(ELF_CODE_LIST.replace("KG,ACTV", "KG,INAC"))
+        index = load_elf_code_list_index(elf_code_list_file)
+        assert sorted(index.get_inactive_elf_codes()) == ["8Z6G", "OLD1"]
+        assert not previous_index_file.exists()
+
+    def test_indexes_of_several_files(self, tmp_path):
+        files = [tmp_path.joinpath("elf-v1.csv"), tmp_path.joinpath("elf-v2.csv")]
+        files[0].write_text(ELF_CODE_LIST)
+        files[1].write_text(ELF_CODE_LIST.replace("KG,ACTV", "KG,INAC"))
+
+        for elf_code_list_file in files:
+            load_elf_code_list_index(elf_code_list_file)
+        # each file keeps its index
+        assert all(elf_code_index_file(f).exists() for f in files)
@@ -0,0 +1,176 @@
+import zipfile
+
+import numpy
+import pandas  # type: ignore
+import pytest  # type: ignore
+
+from lenu.data.lei import (
+    COL_ELF,
+    COL_JURISDICTION,
+    COL_LEGALNAME,
+    COL_REGION,
+    apply_lei_cdf_delta_to_parquet,
+    compact_string_dtype,
+    convert_lei_cdf_to_parquet,
+    iter_lei_parquet_data,
+    load_lei_cdf_data_streaming,
+    load_lei_parquet_data,
+)
+
+COLUMNS = ["LEI", COL_LEGALNAME, COL_JURISDICTION, COL_ELF, COL_REGION]
+
+
+def write_lei_cdf_file(path, records):
+    lei_data = pandas.DataFrame(
+        records, columns=COLUMNS + ["Registration.RegistrationStatus"]
+    )
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr(path.stem, lei_data.to_csv(index=False))
+    return path
+
+
+class TestLEIDelta:
+    def test_apply_delta(self, tmp_path):
+        pytest.importorskip("pyarrow")
+
+        full_file = write_lei_cdf_file(
+            tmp_path.joinpath("full.csv.zip"),
+            [
+                ["LEI1", "Hallo GmbH", "DE", "2HBR", "", "ISSUED"],
+                ["LEI2", "Hello OHG", "DE", "8Z6G", "", "ISSUED"],
+                ["LEI3", "Acme Inc.", "US", "XTIQ", "US-DE", "ISSUED"],
+                ["LEI4", "Foo AG", "AT", "AXSB", "", "ISSUED"],
+            ],
+        )
+        delta_file = write_lei_cdf_file(
+            tmp_path.joinpath("delta.csv.zip"),
+            [
+                # renamed
+                ["LEI1", "Hallo Welt GmbH", "DE", "2HBR", "", "ISSUED"],
+                # moved from US-DE to US-CA
+                ["LEI3", "Acme Inc.", "US", "XTIQ", "US-CA", "LAPSED"],
+                # new
+                ["LEI5", "Bar KG", "DE", "8Z6G", "", "ISSUED"],
+            ],
+        )
+
+        cache_dir = tmp_path.joinpath("cache")
+        convert_lei_cdf_to_parquet(full_file, cache_dir, usecols=COLUMNS)
+        at_file = cache_dir.joinpath("Jurisdiction=AT", "part-0.parquet")
+        at_mtime = at_file.stat().st_mtime_ns
+        records = apply_lei_cdf_delta_to_parquet(delta_file, cache_dir, COLUMNS)
+
+        assert records == 3
+        lei_data = load_lei_parquet_data(cache_dir, usecols=COLUMNS).set_index("LEI")
+        assert lei_data.sort_index()["Jurisdiction"].to_dict() == {
+            "LEI1": "DE",
+            "LEI2": "DE",
+            "LEI3": "US-CA",
+            "LEI4": "AT",
+            "LEI5": "DE",
+        }
+        assert lei_data.loc["LEI1", COL_LEGALNAME] == "Hallo Welt GmbH"
+        assert load_lei_parquet_data(cache_dir, "US-DE", usecols=COLUMNS).empty
+        # untouched partitions are not rewritten
+        assert at_file.stat().st_mtime_ns == at_mtime
+
+
+class TestLEIParquet:
+    def test_same_data_as_csv(self, tmp_path):
+        pytest.importorskip("pyarrow")
+
+        records = [
+            [
+                f"LEI{i}",
+                # quoted line breaks, also at the boundaries of the CSV blocks
+                f"Firma\n{i} GmbH" if i % 3 == 0 else f"Firma {i} KG",
+                "DE" if i % 2 else "US",
+                "2HBR" if i % 5 else "",
+                "" if i % 2 else "US-DE",
+                "ISSUED",
+            ]
+            for i in range(300)
+        ]
+        lei_file = write_lei_cdf_file(tmp_path.joinpath("full.csv.zip"), records)
+        cache_dir = tmp_path.joinpath("cache")
+        convert_lei_cdf_to_parquet(lei_file, cache_dir, COLUMNS, block_size=1000)
+
+        for jurisdictions in [None, "DE", ["DE", "US-DE"]]:
+            pandas.testing.assert_frame_equal(
+                load_lei_parquet_data(cache_dir, jurisdictions, usecols=COLUMNS),
+                load_lei_cdf_data_streaming(lei_file, jurisdictions, usecols=COLUMNS),
+            )
+        chunks = list(iter_lei_parquet_data(cache_dir, "DE", COLUMNS, chunksize=50))
+        pandas.testing.assert_frame_equal(
+            pandas.concat(chunks).sort_index(),
+            load_lei_cdf_data_streaming(lei_file, "DE", usecols=COLUMNS),
+        )
+
+
+class TestLEIStreaming:
+    def test_no_records(self, tmp_path, monkeypatch):
+        lei_file = write_lei_cdf_file(
+            tmp_path.joinpath("full.csv.zip"),
+            [["LEI1", "Hallo GmbH", "DE", "2HBR", "", "ISSUED"]],
+        )
+        empty_file = write_lei_cdf_file(tmp_path.joinpath("empty.csv.zip"), [])
+
+        for url, jurisdictions in [(lei_file, "FR"), (empty_file, None)]:
+            for usecols in [COLUMNS, None]:
+                lei_data = load_lei_cdf_data_streaming(url, jurisdictions, usecols)
+                assert lei_data.empty
+                assert list(lei_data.columns) == list(
+                    load_lei_cdf_data_streaming(lei_file, "DE", usecols).columns
+                )
+
+        # a reader that yields no chunks at all, e.g. for an empty file
+        monkeypatch.setattr("lenu.data.lei.iter_lei_cdf_data", lambda *a, **kw: [])
+        for compact in [False, True]:
+            lei_data = load_lei_cdf_data_streaming(
+                empty_file, usecols=COLUMNS, compact=compact
+            )
+            assert lei_data.empty
+            assert list(lei_data.columns) == COLUMNS + ["Jurisdiction"]
+
+
+class TestCompact:
+    def test_same_data_as_non_compact(self, tmp_path):
+        pytest.importorskip("pyarrow")
+
+        records = [
+            [
+                f"LEI{i}",
+                f"Firma {i} GmbH" if i % 7 else "",
+                ["DE", "US", "AT"][i % 3],
+                ["2HBR", "8Z6G", "", "AXSB"][i % 4],
+                "US-DE" if i % 3 == 1 and i % 2 else "",
+                "ISSUED",
+            ]
+            for i in range(100)
+        ]
+        lei_file = write_lei_cdf_file(tmp_path.joinpath("full.csv.zip"), records)
+        cache_dir = tmp_path.joinpath("cache")
+        convert_lei_cdf_to_parquet(lei_file, cache_dir, COLUMNS)
+
+        def load_parquet(compact):
+            return load_lei_parquet_data(cache_dir, usecols=COLUMNS, compact=compact)
+
+        def load_csv(compact):
+            # small chunks with different categories each
+            return load_lei_cdf_data_streaming(
+                lei_file, usecols=COLUMNS, chunksize=30, compact=compact
+            )
+
+        for load in [load_parquet, load_csv]:
+            lei_data, compact_lei_data = load(False), load(True)
+
+            assert compact_lei_data[COL_ELF].dtype == "category"
+            assert compact_lei_data["Jurisdiction"].dtype == "category"
+            assert compact_lei_data[COL_LEGALNAME].dtype == compact_string_dtype()
+            # same values, with NaN for missing values
+            pandas.testing.assert_frame_equal(
+                compact_lei_data.astype(object).where(
+                    compact_lei_data.notnull(), numpy.nan
+                ),
+                lei_data,
+            )
@@ -0,0 +1,3 @@
+# jurisdictions with fewer records are skipped by ModelRepo.train_many (defined
+# here, so that the command line interface does not need to import scikit-learn)
+DEFAULT_MIN_SAMPLES = 1000
@@ -0,0 +1,163 @@
+import json
+import shutil
+from pathlib import Path
+
+import numpy
+import pandas  # type: ignore
+from sklearn.compose import ColumnTransformer  # type: ignore
+from sklearn.feature_extraction.text import CountVectorizer  # type: ignore
+from sklearn.naive_bayes import ComplementNB  # type: ignore
+from sklearn.pipeline import Pipeline  # type: ignore
+
+from lenu.data.elf_codes import ELFAbbreviations
+from lenu.ml.features import (
+    HashingLegalNameFeaturizer,
+    LegalNameFeaturizer,
+    _identity,
+)
+
+# version of the model directory layout written by save_pipeline
+ARTIFACT_FORMAT = 1
+META_FILE = "meta.json"
+
+# fitted ComplementNB attributes that are stored as .npy files
+CLASSIFIER_ARRAYS = [
+    "class_count_",
+    "class_log_prior_",
+    "feature_count_",
+    "feature_all_",
+    "feature_log_prob_",
+]
+
+
+def _featurizer_settings(pipeline):
+    """
+    :return: the ELFAbbreviationTransformer or LegalNameFeaturizer that holds
+        the abbreviation settings, and the token vocabulary (None if hashed)
+    """
+    feature_extraction = pipeline.named_steps["feature_extraction"]
+    if isinstance(feature_extraction, ColumnTransformer):
+        # models stored before LegalNameFeaturizer, with the same features
+        return (
+            feature_extraction.named_transformers_["abbreviations"],
+            feature_extraction.named_transformers_["tokenizer"].vocabulary_,
+        )
+    if isinstance(feature_extraction, HashingLegalNameFeaturizer):
+        return feature_extraction, None
+    return feature_extraction, feature_extraction.vectorizer_.vocabulary_
+
+
+def _save_vocabulary(target_dir: Path, vocabulary: dict):
+    # all tokens (ordered by feature index) as UTF-8 text, and their offsets in
+    # characters, so that the text needs to be decoded only once when loading
+    tokens = sorted(vocabulary, key=vocabulary.__getitem__)
+    offsets = numpy.cumsum([0] + [len(token) for token in tokens], dtype=numpy.int64)
+    numpy.save(
+        target_dir.joinpath("vocabulary.npy"),
+        numpy.frombuffer("".join(tokens).encode("utf-8"), dtype=numpy.uint8),
+    )
+    numpy.save(target_dir.joinpath("vocabulary_offsets.npy"), offsets)
+
+
+def _load_vocabulary(model_dir: Path) -> dict:
+    text = numpy.load(model_dir.joinpath("vocabulary.npy")).tobytes().decode("utf-8")
+    offsets = numpy.load(model_dir.joinpath("vocabulary_offsets.npy")).tolist()
+    tokens = map(text.__getitem__, map(slice, offsets[:-1], offsets[1:]))
+    return dict(zip(tokens, range(len(offsets) - 1)))
+
+
+def save_pipeline(pipeline, target_dir: Path):
+    """
+    Store a fitted DefaultPipeline or HashingPipeline as a model directory:
+    meta.json with the settings, the abbreviations of the model's jurisdiction
+    and the data watermark, the vocabulary and the classifier arrays as .npy
+    files. Unlike a pickled pipeline, the directory does not contain the
+    abbreviations of all other jurisdictions.
+    """
+    featurizer, vocabulary = _featurizer_settings(pipeline)
+    classifier = pipeline.named_steps["classifier"]
+    jurisdiction = featurizer.jurisdiction
+    elf_abbreviations = featurizer.elf_abbreviations
+
+    meta = {
+        "format": ARTIFACT_FORMAT,
+        "jurisdiction": jurisdiction,
+        "use_endswith": featurizer.use_endswith,
+        "use_lowercasing": featurizer.use_lowercasing,
+        # [abbreviation, ELF Code] pairs
+        "elf_abbreviations": [
+            [abbr, elf_code]
+            for abbr in elf_abbreviations.abbreviations_for_jurisdiction(jurisdiction)
+            for elf_code in elf_abbreviations.elf_codes_for_abbreviation(
+                jurisdiction, abbr
+            )
+        ],
+        "n_features": None if vocabulary is not None else featurizer.n_features,
+        "classifier_params": classifier.get_params(),
+        "data_watermark": getattr(pipeline, "data_watermark_", None),
+    }
+
+    tmp_dir = target_dir.with_name(target_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    if vocabulary is not None:
+        _save_vocabulary(tmp_dir, vocabulary)
+    numpy.save(tmp_dir.joinpath("classes.npy"), classifier.classes_.astype(str))
+    for name in CLASSIFIER_ARRAYS:
+        numpy.save(tmp_dir.joinpath(f"{name[:-1]}.npy"), getattr(classifier, name))
+    with open(tmp_dir.joinpath(META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(target_dir, ignore_errors=True)
+    tmp_dir.rename(target_dir)
+
+
+def load_pipeline(model_dir: Path, mmap: bool = True) -> Pipeline:
+    """
+    Load a model directory written by save_pipeline. With mmap, the classifier
+    arrays are memory mapped instead of read into memory.
+    """
+    with open(model_dir.joinpath(META_FILE)) as f:
+        meta = json.load(f)
+    if meta["format"] != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported model format {meta['format']} in {model_dir}")
+
+    jurisdiction = meta["jurisdiction"]
+    elf_abbreviations = ELFAbbreviations(
+        pandas.DataFrame(
+            meta["elf_abbreviations"], columns=["Abbreviation", "ELF Code"]
+        ).assign(Jurisdiction=jurisdiction)
+    )
+    settings = dict(
+        elf_abbreviations=elf_abbreviations,
+        jurisdiction=jurisdiction,
+        use_endswith=meta["use_endswith"],
+        use_lowercasing=meta["use_lowercasing"],
+    )
+    if meta["n_features"] is not None:
+        featurizer = HashingLegalNameFeaturizer(
+            **settings, n_features=meta["n_features"]
+        )
+    else:
+        featurizer = LegalNameFeaturizer(**settings)
+        featurizer.vectorizer_ = CountVectorizer(analyzer=_identity, binary=True)
+        featurizer.vectorizer_.vocabulary_ = _load_vocabulary(model_dir)
+
+    classifier = ComplementNB(**meta["classifier_params"])
+    classifier.classes_ = numpy.load(model_dir.joinpath("classes.npy")).astype(object)
+    for name in CLASSIFIER_ARRAYS:
+        setattr(
+            classifier,
+            name,
+            numpy.load(
+                model_dir.joinpath(f"{name[:-1]}.npy"), mmap_mode="r" if mmap else None
+            ),
+        )
+    classifier.n_features_in_ = classifier.feature_count_.shape[1]
+
+    pipeline = Pipeline(
+        steps=[("feature_extraction", featurizer), ("classifier", classifier)]
+    )
+    pipeline.data_watermark_ = meta["data_watermark"]
+    return pipeline
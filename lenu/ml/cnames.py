@@ -1,7 +1,7 @@
 # coding=utf-8
 
+import re
 import unicodedata
-import numpy
 
 
 def _rmdiacritics(char):
@@ -10,7 +10,10 @@ def _rmdiacritics(char):
     diacritics like accents or curls and strokes and the like.
     '''
     # https://stackoverflow.com/a/15547803/3264997
-    desc = unicodedata.name(char)
+    try:
+        desc = unicodedata.name(char)
+    except ValueError:
+        return char  # character without a name, e.g. control characters
     cutoff = desc.find(' WITH ')
     if cutoff != -1:
         desc = desc[:cutoff]
@@ -21,67 +24,39 @@ def _rmdiacritics(char):
     return char
 
 
-def _replace_diacritics(s):
-    return "".join([_rmdiacritics(c) for c in s])
-
-
-def _replace_multi_spaces(s):
-    while "  " in s:
-        s = s.replace("  ", " ")
-    return s
-
-
-def _replace_double_quotation_marks(s):
-    return s.replace('"', " ")
-
-
-def _replace_trailing_non_alphanumeric_chars(s):
-    while s and not s[-1].isalnum():
-        s = s[0:-1]
-    return s
+class _DiacriticsTable(dict):
+    """
+    Translation table for str.translate that maps characters to their base
+    character. Latin characters are precomputed, others are added on first use.
+    """
 
+    def __missing__(self, codepoint):
+        base = self[codepoint] = _rmdiacritics(chr(codepoint))
+        return base
 
-def _correct_commas_and_periods(s):
-    s = s.replace(" ,", ",")
-    s = s.replace(" .", ".")
-    s = s.replace(", ", ",")
-    # s = s.replace(u'. ', u'.')
-    return s
 
+_diacritics_table = _DiacriticsTable(
+    # Latin-1 Supplement to Latin Extended-B
+    {codepoint: _rmdiacritics(chr(codepoint)) for codepoint in range(0x80, 0x250)}
+)
 
-# def _replace_spelling_variations(s):
-#    return s
 
-purge_rules = [
-    lambda x: x.replace(" l'", " l "),  # french example: 'L'Habitat'
-    lambda x: x.replace("-", " "),
-    lambda x: x.replace("(", " "),
-    lambda x: x.replace(")", " "),
-    # lambda x : x[4:] if x.startswith(u'the ') else x,
-    lambda x: x.replace(" & ", " and "),
-    lambda x: x.replace(" + ", " and "),
-    lambda x: x.replace(";", " "),
-    lambda x: x.replace("/", " "),
-    lambda x: x.replace(",", " "),
-]
+_multi_spaces = re.compile(" {2,}")
 
 
 def purge(s):
-    for rule in purge_rules:
-        s = rule(s)
-    return s
-
-
-steps = [
-    lambda x: x.lower(),
-    _replace_diacritics,
-    _replace_multi_spaces,
-    _replace_double_quotation_marks,
-    _replace_trailing_non_alphanumeric_chars,
-    _correct_commas_and_periods,
-    purge,
-    _replace_multi_spaces,
-]
+    # note: the order of the replacements matters
+    return (
+        s.replace(" l'", " l ")  # french example: 'L'Habitat'
+        .replace("-", " ")
+        .replace("(", " ")
+        .replace(")", " ")
+        .replace(" & ", " and ")
+        .replace(" + ", " and ")
+        .replace(";", " ")
+        .replace("/", " ")
+        .replace(",", " ")
+    )
 
 
 def harmonize(s):
@@ -89,12 +64,30 @@ def harmonize(s):
     Harmonization for company name matching inspired by
     http://citeseerx.ist.psu.edu/viewdoc/download?doi=10.1.1.95.6455&rep=rep1&type=pdf
     """
-    for step in steps:
-        try:
-            s = step(s)
-        except Exception as e:
-            raise Exception("Step failed: %s - %s" % (str(step), s), e)
-    return s
+    try:
+        s = s.lower()
+        # replace diacritics (ascii characters have none)
+        if not s.isascii():
+            s = s.translate(_diacritics_table)
+        # replace multi spaces
+        if "  " in s:
+            s = _multi_spaces.sub(" ", s)
+        # replace double quotation marks
+        s = s.replace('"', " ")
+        # remove trailing non alphanumeric chars
+        end = len(s)
+        while end and not s[end - 1].isalnum():
+            end -= 1
+        s = s[:end]
+        # correct commas and periods
+        s = s.replace(" ,", ",").replace(" .", ".").replace(", ", ",")
+        s = purge(s)
+        # replace multi spaces
+        if "  " in s:
+            s = _multi_spaces.sub(" ", s)
+        return s
+    except Exception as e:
+        raise Exception("Harmonization failed: %s" % s, e)
 
 
 _synonyms = {
@@ -120,11 +113,10 @@ def tokenize(s):
 
     # "Adding special case tokenization rules"
     # from https://spacy.io/usage/linguistic-features
-    s = harmonize(s).strip()
-    tokens = s.split(" ")
+    tokens = harmonize(s).strip().split(" ")
 
     # Spacy: use lemmatizer to put legal form surface forms into
     # lemmas (what I call synonyms here)
     # I imagine something like this: "Ltd." will be lemmatized as "limited".
     # https://spacy.io/usage/linguistic-features
-    return numpy.unique([_synonyms.get(token, token) for token in tokens])
+    return sorted({_synonyms.get(token, token) for token in tokens})
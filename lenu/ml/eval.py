@@ -1,31 +1,126 @@
+import logging
+import time
+
+import numpy
 import pandas  # type: ignore
-from lenu.data.lei import COL_ELF
+from lenu.data.lei import COL_ELF, COL_LEGALNAME
+from lenu.ml.features import HashingLegalNameFeaturizer, LegalNameFeaturizer
+from sklearn.base import BaseEstimator, TransformerMixin, clone  # type: ignore
 from sklearn.model_selection import (  # type: ignore
     cross_validate,
     StratifiedShuffleSplit,
 )
+from sklearn.pipeline import Pipeline  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SCORING = [
+    "accuracy",
+    "balanced_accuracy",
+    "f1_micro",
+    "f1_macro",
+    "f1_weighted",
+]
+
+
+class OccurringFeatures(BaseEstimator, TransformerMixin):
+    """
+    Keeps the first n_fixed columns of a feature matrix and, of the other
+    columns, only those that occur in the rows it is fitted on.
+
+    Applied to the LegalNameFeaturizer features of all records (with n_fixed
+    abbreviation features), this gives the same features as fitting the
+    LegalNameFeaturizer on the training records only, since the vocabulary
+    of the CountVectorizer is sorted in both cases.
+    """
+
+    def __init__(self, n_fixed=0):
+        self.n_fixed = n_fixed
+
+    def fit(self, X, y=None):
+        occurring = numpy.flatnonzero(X[:, self.n_fixed :].getnnz(axis=0))
+        self.columns_ = numpy.concatenate(
+            [numpy.arange(self.n_fixed), occurring + self.n_fixed]
+        )
+        return self
+
+    def transform(self, X):
+        return X[:, self.columns_]
 
 
-def evaluate_jurisdiction(jurisdiction_data, pipeline):
+def _cached_features(pipeline, X):
+    """
+    Compute the features of all records once, instead of in every fold.
 
-    X = jurisdiction_data
-    y = jurisdiction_data[COL_ELF]
+    :return: features and a pipeline that is trained on them with the same
+        results as pipeline on X, or None if the features depend on the
+        training data in a way that is not known
+    """
+    featurizer = pipeline.named_steps.get("feature_extraction")
+    if isinstance(featurizer, HashingLegalNameFeaturizer):
+        # stateless, all columns are kept
+        features = clone(featurizer).transform(X)
+        n_fixed = features.shape[1]
+    elif isinstance(featurizer, LegalNameFeaturizer):
+        features = clone(featurizer).fit_transform(X)
+        n_fixed = len(featurizer._abbreviations())
+    else:
+        return None, None
 
-    crossvalidation = StratifiedShuffleSplit(n_splits=10, test_size=0.3, random_state=0)
-    # try:
+    cached_pipeline = Pipeline(
+        steps=[
+            ("feature_selection", OccurringFeatures(n_fixed)),
+            ("classifier", pipeline.named_steps["classifier"]),
+        ]
+    )
+    return features, cached_pipeline
+
+
+def evaluate_jurisdiction(
+    jurisdiction_data,
+    pipeline,
+    n_splits=10,
+    test_size=0.3,
+    n_jobs=None,
+    return_estimator=False,
+    cache_features=True,
+):
+    """
+    Cross validate a pipeline on the LEI records of a jurisdiction with
+    n_splits StratifiedShuffleSplit folds, in n_jobs processes.
+
+    With cache_features, the names are harmonized and matched against the
+    abbreviations only once for all folds (see OccurringFeatures). This is
+    not possible if the fitted estimators are returned, they need to work
+    on legal names.
+
+    :return: DataFrame with the fit and score times and the train and test
+        scores of every fold
+    """
+    X = jurisdiction_data[[COL_LEGALNAME]].to_numpy(dtype=object)
+    y = jurisdiction_data[COL_ELF].to_numpy(dtype=object)
+
+    if cache_features and not return_estimator:
+        start = time.perf_counter()
+        features, cached_pipeline = _cached_features(pipeline, X)
+        if cached_pipeline is not None:
+            logger.info(
+                f"Features of {len(X)} records computed in "
+                f"{time.perf_counter() - start:.2f}s"
+            )
+            X, pipeline = features, cached_pipeline
+
+    crossvalidation = StratifiedShuffleSplit(
+        n_splits=n_splits, test_size=test_size, random_state=0
+    )
     results = cross_validate(
         pipeline,
         X,
         y,
         cv=crossvalidation,
-        scoring=[
-            "accuracy",
-            "balanced_accuracy",
-            "f1_micro",
-            "f1_macro",
-            "f1_weighted",
-        ],
+        scoring=SCORING,
+        n_jobs=n_jobs,
         return_train_score=True,
-        return_estimator=True,
+        return_estimator=return_estimator,
     )
-    return pandas.Series(results)
+    return pandas.DataFrame(results).rename_axis("fold")
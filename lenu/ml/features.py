@@ -1,7 +1,35 @@
+from typing import Optional
+
 import numpy
 import pandas  # type: ignore
-from lenu.data.elf_codes import ELFAbbreviations
-from sklearn.base import TransformerMixin  # type: ignore
+from joblib import Parallel, delayed  # type: ignore
+from lenu.data.elf_codes import ELFAbbreviations, ELFAbbreviationMatcher
+from lenu.ml.cnames import tokenize
+from lenu.ml.tokencache import TokenCache
+from scipy import sparse  # type: ignore
+from sklearn.base import BaseEstimator, TransformerMixin  # type: ignore
+from sklearn.feature_extraction.text import (  # type: ignore
+    CountVectorizer,
+    HashingVectorizer,
+)
+
+# number of distinct names from which on LegalNameFeaturizer uses several processes
+PARALLEL_MIN_NAMES = 50_000
+# number of columns the tokens are hashed into by HashingLegalNameFeaturizer
+DEFAULT_HASH_FEATURES = 2**18
+
+
+def _abbreviation_matrix(matches, n_abbreviations):
+    # build the CSR structure directly, one row per list of matching abbreviations
+    indices = []
+    indptr = [0]
+    for m in matches:
+        indices.extend(m)
+        indptr.append(len(indices))
+    return sparse.csr_matrix(
+        (numpy.ones(len(indices), dtype=numpy.int64), indices, indptr),
+        shape=(len(indptr) - 1, n_abbreviations),
+    )
 
 
 class ELFAbbreviationTransformer(TransformerMixin):
@@ -26,22 +54,19 @@ class ELFAbbreviationTransformer(TransformerMixin):
             self.jurisdiction
         )
 
-        predictions = []
-        for name in X:
-            pred = []  # list can end up empty
-            for abbr in abbreviations:
-                if self.elf_abbreviations.matches(
-                    name, abbr, self.use_lowercasing, self.use_endswith
-                ):
-                    pred.append(1)
-                else:
-                    pred.append(0)
+        matcher = self.elf_abbreviations.matcher(
+            self.jurisdiction, self.use_lowercasing, self.use_endswith
+        )
+
+        return _abbreviation_matrix(
+            (matcher.match(name) for name in X), len(abbreviations)
+        )
 
-            predictions.append(pred)  # list can be empty
-        return pandas.DataFrame(
-            numpy.array(predictions),
-            columns=[f"abbr({abbr})" for abbr in abbreviations],
+    def get_feature_names_out(self, input_features=None):
+        abbreviations = self.elf_abbreviations.abbreviations_for_jurisdiction(
+            self.jurisdiction
         )
+        return numpy.array([f"abbr({abbr})" for abbr in abbreviations], dtype=object)
 
     def get_params(self, **kwargs):
         return {
@@ -50,3 +75,217 @@ class ELFAbbreviationTransformer(TransformerMixin):
             "use_endswith": self.use_endswith,
             "use_lowercasing": self.use_lowercasing,
         }
+
+
+def _identity(tokens):
+    return tokens
+
+
+def _match_names(names, matcher: ELFAbbreviationMatcher):
+    return [matcher.match(name) for name in names]
+
+
+def _tokenize_names(names):
+    return [tokenize(name) for name in names]
+
+
+class LegalNameFeaturizer(BaseEstimator, TransformerMixin):
+    """
+    Computes the features of ELFAbbreviationTransformer and of a CountVectorizer
+    with the cnames.tokenize tokenizer in one pass over a column of legal names:
+    every distinct name is matched and harmonized only once (optionally in
+    n_jobs processes), and both sparse feature blocks are built from that result.
+
+    With a token_cache (see lenu.ml.tokencache), only names that are not in the
+    cache yet are tokenized.
+    """
+
+    def __init__(
+        self,
+        elf_abbreviations: ELFAbbreviations,
+        jurisdiction: str,
+        use_endswith=True,
+        use_lowercasing=True,
+        n_jobs=None,
+        token_cache: Optional[TokenCache] = None,
+    ):
+        self.elf_abbreviations = elf_abbreviations
+        self.jurisdiction = jurisdiction
+        self.use_endswith = use_endswith
+        self.use_lowercasing = use_lowercasing
+        self.n_jobs = n_jobs
+        self.token_cache = token_cache
+
+    @staticmethod
+    def _names(X):
+        # accepts a column of names as well as 2d inputs with names in column 0
+        if isinstance(X, pandas.DataFrame):
+            X = X.iloc[:, 0]
+        elif isinstance(X, numpy.ndarray) and X.ndim == 2:
+            X = X[:, 0]
+        return pandas.Series(X, dtype=object)
+
+    def _abbreviations(self):
+        return self.elf_abbreviations.abbreviations_for_jurisdiction(self.jurisdiction)
+
+    def _map(self, func, names, *args):
+        # applies func to batches of names, in several processes for large inputs
+        if self.n_jobs in (None, 1) or len(names) < PARALLEL_MIN_NAMES:
+            return func(names, *args)
+
+        batches = numpy.array_split(
+            numpy.asarray(names, dtype=object), 4 * abs(self.n_jobs)
+        )
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(func)(batch, *args) for batch in batches
+        )
+        return [r for batch_results in results for r in batch_results]
+
+    def _featurize(self, X):
+        """
+        :return: codes of the names (see pandas.factorize), abbreviation feature
+            matrix and token lists of the distinct names
+        """
+        codes, unique_names = pandas.factorize(self._names(X))
+        if (codes < 0).any():
+            # factorize gives them code -1, which would select the last name
+            raise ValueError("Legal names must not be missing (NaN or None)")
+        matcher = self.elf_abbreviations.matcher(
+            self.jurisdiction, self.use_lowercasing, self.use_endswith
+        )
+
+        matches = self._map(_match_names, unique_names, matcher)
+
+        if self.token_cache is None:
+            tokens = self._map(_tokenize_names, unique_names)
+        else:
+            missing = self.token_cache.missing(self.jurisdiction, unique_names)
+            self.token_cache.update(
+                self.jurisdiction, missing, self._map(_tokenize_names, missing)
+            )
+            tokens = self.token_cache.get(self.jurisdiction, unique_names)
+
+        abbreviation_features = _abbreviation_matrix(
+            matches, len(self._abbreviations())
+        )
+        return codes, abbreviation_features, tokens
+
+    def fit(self, X, y=None):
+        self.fit_transform(X, y)
+        return self
+
+    def fit_transform(self, X, y=None):
+        codes, abbreviation_features, tokens = self._featurize(X)
+        # binary features: fitting on distinct names gives the same vocabulary
+        self.vectorizer_ = CountVectorizer(analyzer=_identity, binary=True)
+        token_features = self.vectorizer_.fit_transform(tokens)
+        return sparse.hstack([abbreviation_features, token_features], format="csr")[
+            codes
+        ]
+
+    def partial_fit(self, X, y=None):
+        self.partial_fit_transform(X, y)
+        return self
+
+    def partial_fit_transform(self, X, y=None):
+        """
+        Like fit_transform, but a fitted featurizer keeps its vocabulary and
+        only appends the tokens it has not seen yet. The existing features keep
+        their columns, new token features are added at the end.
+        """
+        if not hasattr(self, "vectorizer_"):
+            return self.fit_transform(X, y)
+
+        codes, abbreviation_features, tokens = self._featurize(X)
+        vocabulary = self.vectorizer_.vocabulary_
+        new_tokens = sorted(
+            {t for name_tokens in tokens for t in name_tokens} - vocabulary.keys()
+        )
+        for index, token in enumerate(new_tokens, start=len(vocabulary)):
+            vocabulary[token] = index
+        token_features = self.vectorizer_.transform(tokens)
+        return sparse.hstack([abbreviation_features, token_features], format="csr")[
+            codes
+        ]
+
+    def transform(self, X):
+        codes, abbreviation_features, tokens = self._featurize(X)
+        token_features = self.vectorizer_.transform(tokens)
+        return sparse.hstack([abbreviation_features, token_features], format="csr")[
+            codes
+        ]
+
+    def get_feature_names_out(self, input_features=None):
+        return numpy.array(
+            [f"abbreviations__abbr({abbr})" for abbr in self._abbreviations()]
+            + [
+                f"tokenizer__{token}"
+                for token in self.vectorizer_.get_feature_names_out()
+            ],
+            dtype=object,
+        )
+
+
+class HashingLegalNameFeaturizer(LegalNameFeaturizer):
+    """
+    Like LegalNameFeaturizer, but tokens are hashed into n_features columns by a
+    HashingVectorizer instead of being looked up in a fitted vocabulary. The
+    abbreviation features are given by the ELF Code list already, so the
+    featurizer has no state that depends on the data and can be applied to
+    chunks of data one by one (e.g. for ComplementNB.partial_fit).
+
+    More columns mean fewer tokens sharing a column, but larger models.
+    """
+
+    def __init__(
+        self,
+        elf_abbreviations: ELFAbbreviations,
+        jurisdiction: str,
+        use_endswith=True,
+        use_lowercasing=True,
+        n_jobs=None,
+        token_cache: Optional[TokenCache] = None,
+        n_features=DEFAULT_HASH_FEATURES,
+    ):
+        super().__init__(
+            elf_abbreviations,
+            jurisdiction,
+            use_endswith=use_endswith,
+            use_lowercasing=use_lowercasing,
+            n_jobs=n_jobs,
+            token_cache=token_cache,
+        )
+        self.n_features = n_features
+
+    def _vectorizer(self):
+        # non-negative counts, as required by ComplementNB
+        return HashingVectorizer(
+            analyzer=_identity,
+            n_features=self.n_features,
+            binary=True,
+            norm=None,
+            alternate_sign=False,
+        )
+
+    def fit(self, X, y=None):
+        return self
+
+    def fit_transform(self, X, y=None):
+        return self.transform(X)
+
+    def partial_fit_transform(self, X, y=None):
+        return self.transform(X)
+
+    def transform(self, X):
+        codes, abbreviation_features, tokens = self._featurize(X)
+        token_features = self._vectorizer().transform(tokens)
+        return sparse.hstack([abbreviation_features, token_features], format="csr")[
+            codes
+        ]
+
+    def get_feature_names_out(self, input_features=None):
+        return numpy.array(
+            [f"abbreviations__abbr({abbr})" for abbr in self._abbreviations()]
+            + [f"tokenizer__hash{i}" for i in range(self.n_features)],
+            dtype=object,
+        )
@@ -1,3 +1,5 @@
+from operator import itemgetter
+
 import pandas  # type: ignore
 from lenu.data.elf_codes import ELFAbbreviations
 from sklearn.base import (  # type: ignore
@@ -21,46 +23,54 @@ class ELFAbbreviationClassifier(BaseEstimator, ClassifierMixin):
     def _get_jurisdiction_from_input(self, X):
         return X["Jurisdiction"].iloc[0]
 
-    def fit(self, _, y):
+    def fit(self, X, y):
         self.frequencies_ = pandas.value_counts(y)
         self.most_frequent_ = self.frequencies_.idxmax()
+        jurisdictions = X["Jurisdiction"].unique() if "Jurisdiction" in X else []
+        self.abbreviation_tables_ = {
+            jurisdiction: self._abbreviation_table(jurisdiction)
+            for jurisdiction in jurisdictions
+        }
         return self
 
-    def _best_elf_code_for_abbr(self, jurisdiction, name, abbr):
-        if self.elf_abbreviations.matches(
-            name, abbr, self.use_lowercasing, self.use_endswith
-        ):
-            elf_codes = self.elf_abbreviations.elf_codes_for_abbreviation(
-                jurisdiction, abbr
-            )
-            pred = max(
-                elf_codes, key=lambda elf_code: self.frequencies_.get(elf_code, 0)
+    def _abbreviation_table(self, jurisdiction):
+        """
+        For each abbreviation of the jurisdiction, the ELF code that is predicted
+        if the abbreviation matches, together with its priority (frequency).
+        """
+        frequencies = self.frequencies_.to_dict()
+        table = []
+        for abbr in self.elf_abbreviations.abbreviations_for_jurisdiction(jurisdiction):
+            elf_code = max(
+                self.elf_abbreviations.elf_codes_for_abbreviation(jurisdiction, abbr),
+                key=lambda elf_code: frequencies.get(elf_code, 0),
             )
-            return pred
-        else:
-            return None
+            table.append((elf_code, frequencies.get(elf_code, 0)))
+        return table
 
     def predict(self, data):
         check_is_fitted(self, ["frequencies_", "most_frequent_"])
 
         jurisdiction = self._get_jurisdiction_from_input(data)
 
-        abbreviations = self.elf_abbreviations.abbreviations_for_jurisdiction(
-            jurisdiction
+        # predict does not modify the model (it may be used by several threads),
+        # jurisdictions not seen by fit and models stored before the tables
+        # were introduced get a table for this call only
+        table = getattr(self, "abbreviation_tables_", {}).get(jurisdiction)
+        if table is None:
+            table = self._abbreviation_table(jurisdiction)
+        matcher = self.elf_abbreviations.matcher(
+            jurisdiction, self.use_lowercasing, self.use_endswith
         )
+        default = (self.most_frequent_, 0)
 
-        predictions = []
-        for name in data["Entity.LegalName"]:
-            potential_elf_codes = [
-                self._best_elf_code_for_abbr(jurisdiction, name, abbr)
-                for abbr in abbreviations
-            ]
-
-            pred = max(
-                [elf_code for elf_code in potential_elf_codes if elf_code is not None],
-                key=lambda elf_code: self.frequencies_.get(elf_code, 0),
-                default=self.most_frequent_,
-            )
-
-            predictions.append(pred)
-        return predictions
+        # the first of the matching abbreviations with the highest priority wins
+        predictions_by_name = {
+            name: max(
+                (table[i] for i in matcher.match(name)),
+                key=itemgetter(1),
+                default=default,
+            )[0]
+            for name in data["Entity.LegalName"].unique()
+        }
+        return [predictions_by_name[name] for name in data["Entity.LegalName"]]
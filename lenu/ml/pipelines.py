@@ -1,41 +1,49 @@
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import List, Optional
 
 import joblib  # type: ignore
 import numpy
 import pandas  # type: ignore
-from sklearn.compose import ColumnTransformer  # type: ignore
-from sklearn.feature_extraction.text import CountVectorizer  # type: ignore
 from sklearn.metrics import accuracy_score, balanced_accuracy_score  # type: ignore
 from sklearn.model_selection import train_test_split  # type: ignore
 from sklearn.naive_bayes import ComplementNB  # type: ignore
 from sklearn.pipeline import Pipeline  # type: ignore
 
-from lenu.data import DataRepo, ELFAbbreviations, ELFCodeList
-from lenu.data.lei import COL_LEGALNAME, COL_ELF
-from lenu.ml.cnames import tokenize
-from lenu.ml.features import ELFAbbreviationTransformer
+from lenu.data import DataRepo, ELFAbbreviations, ELFCodeListIndex
+from lenu.data.lei import COL_LEGALNAME, COL_ELF, COL_LAST_UPDATE
+from lenu.ml import DEFAULT_MIN_SAMPLES
+from lenu.ml.artifact import META_FILE, load_pipeline, save_pipeline
+from lenu.ml.features import (
+    DEFAULT_HASH_FEATURES,
+    HashingLegalNameFeaturizer,
+    LegalNameFeaturizer,
+)
+from lenu.ml.tokencache import TokenCache
+from lenu.profiling import profile_stage
+from lenu.util import top_elf_codes
 
 logger = logging.getLogger(__name__)
 
-
-def DefaultPipeline(elf_abbreviations: ELFAbbreviations, jurisdiction: str):
-    feature_extractor = ColumnTransformer(
-        transformers=[
-            (
-                "abbreviations",
-                ELFAbbreviationTransformer(
-                    elf_abbreviations=elf_abbreviations,
-                    jurisdiction=jurisdiction,
-                ),
-                0,  # column nr
-            ),
-            (
-                "tokenizer",
-                CountVectorizer(tokenizer=tokenize, lowercase=False, binary=True),
-                0,  # column nr
-            ),
-        ]
+# number of records per chunk of ModelRepo.train_out_of_core
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def DefaultPipeline(
+    elf_abbreviations: ELFAbbreviations,
+    jurisdiction: str,
+    n_jobs=None,
+    token_cache: Optional[TokenCache] = None,
+):
+    # abbreviation and token features (see ELFAbbreviationTransformer and
+    # CountVectorizer with cnames.tokenize) from a single pass over the names
+    feature_extractor = LegalNameFeaturizer(
+        elf_abbreviations=elf_abbreviations,
+        jurisdiction=jurisdiction,
+        n_jobs=n_jobs,
+        token_cache=token_cache,
     )
     pipeline_extPrep = Pipeline(
         steps=[
@@ -46,12 +54,38 @@ def DefaultPipeline(elf_abbreviations: ELFAbbreviations, jurisdiction: str):
     return pipeline_extPrep
 
 
+def HashingPipeline(
+    elf_abbreviations: ELFAbbreviations,
+    jurisdiction: str,
+    n_features=DEFAULT_HASH_FEATURES,
+    n_jobs=None,
+):
+    # like DefaultPipeline, but with a fixed, data independent feature space
+    # (see HashingLegalNameFeaturizer) that allows training chunk by chunk
+    feature_extractor = HashingLegalNameFeaturizer(
+        elf_abbreviations=elf_abbreviations,
+        jurisdiction=jurisdiction,
+        n_jobs=n_jobs,
+        n_features=n_features,
+    )
+    return Pipeline(
+        steps=[
+            ("feature_extraction", feature_extractor),
+            ("classifier", ComplementNB()),
+        ]
+    )
+
+
 def filter_infrequent_elf_codes(jurisdiction_data):
     # This fixes:
     # "ValueError: The least populated class in y has only 1 member, which is too few."
-    filtered = jurisdiction_data.groupby(COL_ELF).filter(lambda x: len(x) >= 2)
+    with profile_stage("filter_infrequent_elf_codes"):
+        counts = jurisdiction_data[COL_ELF].value_counts()
+        filtered = jurisdiction_data[
+            jurisdiction_data[COL_ELF].isin(counts[counts >= 2].index)
+        ]
 
-    removed = jurisdiction_data[~jurisdiction_data[COL_ELF].isin(filtered[COL_ELF])]
+        removed = jurisdiction_data[~jurisdiction_data[COL_ELF].isin(filtered[COL_ELF])]
     if len(removed) > 0:
         removed_elfs = list(removed[COL_ELF].unique())
         logger.warning(
@@ -61,23 +95,31 @@ def filter_infrequent_elf_codes(jurisdiction_data):
     return filtered
 
 
-def filter_inactive_elf_codes(jurisdiction_data, elf_code_list: ELFCodeList):
-    return jurisdiction_data[
-        ~jurisdiction_data[COL_ELF].isin(elf_code_list.get_inactive_elf_codes())
-    ]
+def filter_inactive_elf_codes(jurisdiction_data, elf_code_list: ELFCodeListIndex):
+    with profile_stage("filter_inactive_elf_codes"):
+        return jurisdiction_data[
+            ~jurisdiction_data[COL_ELF].isin(elf_code_list.get_inactive_elf_codes())
+        ]
 
 
 def train_for_jurisdiction(jurisdiction_data, pipeline, test_size=1.0 / 3):
 
-    X = jurisdiction_data[[COL_LEGALNAME]].values
-    y = jurisdiction_data[COL_ELF].values
+    # plain object arrays, also for compact (categorical / Arrow string) columns
+    X = jurisdiction_data[[COL_LEGALNAME]].to_numpy(dtype=object)
+    y = jurisdiction_data[COL_ELF].to_numpy(dtype=object)
 
     # The minimum number of groups for any class cannot be less than 2.
     X_train, X_test, y_train, y_test = train_test_split(X, y, stratify=y)
 
-    pipeline.fit(X_train, y_train)
-
-    y_pred = pipeline.predict(X_test)
+    # same as pipeline.fit and pipeline.predict, in stages
+    featurizer, classifier = pipeline[:-1], pipeline[-1]
+    with profile_stage("feature_extraction"):
+        features_train = featurizer.fit_transform(X_train, y_train)
+        features_test = featurizer.transform(X_test)
+    with profile_stage("fit"):
+        classifier.fit(features_train, y_train)
+    with profile_stage("predict"):
+        y_pred = classifier.predict(features_test)
 
     accuracy = accuracy_score(y_true=y_test, y_pred=y_pred)
     logger.info(f"Model Accuracy: {accuracy}")
@@ -87,6 +129,122 @@ def train_for_jurisdiction(jurisdiction_data, pipeline, test_size=1.0 / 3):
     return pipeline
 
 
+def _holdout(lei_data, test_size=1.0 / 3):
+    # records are held out by the hash of their LEI, independent of the chunks
+    hashes = pandas.util.hash_pandas_object(lei_data["LEI"], index=False).to_numpy()
+    return hashes % 1000 < test_size * 1000
+
+
+def train_for_jurisdiction_out_of_core(chunks, pipeline, classes, test_size=1.0 / 3):
+    """
+    Train a HashingPipeline with partial_fit, one chunk of records at a time,
+    and evaluate it on the records held out by _holdout.
+
+    :param chunks: callable that returns a new iterator over the chunks
+    :param classes: all ELF Codes of the chunks
+    :return: the pipeline (with the data_watermark_ of all chunks) and the
+        number of training records
+    """
+    featurizer = pipeline.named_steps["feature_extraction"]
+    classifier = pipeline.named_steps["classifier"]
+
+    nsamples = 0
+    watermarks = []
+    for chunk in chunks():
+        watermarks.append(data_watermark(chunk))
+        train = chunk[~_holdout(chunk, test_size)]
+        if len(train) == 0:
+            continue
+        with profile_stage("feature_extraction"):
+            features = featurizer.transform(
+                train[[COL_LEGALNAME]].to_numpy(dtype=object)
+            )
+        with profile_stage("fit"):
+            classifier.partial_fit(
+                features, train[COL_ELF].to_numpy(dtype=object), classes=classes
+            )
+        nsamples += len(train)
+    watermarks = [w for w in watermarks if w is not None]
+    pipeline.data_watermark_ = (
+        max(watermarks, key=pandas.Timestamp) if watermarks else None
+    )
+
+    # per class counts instead of all predictions, to keep memory bounded
+    correct = pandas.Series(0, index=classes)
+    total = pandas.Series(0, index=classes)
+    for chunk in chunks():
+        test = chunk[_holdout(chunk, test_size)]
+        if len(test) == 0:
+            continue
+        y_test = test[COL_ELF].to_numpy(dtype=object)
+        with profile_stage("predict"):
+            y_pred = pipeline.predict(test[[COL_LEGALNAME]].to_numpy(dtype=object))
+        total = total.add(pandas.value_counts(y_test), fill_value=0)
+        correct = correct.add(
+            pandas.value_counts(y_test[y_test == y_pred]), fill_value=0
+        )
+
+    if total.sum() > 0:
+        logger.info(f"Model Accuracy: {correct.sum() / total.sum()}")
+        recall = correct[total > 0] / total[total > 0]
+        logger.info(f"Model Balanced Accuracy: {recall.mean()}")
+
+    return pipeline, nsamples
+
+
+def _last_update(lei_data):
+    return pandas.to_datetime(lei_data[COL_LAST_UPDATE], utc=True, errors="coerce")
+
+
+def data_watermark(lei_data) -> Optional[str]:
+    """
+    Latest Registration.LastUpdateDate of the given LEI records (ISO format, UTC),
+    or None if it is not known.
+    """
+    if COL_LAST_UPDATE not in lei_data:
+        return None
+    watermark = _last_update(lei_data).max()
+    return None if pandas.isnull(watermark) else watermark.isoformat()
+
+
+def _extend_classifier(classifier: ComplementNB, n_features, classes):
+    """
+    Add zero counts for new features (appended at the end) and new classes to
+    a fitted ComplementNB, so that partial_fit accepts them.
+    """
+    all_classes = numpy.union1d(classifier.classes_, classes)
+    rows = numpy.searchsorted(all_classes, classifier.classes_)
+
+    feature_count = numpy.zeros((len(all_classes), n_features))
+    feature_count[
+        rows, : classifier.feature_count_.shape[1]
+    ] = classifier.feature_count_
+    class_count = numpy.zeros(len(all_classes))
+    class_count[rows] = classifier.class_count_
+
+    classifier.classes_ = all_classes
+    classifier.class_count_ = class_count
+    classifier.feature_count_ = feature_count
+    classifier.feature_all_ = feature_count.sum(axis=0)
+    classifier.n_features_in_ = n_features
+
+
+def update_for_jurisdiction(update_data, pipeline):
+    """
+    Update a fitted DefaultPipeline with additional records: the vocabulary is
+    extended by their new tokens and their counts are added to the classifier.
+    """
+    X = update_data[[COL_LEGALNAME]].to_numpy(dtype=object)
+    y = update_data[COL_ELF].to_numpy(dtype=object)
+
+    features = pipeline.named_steps["feature_extraction"].partial_fit_transform(X)
+    classifier = pipeline.named_steps["classifier"]
+    _extend_classifier(classifier, features.shape[1], numpy.unique(y))
+    classifier.partial_fit(features, y)
+
+    return pipeline
+
+
 class ELFDetectionModel:
     def __init__(self, jurisdiction, pipeline):
         self.jurisdiction = jurisdiction
@@ -97,59 +255,326 @@ class ELFDetectionModel:
         input = numpy.array([[legal_name]])
 
         # do the prediction
+        with profile_stage("predict"):
+            probabilities = self.pipeline.predict_proba(input)[0]
         elf_probabilities = (
-            pandas.Series(
-                self.pipeline.predict_proba(input)[0], index=self.pipeline.classes_
-            )
+            pandas.Series(probabilities, index=self.pipeline.classes_)
             .sort_values(ascending=False)
             .head(top)
         )
 
         return elf_probabilities
 
+    def detect_batch(self, legal_names, top=3) -> pandas.DataFrame:
+        """
+        Detect ELF Codes for many legal names with a single predict_proba call.
+        See lenu.util.top_elf_codes for the result.
+        """
+        input = numpy.asarray(legal_names, dtype=object).reshape(-1, 1)
+        with profile_stage("predict"):
+            probabilities = self.pipeline.predict_proba(input)
+        return top_elf_codes(probabilities, self.pipeline.classes_, top=top)
+
+
+# state shared with the worker processes of ModelRepo.train_many
+_train_many_state: dict = {}
+
+
+def _init_train_many_worker(state):
+    _train_many_state.update(state)
+
+
+def _train_many_worker(jurisdiction):
+    state = _train_many_state
+    jurisdiction_data = state["lei_data"].iloc[state["indices"][jurisdiction]]
+    ModelRepo(state["models_dir"]).train_and_store(
+        jurisdiction,
+        jurisdiction_data,
+        state["elf_code_list"],
+        state["elf_abbreviations"],
+        state["token_cache"],
+    )
+    return jurisdiction
+
 
 class ModelRepo:
     def __init__(self, models_dir: Path):
         self.models_dir = models_dir
 
-    def train_pipeline(self, jurisdiction, data_loader: DataRepo):
-        jurisdiction_data = data_loader.load_lei_cdf_data(jurisdiction)
-        elf_code_list = data_loader.load_elf_code_list()
+    def model_dir(self, jurisdiction) -> Path:
+        return self.models_dir.joinpath(f"complement_nb_{jurisdiction}")
+
+    def model_file(self, jurisdiction) -> Path:
+        # pickled pipeline, as stored before the model directories (see convert_models)
+        return self.models_dir.joinpath(f"complement_nb_{jurisdiction}.joblib")
 
+    def store(self, jurisdiction, pipeline):
+        logger.info(f"Store model to {self.models_dir} ...")
+        with profile_stage("store_model"):
+            save_pipeline(pipeline, self.model_dir(jurisdiction))
+
+    def train_and_store(
+        self,
+        jurisdiction,
+        jurisdiction_data,
+        elf_code_list: ELFCodeListIndex,
+        elf_abbreviations: ELFAbbreviations,
+        token_cache: Optional[TokenCache] = None,
+    ):
         jurisdiction_data = filter_infrequent_elf_codes(jurisdiction_data)
         jurisdiction_data = filter_inactive_elf_codes(jurisdiction_data, elf_code_list)
 
-        pipeline = DefaultPipeline(elf_code_list.get_abbreviations(), jurisdiction)
+        pipeline = DefaultPipeline(
+            elf_abbreviations, jurisdiction, token_cache=token_cache
+        )
 
         nsamples = len(jurisdiction_data)
         logger.info(
             f"Train model for jurisdiction {jurisdiction} ({nsamples} samples) ..."
         )
         pipeline = train_for_jurisdiction(jurisdiction_data, pipeline)
+        # records updated after the watermark are used by update_pipeline
+        pipeline.data_watermark_ = data_watermark(jurisdiction_data)
 
-        model_file = self.models_dir.joinpath(f"complement_nb_{jurisdiction}.joblib")
-        logger.info(f"Store model to {self.models_dir} ...")
-        joblib.dump(pipeline, model_file)
+        if token_cache is not None:
+            # the cache belongs to the data directory, not to the model
+            pipeline.set_params(feature_extraction__token_cache=None)
+            token_cache.save()
+
+        self.store(jurisdiction, pipeline)
+
+    def train_pipeline(
+        self, jurisdiction, data_loader: DataRepo, use_token_cache: bool = True
+    ):
+        jurisdiction_data = data_loader.load_lei_cdf_data(jurisdiction)
+        elf_code_list = data_loader.load_elf_code_list()
 
-    def get_model(self, jurisdiction) -> ELFDetectionModel:
-        model_file = self.models_dir.joinpath(f"complement_nb_{jurisdiction}.joblib")
+        self.train_and_store(
+            jurisdiction,
+            jurisdiction_data,
+            elf_code_list,
+            elf_code_list.get_abbreviations(),
+            TokenCache.for_data_dir(data_loader.data_dir) if use_token_cache else None,
+        )
+
+    def train_out_of_core(
+        self,
+        jurisdiction,
+        data_loader: DataRepo,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        n_features: int = DEFAULT_HASH_FEATURES,
+    ) -> int:
+        """
+        Train a HashingPipeline for a jurisdiction from chunks of at most
+        chunksize records that are streamed from the LEI data, so that memory
+        usage does not depend on the size of the jurisdiction. The data is read
+        three times: for the ELF Codes, for training and for evaluating the
+        model on the held out third of the records.
+
+        :return: number of training records
+        """
+        elf_code_list = data_loader.load_elf_code_list()
 
-        if not model_file.exists():
+        def chunks(usecols=None):
+            for chunk in data_loader.iter_lei_cdf_data(
+                jurisdiction, usecols=usecols, chunksize=chunksize
+            ):
+                chunk = filter_inactive_elf_codes(chunk, elf_code_list)
+                if len(chunk) > 0:
+                    yield chunk
+
+        elf_codes = set()
+        for chunk in chunks(usecols=[COL_ELF]):
+            elf_codes.update(chunk[COL_ELF].unique())
+        if not elf_codes:
+            raise ValueError(f"No LEI data for Jurisdiction {jurisdiction}")
+
+        pipeline = HashingPipeline(
+            elf_code_list.get_abbreviations(), jurisdiction, n_features=n_features
+        )
+        logger.info(
+            f"Train model for jurisdiction {jurisdiction} out of core "
+            f"(chunks of {chunksize} records) ..."
+        )
+        pipeline, nsamples = train_for_jurisdiction_out_of_core(
+            chunks, pipeline, numpy.array(sorted(elf_codes), dtype=object)
+        )
+
+        self.store(jurisdiction, pipeline)
+        return nsamples
+
+    def update_pipeline(self, jurisdiction, data_loader: DataRepo) -> int:
+        """
+        Update the stored model of a jurisdiction with the LEI records that were
+        registered or changed after its data watermark (Registration.LastUpdateDate)
+        instead of training it from scratch. Changed records are added to the
+        counts again rather than replacing their previous version, so models
+        should still be trained from scratch now and then. The token cache is
+        not used, it only keeps the names of the last run.
+
+        :return: number of records the model was updated with
+        """
+        pipeline = self.get_model(jurisdiction).pipeline
+        watermark = getattr(pipeline, "data_watermark_", None)
+        if watermark is None:
             raise ValueError(
-                f"No model for Jurisdiction {jurisdiction} in {self.models_dir}"
+                f"Model for Jurisdiction {jurisdiction} has no data watermark, "
+                "it needs to be trained from scratch"
             )
 
-        pipeline = joblib.load(model_file)
+        jurisdiction_data = data_loader.load_lei_cdf_data(jurisdiction)
+        update_data = jurisdiction_data[
+            _last_update(jurisdiction_data) > pandas.Timestamp(watermark)
+        ]
+        update_data = filter_inactive_elf_codes(
+            update_data, data_loader.load_elf_code_list()
+        )
+        if update_data.empty:
+            logger.info(f"No LEI records for {jurisdiction} after {watermark}")
+            return 0
+
+        logger.info(
+            f"Update model for jurisdiction {jurisdiction} "
+            f"({len(update_data)} samples after {watermark}) ..."
+        )
+        pipeline = update_for_jurisdiction(update_data, pipeline)
+        pipeline.data_watermark_ = data_watermark(jurisdiction_data)
+
+        self.store(jurisdiction, pipeline)
+        return len(update_data)
+
+    def train_many(
+        self,
+        data_loader: DataRepo,
+        jurisdictions: Optional[List[str]] = None,
+        n_workers: Optional[int] = None,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        use_token_cache: bool = True,
+    ) -> List[str]:
+        """
+        Train models for many jurisdictions, loading the LEI data and the ELF
+        Code list only once. Models are trained in a pool of n_workers processes
+        (all CPUs for None, in-process for 1) and stored as soon as they are ready.
+
+        :param jurisdictions: jurisdictions to train, or None for all jurisdictions
+            with at least min_samples records
+        :return: sorted jurisdictions for which a model has been stored
+        """
+        lei_data = data_loader.load_lei_cdf_data(jurisdictions)
+        elf_code_list = data_loader.load_elf_code_list()
+
+        indices = lei_data.groupby("Jurisdiction", observed=True).indices
+        if jurisdictions is None:
+            jurisdictions = sorted(
+                j for j, idx in indices.items() if len(idx) >= min_samples
+            )
+        missing = [j for j in jurisdictions if j not in indices]
+        if missing:
+            logger.warning(f"No LEI data for jurisdictions {missing}")
+        jurisdictions = [j for j in jurisdictions if j in indices]
+
+        state = {
+            "lei_data": lei_data,
+            "indices": indices,
+            "elf_code_list": elf_code_list,
+            "elf_abbreviations": elf_code_list.get_abbreviations(),
+            "token_cache": TokenCache.for_data_dir(data_loader.data_dir)
+            if use_token_cache
+            else None,
+            "models_dir": self.models_dir,
+        }
+
+        trained = []
+        if n_workers == 1:
+            _init_train_many_worker(state)
+            try:
+                for jurisdiction in jurisdictions:
+                    try:
+                        trained.append(_train_many_worker(jurisdiction))
+                        logger.info(f"Model for {jurisdiction} stored")
+                    except Exception:
+                        logger.exception(f"Training failed for {jurisdiction}")
+            finally:
+                # do not keep the LEI data alive after training
+                _train_many_state.clear()
+            return sorted(trained)
+
+        # Forked workers inherit the loaded data (copy-on-write) instead of
+        # receiving a pickled copy each.
+        mp_context = (
+            multiprocessing.get_context("fork")
+            if "fork" in multiprocessing.get_all_start_methods()
+            else None
+        )
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp_context,
+            initializer=_init_train_many_worker,
+            initargs=(state,),
+        ) as executor:
+            futures = {
+                executor.submit(_train_many_worker, jurisdiction): jurisdiction
+                for jurisdiction in jurisdictions
+            }
+            for future in as_completed(futures):
+                jurisdiction = futures[future]
+                try:
+                    trained.append(future.result())
+                    logger.info(f"Model for {jurisdiction} stored")
+                except Exception:
+                    logger.exception(f"Training failed for {jurisdiction}")
+        return sorted(trained)
+
+    def get_model(self, jurisdiction, mmap: bool = True) -> ELFDetectionModel:
+        """
+        :param mmap: memory map the arrays of the model (see load_pipeline)
+        """
+        model_dir = self.model_dir(jurisdiction)
+        model_file = self.model_file(jurisdiction)
+
+        if model_dir.joinpath(META_FILE).exists():
+            with profile_stage("load_model"):
+                pipeline = load_pipeline(model_dir, mmap=mmap)
+        elif model_file.exists():
+            with profile_stage("load_model"):
+                pipeline = joblib.load(model_file)
+        else:
+            raise ValueError(
+                f"No model for Jurisdiction {jurisdiction} in {self.models_dir}"
+            )
 
         return ELFDetectionModel(jurisdiction, pipeline)
 
+    def convert_models(self, keep: bool = False) -> List[str]:
+        """
+        Convert pickled models (.joblib files) into model directories.
+
+        :param keep: keep the .joblib files instead of removing them
+        :return: jurisdictions of the converted models
+        """
+        converted = []
+        for model_file in sorted(self.models_dir.glob("complement_nb_*.joblib")):
+            jurisdiction = model_file.stem.split("_")[-1]
+            logger.info(f"Converting {model_file.name} ...")
+            save_pipeline(joblib.load(model_file), self.model_dir(jurisdiction))
+            if not keep:
+                model_file.unlink()
+            converted.append(jurisdiction)
+        return converted
+
     def list(self):
+        model_dirs = [
+            meta_file.parent
+            for meta_file in self.models_dir.glob(f"complement_nb_*/{META_FILE}")
+            if not meta_file.parent.name.endswith(".tmp")
+        ]
         return list(
             sorted(
-                [
+                {
                     model_path.stem.split("_")[-1]
-                    for model_path in self.models_dir.glob("*.joblib")
-                ]
+                    for model_path in list(self.models_dir.glob("*.joblib"))
+                    + model_dirs
+                }
             )
         )
 
@@ -0,0 +1,99 @@
+import joblib  # type: ignore
+import numpy
+import pandas  # type: ignore
+from sklearn.compose import ColumnTransformer  # type: ignore
+from sklearn.feature_extraction.text import CountVectorizer  # type: ignore
+from sklearn.naive_bayes import ComplementNB  # type: ignore
+from sklearn.pipeline import Pipeline  # type: ignore
+
+from lenu.data.elf_codes import ELFAbbreviations
+from lenu.ml.artifact import load_pipeline, save_pipeline
+from lenu.ml.cnames import tokenize
+from lenu.ml.features import ELFAbbreviationTransformer
+from lenu.ml.pipelines import DefaultPipeline, HashingPipeline, ModelRepo
+
+ELF_ABBREVIATIONS = ELFAbbreviations(
+    pandas.DataFrame(
+        [
+            {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+            {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "KG"},
+            {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "Kg"},
+            {"Jurisdiction": "AT", "ELF Code": "AXSB", "Abbreviation": "GmbH"},
+        ]
+    )
+)
+X = numpy.array(
+    [["Hallo GmbH"], ["Müller GmbH & Co. KG"], ["Schulz Bau KG"], ["Acme Bau GmbH"]],
+    dtype=object,
+)
+y = numpy.array(["2HBR", "8Z6G", "8Z6G", "2HBR"], dtype=object)
+NAMES = numpy.array([["Schulz Müller GmbH"], ["Hallo Bau KG"], ["Foo"]], dtype=object)
+
+
+def legacy_pipeline():
+    # layout of models stored by earlier versions of lenu
+    return Pipeline(
+        steps=[
+            (
+                "feature_extraction",
+                ColumnTransformer(
+                    [
+                        (
+                            "abbreviations",
+                            ELFAbbreviationTransformer(ELF_ABBREVIATIONS, "DE"),
+                            0,
+                        ),
+                        (
+                            "tokenizer",
+                            CountVectorizer(
+                                tokenizer=tokenize, lowercase=False, binary=True
+                            ),
+                            0,
+                        ),
+                    ]
+                ),
+            ),
+            ("classifier", ComplementNB()),
+        ]
+    )
+
+
+class TestModelArtifact:
+    def test_round_trip(self, tmp_path):
+        for pipeline in [
+            DefaultPipeline(ELF_ABBREVIATIONS, "DE"),
+            HashingPipeline(ELF_ABBREVIATIONS, "DE", n_features=2**10),
+            legacy_pipeline(),
+        ]:
+            pipeline.fit(X, y)
+            pipeline.data_watermark_ = "2023-01-08T00:00:00+00:00"
+            save_pipeline(pipeline, tmp_path.joinpath("model"))
+            loaded = load_pipeline(tmp_path.joinpath("model"))
+
+            assert list(loaded.classes_) == ["2HBR", "8Z6G"]
+            assert loaded.data_watermark_ == "2023-01-08T00:00:00+00:00"
+            assert numpy.allclose(
+                loaded.predict_proba(NAMES), pipeline.predict_proba(NAMES)
+            )
+
+        # only the abbreviations of the model's jurisdiction are stored
+        elf_abbreviations = loaded.named_steps["feature_extraction"].elf_abbreviations
+        assert elf_abbreviations.abbreviations_for_jurisdiction("AT") == []
+        assert elf_abbreviations.abbreviations_for_jurisdiction("DE") == [
+            "GmbH",
+            "KG",
+            "Kg",
+        ]
+
+    def test_convert_models(self, tmp_path):
+        pipeline = DefaultPipeline(ELF_ABBREVIATIONS, "DE").fit(X, y)
+        model_repo = ModelRepo(tmp_path)
+        joblib.dump(pipeline, model_repo.model_file("DE"))
+
+        assert model_repo.convert_models() == ["DE"]
+        assert not model_repo.model_file("DE").exists()
+        assert model_repo.list() == ["DE"]
+        assert numpy.allclose(
+            model_repo.get_model("DE").pipeline.predict_proba(NAMES),
+            pipeline.predict_proba(NAMES),
+        )
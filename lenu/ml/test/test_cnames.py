@@ -0,0 +1,125 @@
+import random
+import unicodedata
+
+import numpy
+
+from lenu.ml import cnames
+
+
+class ReferenceHarmonizer:
+    """
+    The original, step by step implementation of cnames.harmonize and
+    cnames.tokenize, which the optimized implementation has to reproduce.
+    """
+
+    @staticmethod
+    def _rmdiacritics(char):
+        desc = unicodedata.name(char)
+        cutoff = desc.find(" WITH ")
+        if cutoff != -1:
+            desc = desc[:cutoff]
+            try:
+                char = unicodedata.lookup(desc)
+            except KeyError:
+                pass
+        return char
+
+    @staticmethod
+    def _replace_multi_spaces(s):
+        while "  " in s:
+            s = s.replace("  ", " ")
+        return s
+
+    @staticmethod
+    def _replace_trailing_non_alphanumeric_chars(s):
+        while s and not s[-1].isalnum():
+            s = s[0:-1]
+        return s
+
+    @staticmethod
+    def _correct_commas_and_periods(s):
+        s = s.replace(" ,", ",")
+        s = s.replace(" .", ".")
+        s = s.replace(", ", ",")
+        return s
+
+    purge_rules = [
+        lambda x: x.replace(" l'", " l "),
+        lambda x: x.replace("-", " "),
+        lambda x: x.replace("(", " "),
+        lambda x: x.replace(")", " "),
+        lambda x: x.replace(" & ", " and "),
+        lambda x: x.replace(" + ", " and "),
+        lambda x: x.replace(";", " "),
+        lambda x: x.replace("/", " "),
+        lambda x: x.replace(",", " "),
+    ]
+
+    def harmonize(self, s):
+        s = s.lower()
+        s = "".join([self._rmdiacritics(c) for c in s])
+        s = self._replace_multi_spaces(s)
+        s = s.replace('"', " ")
+        s = self._replace_trailing_non_alphanumeric_chars(s)
+        s = self._correct_commas_and_periods(s)
+        for rule in self.purge_rules:
+            s = rule(s)
+        return self._replace_multi_spaces(s)
+
+    def tokenize(self, s):
+        tokens = self.harmonize(s).strip().split(" ")
+        return numpy.unique([cnames._synonyms.get(token, token) for token in tokens])
+
+
+def name_corpus(n, seed=0):
+    rng = random.Random(seed)
+    words = [
+        "Müller",
+        "Société",
+        "Générale",
+        "Ærøskøbing",
+        "Łódź",
+        "Straße",
+        "Øresund",
+        "Œuvre",
+        "Ţara",
+        "ΑΛΦΑ",
+        "Москва",
+        "東京",
+        "l'Habitat",
+        "L'Oréal",
+        "AG",
+        "Co.",
+        "Inc.",
+        "Ltd",
+        "Corp",
+        "GmbH",
+        "S.A.",
+        "&",
+        "+",
+        "-",
+        "(Europe)",
+        "Int.",
+    ]
+    chars = " \"'-()&+;/,.!?_#*°ÀÉÎÕÜÇÑİıǅﬁ½²"
+    names = []
+    for _ in range(n):
+        tokens = rng.choices(words, k=rng.randint(1, 6))
+        tokens += ["".join(rng.choices(chars, k=rng.randint(1, 4)))]
+        rng.shuffle(tokens)
+        names.append(rng.choice([" ", "  ", " , ", " . "]).join(tokens))
+    return names
+
+
+class TestHarmonization:
+    def test_equivalence_with_reference_implementation(self):
+        reference = ReferenceHarmonizer()
+        for name in name_corpus(20000):
+            assert cnames.harmonize(name) == reference.harmonize(name), name
+            assert cnames.tokenize(name) == list(reference.tokenize(name)), name
+
+    def test_examples(self):
+        assert cnames.harmonize("Hans Müller GmbH & Co. KG") == (
+            "hans muller gmbh and co. kg"
+        )
+        assert cnames.tokenize("Acme Ltd.") == ["acme", "limited"]
@@ -0,0 +1,48 @@
+import pandas  # type: ignore
+
+from lenu.data.elf_codes import ELFAbbreviations
+from lenu.data.lei import COL_ELF, COL_LEGALNAME
+from lenu.ml.eval import evaluate_jurisdiction
+from lenu.ml.pipelines import DefaultPipeline
+
+
+class TestEvaluateJurisdiction:
+    def test_cached_features_give_same_scores(self):
+        elf_abbr = ELFAbbreviations(
+            pandas.DataFrame(
+                [
+                    {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+                    {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "KG"},
+                ]
+            )
+        )
+        words = ["Müller", "Bau", "Handel", "Schulz", "Nord", "Logistik", "Solar"]
+        jurisdiction_data = pandas.DataFrame(
+            [
+                [f"{a} {b} {suffix}", elf_code]
+                for a in words
+                for b in words
+                for suffix, elf_code in [
+                    ("GmbH", "2HBR"),
+                    ("KG", "8Z6G"),
+                    ("eG", "XLWA"),
+                    ("GmbH & Co. KG", "8Z6G"),
+                ]
+            ],
+            columns=[COL_LEGALNAME, COL_ELF],
+        )
+
+        cached = evaluate_jurisdiction(
+            jurisdiction_data, DefaultPipeline(elf_abbr, "DE"), n_splits=3
+        )
+        uncached = evaluate_jurisdiction(
+            jurisdiction_data,
+            DefaultPipeline(elf_abbr, "DE"),
+            n_splits=3,
+            cache_features=False,
+        )
+
+        scores = [col for col in cached if col.startswith(("test_", "train_"))]
+        assert len(cached) == 3
+        pandas.testing.assert_frame_equal(cached[scores], uncached[scores])
+        assert "estimator" not in cached
@@ -1,8 +1,13 @@
 import pandas  # type: ignore
 import numpy
+import pytest  # type: ignore
+from scipy import sparse  # type: ignore
+from sklearn.compose import ColumnTransformer  # type: ignore
+from sklearn.feature_extraction.text import CountVectorizer  # type: ignore
 
 from lenu.data.elf_codes import ELFAbbreviations
-from lenu.ml.features import ELFAbbreviationTransformer
+from lenu.ml.cnames import tokenize
+from lenu.ml.features import ELFAbbreviationTransformer, LegalNameFeaturizer
 
 
 class TestELFAbbreviationsTransformer:
@@ -21,17 +26,68 @@ class TestELFAbbreviationsTransformer:
             )
         )
 
-        elf_abbr_transformer = ELFAbbreviationTransformer(elf_abbr)
+        elf_abbr_transformer = ELFAbbreviationTransformer(elf_abbr, "DE")
 
         res = elf_abbr_transformer.transform(
+            pandas.Series(["Hallo GmbH", "Hello OHG mbH"], name="Entity.LegalName")
+        )
+
+        assert sparse.isspmatrix_csr(res)
+        assert (res.toarray() == numpy.array([[1, 0, 0], [0, 0, 1]])).all()
+
+        assert list(elf_abbr_transformer.get_feature_names_out()) == [
+            "abbr(GmbH)",
+            "abbr(OHG)",
+            "abbr(OHG mbH)",
+        ]
+
+
+class TestLegalNameFeaturizer:
+    def test_same_features_as_column_transformer(self):
+        elf_abbr = ELFAbbreviations(
             pandas.DataFrame(
-                {
-                    "Entity.LegalName": ["Hallo GmbH", "Hello OHG mbH"],
-                    "Jurisdiction": ["DE", "DE"],
-                }
+                [
+                    {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+                    {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "KG"},
+                ]
             )
         )
+        X = numpy.array(
+            [["Hallo GmbH"], ["Müller GmbH & Co. KG"], ["Hallo GmbH"], ["Acme Ltd."]]
+        )
 
-        assert (res == numpy.array([[1, 0, 0], [0, 0, 1]])).all().all()
+        column_transformer = ColumnTransformer(
+            [
+                ("abbreviations", ELFAbbreviationTransformer(elf_abbr, "DE"), 0),
+                (
+                    "tokenizer",
+                    CountVectorizer(tokenizer=tokenize, lowercase=False, binary=True),
+                    0,
+                ),
+            ],
+            sparse_threshold=1.0,
+        )
+        featurizer = LegalNameFeaturizer(elf_abbr, "DE")
+
+        expected = column_transformer.fit_transform(X).toarray()
+        assert (featurizer.fit_transform(X).toarray() == expected).all()
+        assert (featurizer.transform(X[::-1]).toarray() == expected[::-1]).all()
+        assert list(featurizer.get_feature_names_out()) == list(
+            column_transformer.get_feature_names_out()
+        )
+
+    def test_missing_names(self):
+        elf_abbr = ELFAbbreviations(
+            pandas.DataFrame(
+                [{"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"}]
+            )
+        )
+        featurizer = LegalNameFeaturizer(elf_abbr, "DE").fit(
+            numpy.array([["Foo GmbH"], ["Bar KG"]], dtype=object)
+        )
 
-        assert list(res.columns) == ["abbr(GmbH)", "abbr(OHG)", "abbr(OHG mbH)"]
+        for missing in [numpy.nan, None]:
+            with pytest.raises(ValueError):
+                featurizer.transform(
+                    numpy.array([["Foo GmbH"], ["Bar KG"], [missing]], dtype=object)
+                )
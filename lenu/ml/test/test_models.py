@@ -0,0 +1,108 @@
+import pandas  # type: ignore
+
+from lenu.data.elf_codes import ELFAbbreviations
+from lenu.ml.models import ELFAbbreviationClassifier
+
+ELF_ABBREVIATIONS = ELFAbbreviations(
+    pandas.DataFrame(
+        [
+            {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+            {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "KG"},
+            {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "GmbH & Co. KG"},
+            {"Jurisdiction": "DE", "ELF Code": "40DB", "Abbreviation": "OHG"},
+            {"Jurisdiction": "DE", "ELF Code": "FR3V", "Abbreviation": "GbR"},
+            # the same abbreviation for several ELF Codes
+            {"Jurisdiction": "DE", "ELF Code": "6QQB", "Abbreviation": "AG"},
+            {"Jurisdiction": "DE", "ELF Code": "SQKS", "Abbreviation": "AG"},
+            {"Jurisdiction": "AT", "ELF Code": "AXSB", "Abbreviation": "GmbH"},
+            {"Jurisdiction": "AT", "ELF Code": "EQOV", "Abbreviation": "AG"},
+        ]
+    )
+)
+
+LEGAL_NAMES = [
+    "Hallo GmbH",
+    "Müller GmbH & Co. KG",
+    "Schulz OHG",
+    "Meier GbR",
+    "Siemens AG",
+    "AG Holding GmbH",
+    "Verein e.V.",
+    "gmbh",
+    "",
+]
+
+
+def previous_predict(classifier, data):
+    """
+    Abbreviation matching as it was implemented before the abbreviation
+    tables: all abbreviations are matched against every name.
+    """
+    frequencies = classifier.frequencies_
+    jurisdiction = data["Jurisdiction"].iloc[0]
+    abbreviations = ELF_ABBREVIATIONS.abbreviations_for_jurisdiction(jurisdiction)
+
+    predictions = []
+    for name in data["Entity.LegalName"]:
+        potential_elf_codes = [
+            max(
+                ELF_ABBREVIATIONS.elf_codes_for_abbreviation(jurisdiction, abbr),
+                key=lambda elf_code: frequencies.get(elf_code, 0),
+            )
+            for abbr in abbreviations
+            if ELF_ABBREVIATIONS.matches(
+                name, abbr, classifier.use_lowercasing, classifier.use_endswith
+            )
+        ]
+        predictions.append(
+            max(
+                potential_elf_codes,
+                key=lambda elf_code: frequencies.get(elf_code, 0),
+                default=classifier.most_frequent_,
+            )
+        )
+    return predictions
+
+
+class TestELFAbbreviationClassifier:
+    def test_same_predictions_as_previous_logic(self):
+        X = pandas.DataFrame({"Entity.LegalName": LEGAL_NAMES, "Jurisdiction": "DE"})
+        # SQKS is more frequent than 6QQB, FR3V does not appear at all
+        y = ["2HBR", "2HBR", "2HBR", "8Z6G", "8Z6G", "40DB", "SQKS", "6QQB", "2HBR"]
+
+        for use_lowercasing in [True, False]:
+            for use_endswith in [True, False]:
+                classifier = ELFAbbreviationClassifier(
+                    ELF_ABBREVIATIONS,
+                    use_endswith=use_endswith,
+                    use_lowercasing=use_lowercasing,
+                ).fit(X, y)
+
+                for jurisdiction in ["DE", "AT", "XX"]:
+                    data = X.assign(Jurisdiction=jurisdiction)
+                    assert classifier.predict(data) == previous_predict(
+                        classifier, data
+                    ), (jurisdiction, use_lowercasing, use_endswith)
+
+    def test_predict_does_not_modify_the_model(self):
+        X = pandas.DataFrame({"Entity.LegalName": LEGAL_NAMES, "Jurisdiction": "DE"})
+        classifier = ELFAbbreviationClassifier(ELF_ABBREVIATIONS).fit(
+            X, ["2HBR"] * len(LEGAL_NAMES)
+        )
+
+        predictions = classifier.predict(X.assign(Jurisdiction="AT"))
+
+        assert predictions[0] == "AXSB"
+        assert list(classifier.abbreviation_tables_) == ["DE"]
+
+    def test_model_without_abbreviation_tables(self):
+        # as stored before the abbreviation tables were introduced
+        X = pandas.DataFrame({"Entity.LegalName": LEGAL_NAMES, "Jurisdiction": "DE"})
+        classifier = ELFAbbreviationClassifier(ELF_ABBREVIATIONS).fit(
+            X, ["2HBR"] * len(LEGAL_NAMES)
+        )
+        expected = classifier.predict(X)
+        del classifier.abbreviation_tables_
+
+        assert classifier.predict(X) == expected
+        assert expected[1] == "8Z6G"
@@ -0,0 +1,227 @@
+import numpy
+import pandas  # type: ignore
+import pytest  # type: ignore
+
+from lenu.data.elf_codes import ELFAbbreviations
+from lenu.data.lei import COL_ELF, COL_LAST_UPDATE, COL_LEGALNAME, compact_lei_data
+from lenu.ml.pipelines import (
+    DefaultPipeline,
+    HashingPipeline,
+    ModelRepo,
+    _holdout,
+    update_for_jurisdiction,
+)
+
+ELF_ABBREVIATIONS = ELFAbbreviations(
+    pandas.DataFrame(
+        [
+            {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+            {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "KG"},
+        ]
+    )
+)
+
+
+def lei_data(records):
+    return pandas.DataFrame(records, columns=[COL_LEGALNAME, COL_ELF, COL_LAST_UPDATE])
+
+
+INITIAL = lei_data(
+    [
+        ["Hallo GmbH", "2HBR", "2023-01-01T00:00:00Z"],
+        ["Müller Bau GmbH", "2HBR", "2023-01-02T00:00:00Z"],
+        ["Schmidt Logistik GmbH", "2HBR", "2023-01-03T00:00:00+02:00"],
+        ["Meier Handel GmbH", "2HBR", "2023-01-04T00:00:00Z"],
+        ["Müller GmbH & Co. KG", "8Z6G", "2023-01-05T00:00:00Z"],
+        ["Schulz Bau KG", "8Z6G", "2023-01-06T00:00:00Z"],
+        ["Wagner Handel KG", "8Z6G", "2023-01-07T00:00:00Z"],
+        ["Becker Logistik KG", "8Z6G", "2023-01-08T00:00:00Z"],
+    ]
+)
+UPDATES = lei_data(
+    [
+        ["Hoffmann Solar GmbH", "2HBR", "2023-02-01T00:00:00Z"],
+        ["Zeller Solar eG", "XLWA", "2023-02-02T00:00:00Z"],
+        ["Hansa Energie eG", "XLWA", "2023-02-03T00:00:00Z"],
+    ]
+)
+
+
+class ELFCodeListStub:
+    def get_inactive_elf_codes(self):
+        return []
+
+    def get_abbreviations(self):
+        return ELF_ABBREVIATIONS
+
+
+class DataRepoStub:
+    def __init__(self, lei_data):
+        self.lei_data = lei_data
+
+    def load_lei_cdf_data(self, jurisdiction):
+        return self.lei_data
+
+    def iter_lei_cdf_data(self, jurisdiction, usecols=None, chunksize=100_000):
+        for start in range(0, len(self.lei_data), chunksize):
+            yield self.lei_data.iloc[start : start + chunksize]
+
+    def load_elf_code_list(self):
+        return ELFCodeListStub()
+
+
+class TrainManyDataRepoStub(DataRepoStub):
+    data_dir = None
+
+    def load_lei_cdf_data(self, jurisdictions):
+        return self.lei_data[self.lei_data["Jurisdiction"].isin(jurisdictions)]
+
+
+class TestIncrementalUpdate:
+    def test_update_matches_training_on_all_records(self):
+        names = numpy.array([["Hoffmann Solar eG"], ["Schulz Handel GmbH"]])
+
+        updated = DefaultPipeline(ELF_ABBREVIATIONS, "DE")
+        updated.fit(INITIAL[[COL_LEGALNAME]].to_numpy(), INITIAL[COL_ELF].to_numpy())
+        update_for_jurisdiction(UPDATES, updated)
+
+        all_records = pandas.concat([INITIAL, UPDATES])
+        trained = DefaultPipeline(ELF_ABBREVIATIONS, "DE")
+        trained.fit(all_records[[COL_LEGALNAME]].to_numpy(), all_records[COL_ELF])
+
+        assert list(updated.classes_) == ["2HBR", "8Z6G", "XLWA"]
+        assert numpy.allclose(
+            updated.predict_proba(names), trained.predict_proba(names)
+        )
+
+    def test_update_pipeline(self, tmp_path):
+        model_repo = ModelRepo(tmp_path)
+        model_repo.train_and_store("DE", INITIAL, ELFCodeListStub(), ELF_ABBREVIATIONS)
+        assert model_repo.get_model("DE").pipeline.data_watermark_ == (
+            "2023-01-08T00:00:00+00:00"
+        )
+
+        data_repo = DataRepoStub(pandas.concat([INITIAL, UPDATES]))
+        assert model_repo.update_pipeline("DE", data_repo) == 3
+        # nothing new after the watermark has been moved
+        assert model_repo.update_pipeline("DE", data_repo) == 0
+
+        pipeline = model_repo.get_model("DE").pipeline
+        assert pipeline.data_watermark_ == "2023-02-03T00:00:00+00:00"
+        assert model_repo.get_model("DE").detect("Hansa Solar eG").index[0] == "XLWA"
+
+
+class TestOutOfCore:
+    def test_chunks_give_same_model(self, tmp_path):
+        all_records = pandas.concat([INITIAL, UPDATES])
+        all_records = all_records.assign(
+            LEI=[f"LEI{i}" for i in range(len(all_records))]
+        )
+        names = numpy.array([["Hoffmann Solar eG"], ["Schulz Handel GmbH"]])
+
+        model_repo = ModelRepo(tmp_path)
+        nsamples = model_repo.train_out_of_core(
+            "DE", DataRepoStub(all_records), chunksize=3
+        )
+        pipeline = model_repo.get_model("DE").pipeline
+
+        train = all_records[~_holdout(all_records)]
+        # a single partial_fit on all training records
+        trained = HashingPipeline(ELF_ABBREVIATIONS, "DE")
+        trained.named_steps["classifier"].partial_fit(
+            trained.named_steps["feature_extraction"].transform(
+                train[[COL_LEGALNAME]].to_numpy()
+            ),
+            train[COL_ELF],
+            classes=["2HBR", "8Z6G", "XLWA"],
+        )
+
+        assert nsamples == len(train)
+        assert pipeline.data_watermark_ == "2023-02-03T00:00:00+00:00"
+        assert list(pipeline.classes_) == ["2HBR", "8Z6G", "XLWA"]
+        assert numpy.allclose(
+            pipeline.predict_proba(names), trained.predict_proba(names)
+        )
+
+
+class TestELFDetectionModel:
+    def test_detect_batch_equals_detect(self, tmp_path):
+        model_repo = ModelRepo(tmp_path)
+        model_repo.train_and_store(
+            "DE",
+            pandas.concat([INITIAL, UPDATES]),
+            ELFCodeListStub(),
+            ELF_ABBREVIATIONS,
+        )
+        elf_model = model_repo.get_model("DE")
+        names = ["Hansa Solar eG", "Schulz Handel GmbH", "", "Hansa Solar eG"]
+
+        res = elf_model.detect_batch(names, top=2)
+
+        assert list(res.columns) == ["ELF Code 1", "Score 1", "ELF Code 2", "Score 2"]
+        assert len(res) == len(names)
+        for name, row in zip(names, res.itertuples(index=False)):
+            detected = elf_model.detect(name, top=2)
+            assert list(row[0::2]) == list(detected.index)
+            assert numpy.allclose(row[1::2], detected.values)
+
+    def test_detect_batch_top_exceeds_classes(self, tmp_path):
+        model_repo = ModelRepo(tmp_path)
+        model_repo.train_and_store("DE", INITIAL, ELFCodeListStub(), ELF_ABBREVIATIONS)
+
+        res = model_repo.get_model("DE").detect_batch(["Hallo KG"], top=5)
+
+        assert list(res.columns) == ["ELF Code 1", "Score 1", "ELF Code 2", "Score 2"]
+        assert res["ELF Code 1"][0] == "8Z6G"
+
+
+class TestCompact:
+    def test_compact_data_gives_same_model(self, tmp_path):
+        all_records = pandas.concat([INITIAL, UPDATES], ignore_index=True)
+        names = ["Hoffmann Solar eG", "Schulz Handel GmbH", "Bau KG"]
+
+        probabilities = []
+        for i, lei_data in enumerate([all_records, compact_lei_data(all_records)]):
+            models_dir = tmp_path.joinpath(str(i))
+            models_dir.mkdir()
+            model_repo = ModelRepo(models_dir)
+            # same train/test split
+            numpy.random.seed(0)
+            model_repo.train_and_store(
+                "DE", lei_data, ELFCodeListStub(), ELF_ABBREVIATIONS
+            )
+            pipeline = model_repo.get_model("DE").pipeline
+            assert list(pipeline.classes_) == ["2HBR", "8Z6G", "XLWA"]
+            assert pipeline.data_watermark_ == "2023-02-03T00:00:00+00:00"
+            probabilities.append(pipeline.predict_proba(numpy.array([names]).T))
+
+        numpy.testing.assert_allclose(probabilities[0], probabilities[1])
+
+
+class TestTrainMany:
+    @pytest.mark.parametrize("n_workers", [1, 2])
+    def test_train_many(self, tmp_path, n_workers):
+        lei_data = pandas.concat(
+            [
+                INITIAL.assign(Jurisdiction="DE"),
+                INITIAL.assign(Jurisdiction="AT"),
+                # too few records, training fails
+                UPDATES.iloc[:1].assign(Jurisdiction="CH"),
+            ],
+            ignore_index=True,
+        )
+        model_repo = ModelRepo(tmp_path)
+
+        trained = model_repo.train_many(
+            TrainManyDataRepoStub(lei_data),
+            ["DE", "CH", "FR", "AT"],
+            n_workers=n_workers,
+            use_token_cache=False,
+        )
+
+        # in the same (sorted) order, however many workers
+        assert trained == ["AT", "DE"]
+        assert model_repo.get_model("DE").detect("Hallo KG").index[0] == "8Z6G"
+        assert model_repo.get_model("AT").detect("Hallo GmbH").index[0] == "2HBR"
+        with pytest.raises(ValueError):
+            model_repo.get_model("CH")
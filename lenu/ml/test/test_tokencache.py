@@ -0,0 +1,45 @@
+from lenu.ml import tokencache
+from lenu.ml.tokencache import TokenCache
+
+
+class TestTokenCache:
+    def test_miss_and_hit(self, tmp_path):
+        cache = TokenCache.for_data_dir(tmp_path)
+        names = ["Hallo GmbH", "Hello KG"]
+        assert cache.missing("DE", names) == names
+
+        cache.update("DE", names, [["hallo", "gmbh"], ["hello", "kg"]])
+        assert cache.missing("DE", names + ["Foo AG"]) == ["Foo AG"]
+        assert cache.get("DE", names) == [["hallo", "gmbh"], ["hello", "kg"]]
+        cache.save()
+
+        cache = TokenCache.for_data_dir(tmp_path)
+        assert cache.missing("DE", names) == []
+        assert cache.missing("AT", names) == names
+
+    def test_save_keeps_used_names_only(self, tmp_path):
+        cache = TokenCache.for_data_dir(tmp_path)
+        cache.update("DE", ["Old GmbH", "New KG"], [["old", "gmbh"], ["new", "kg"]])
+        cache.get("DE", ["New KG"])
+        cache.save()
+
+        cache = TokenCache.for_data_dir(tmp_path)
+        assert cache.missing("DE", ["Old GmbH", "New KG"]) == ["Old GmbH"]
+
+    def test_other_harmonization_rules(self, tmp_path, monkeypatch):
+        cache = TokenCache.for_data_dir(tmp_path)
+        cache.update("DE", ["Hallo GmbH"], [["hallo", "gmbh"]])
+        cache.get("DE", ["Hallo GmbH"])
+        cache.save()
+
+        monkeypatch.setattr(tokencache, "harmonization_rules_hash", lambda: "other")
+        new_cache = TokenCache.for_data_dir(tmp_path)
+        assert new_cache.cache_dir != cache.cache_dir
+        assert new_cache.missing("DE", ["Hallo GmbH"]) == ["Hallo GmbH"]
+        # the cache of the previous rules is removed
+        new_cache.save()
+        assert not cache.cache_dir.exists()
+
+    def test_rules_hash_without_module_file(self, monkeypatch):
+        monkeypatch.setattr(tokencache.cnames, "__file__", None)
+        assert len(tokencache.harmonization_rules_hash()) == 16
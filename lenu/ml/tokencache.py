@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from lenu.ml import cnames
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_DIR_PREFIX = "token-cache-"
+
+
+def harmonization_rules_hash() -> str:
+    # any change to the harmonization / tokenization code invalidates the cache
+    try:
+        rules = Path(cnames.__file__).read_bytes()  # type: ignore
+    except (OSError, TypeError):
+        # no module file (e.g. frozen builds), any other version of lenu may
+        # have other rules
+        try:
+            rules = f"lenu {metadata.version('lenu')}".encode("utf-8")
+        except metadata.PackageNotFoundError:
+            rules = b"lenu"
+    return hashlib.sha1(rules).hexdigest()[:16]
+
+
+class TokenCache:
+    """
+    On-disk cache of cnames.tokenize results, one file per jurisdiction, stored
+    in a directory that is specific to the current harmonization rules.
+
+    Only the names that have been used since loading are written back by save(),
+    so the cache follows the LEI data instead of growing with every golden copy.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self._tokens: Dict[str, Dict[str, Tuple[str, ...]]] = {}
+        self._used: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def for_data_dir(data_dir: Path) -> "TokenCache":
+        return TokenCache(
+            data_dir.joinpath(TOKEN_CACHE_DIR_PREFIX + harmonization_rules_hash())
+        )
+
+    def __getstate__(self):
+        # loaded tokens are not shipped to other processes, they load their own
+        return {"cache_dir": self.cache_dir, "_tokens": {}, "_used": {}}
+
+    def _file(self, jurisdiction) -> Path:
+        return self.cache_dir.joinpath(f"{jurisdiction}.pkl")
+
+    def _load(self, jurisdiction) -> Dict[str, Tuple[str, ...]]:
+        if jurisdiction not in self._tokens:
+            tokens = {}
+            if self._file(jurisdiction).exists():
+                with open(self._file(jurisdiction), "rb") as f:
+                    tokens = pickle.load(f)
+            self._tokens[jurisdiction] = tokens
+            self._used[jurisdiction] = set()
+        return self._tokens[jurisdiction]
+
+    def missing(self, jurisdiction, names) -> List[str]:
+        cached = self._load(jurisdiction)
+        return [name for name in names if name not in cached]
+
+    def update(self, jurisdiction, names, tokens):
+        self._load(jurisdiction).update(zip(names, map(tuple, tokens)))
+
+    def get(self, jurisdiction, names) -> List[List[str]]:
+        cached = self._load(jurisdiction)
+        self._used[jurisdiction].update(names)
+        return [list(cached[name]) for name in names]
+
+    def save(self):
+        self.cache_dir.mkdir(exist_ok=True)
+        for jurisdiction, tokens in self._tokens.items():
+            used = self._used[jurisdiction]
+            tokens = {name: t for name, t in tokens.items() if name in used}
+
+            tmp_file = self._file(jurisdiction).with_suffix(".tmp")
+            with open(tmp_file, "wb") as f:
+                pickle.dump(tokens, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self._file(jurisdiction))
+        self._tokens, self._used = {}, {}
+
+        # caches of previous harmonization rules are obsolete
+        for other in self.cache_dir.parent.glob(TOKEN_CACHE_DIR_PREFIX + "*"):
+            if other != self.cache_dir:
+                logger.info(f"Removing obsolete token cache {other}")
+                shutil.rmtree(other, ignore_errors=True)
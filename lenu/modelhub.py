@@ -1,12 +1,52 @@
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy
 import pandas
 import requests
-from transformers import pipeline
+
+# torch, transformers and huggingface_hub are imported where they are used, so
+# that the model manifest and ONNX exports can be listed without loading them
+from lenu.util import top_elf_codes
+
+logger = logging.getLogger(__name__)
+
+MODEL_MANIFEST = "huggingface_models.json"
+MODEL_MANIFEST_TTL = 24 * 60 * 60  # seconds
+
+ONNX_EXPORT_PREFIX = "onnx_"
+ONNX_EXPORT_INFO = "export.json"
+
+# used to measure the drift of an exported model, if no other legal names are given
+SAMPLE_LEGAL_NAMES = [
+    "Hans Müller KG",
+    "Müller & Söhne GmbH & Co. KG",
+    "Acme Holdings Limited",
+    "ACME LTD.",
+    "Société Générale S.A.",
+    "Compagnie de l'Habitat SARL",
+    "Stichting Pensioenfonds",
+    "Banco Santander, S.A.",
+    "Nordic Invest AB",
+    "Fondazione Cassa di Risparmio",
+    "Smith Family Trust",
+    "Green Energy Fund LP",
+]
 
 
 def get_available_lenu_models_from_huggingface():
     r = requests.get(
-        "https://huggingface.co/api/models", params={"search": "Sociovestix"}
+        "https://huggingface.co/api/models",
+        params={"search": "Sociovestix"},
+        timeout=10,
     )
+    r.raise_for_status()
 
     return list(
         sorted(
@@ -22,21 +62,417 @@ def get_available_lenu_models_from_huggingface():
     )
 
 
+def get_lenu_models_from_huggingface_cache(cache_dir=None) -> List[str]:
+    """
+    lenu models that have been downloaded to the local Hugging Face cache
+
+    :param cache_dir: the Hugging Face cache (default: from the environment)
+    """
+    from huggingface_hub import scan_cache_dir
+    from huggingface_hub.utils import CacheNotFound
+
+    try:
+        repos = scan_cache_dir(cache_dir).repos
+    except (CacheNotFound, OSError):
+        return []
+    return list(
+        sorted(
+            repo.repo_id
+            for repo in repos
+            if repo.repo_type == "model"
+            and repo.repo_id.startswith("Sociovestix/lenu_")
+        )
+    )
+
+
+class ModelManifest:
+    """
+    Local copy of the list of models available on https://huggingface.co/Sociovestix,
+    stored in the models directory, so that resolving a model name does not need
+    a request to the Hugging Face API every time.
+    """
+
+    def __init__(self, models_dir: Path, ttl=MODEL_MANIFEST_TTL):
+        self.manifest_file = models_dir.joinpath(MODEL_MANIFEST)
+        self.ttl = ttl
+
+    def _read(self) -> Optional[dict]:
+        try:
+            manifest = json.loads(self.manifest_file.read_text())
+            return {
+                "fetched_at": float(manifest["fetched_at"]),
+                "models": [str(model) for model in manifest["models"]],
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing, or e.g. corrupt or edited by hand
+            return None
+
+    def expired(self) -> bool:
+        manifest = self._read()
+        return manifest is None or time.time() - manifest["fetched_at"] > self.ttl
+
+    def cached_models(self) -> List[str]:
+        """
+        Models of the manifest, without checking its age
+        """
+        manifest = self._read()
+        return manifest["models"] if manifest else []
+
+    def refresh(self) -> List[str]:
+        models = get_available_lenu_models_from_huggingface()
+        tmp_file = self.manifest_file.with_suffix(".tmp")
+        try:
+            tmp_file.write_text(
+                json.dumps({"fetched_at": time.time(), "models": models}, indent=2)
+            )
+            os.replace(tmp_file, self.manifest_file)
+        except OSError as e:
+            # e.g. a read-only models directory, the list is fetched again next time
+            logger.warning(f"Could not store the list of models: {e}")
+        return models
+
+    def models(self) -> List[str]:
+        """
+        Models of the manifest, refreshed first if it is older than ttl. If
+        Hugging Face is not reachable, the outdated manifest is used, or the
+        models in the local Hugging Face cache if there is no manifest yet.
+        """
+        if self.expired():
+            try:
+                return self.refresh()
+            except requests.RequestException as e:
+                logger.warning(f"Could not refresh the list of models: {e}")
+        return self.cached_models() or get_lenu_models_from_huggingface_cache()
+
+
+def _labels(config):
+    return [config.id2label[i][0:4] for i in range(config.num_labels)]
+
+
+def _uses_sigmoid(config):
+    # same function as the text-classification pipeline applies to the logits
+    return config.problem_type == "multi_label_classification" or config.num_labels == 1
+
+
+def _length_bucketed_probabilities(
+    tokenizer, num_labels, legal_names, batch_size, score_batch, return_tensors
+):
+    """
+    Every distinct name is tokenized once, and the names are scored in batches of
+    similar token length, so that little padding is needed.
+
+    :param score_batch: function computing the probabilities (as numpy array)
+        for a padded batch of tokenized names
+    :return: codes of the legal names (see pandas.factorize) and probabilities
+        of the distinct names
+    """
+    codes, unique_names = pandas.factorize(pandas.Series(legal_names, dtype=object))
+    probabilities = numpy.empty((len(unique_names), num_labels), dtype=numpy.float32)
+    if len(unique_names) == 0:
+        return codes, probabilities
+
+    from transformers import logging as transformers_logging
+
+    encodings = tokenizer(list(unique_names), truncation=True)
+    features = [
+        {key: encodings[key][i] for key in encodings.keys()}
+        for i in range(len(unique_names))
+    ]
+    order = numpy.argsort([len(ids) for ids in encodings["input_ids"]], kind="stable")
+
+    # padding pre-tokenized batches is intended here (as in DataCollatorWithPadding),
+    # the warning that calling a fast tokenizer with padding is faster does not apply
+    verbosity = transformers_logging.get_verbosity()
+    transformers_logging.set_verbosity_error()
+    try:
+        for start in range(0, len(order), batch_size):
+            batch = order[start : start + batch_size]
+            inputs = tokenizer.pad(
+                [features[i] for i in batch], return_tensors=return_tensors
+            )
+            probabilities[batch] = score_batch(inputs)
+    finally:
+        transformers_logging.set_verbosity(verbosity)
+    return codes, probabilities
+
+
 class ELFDetectionModel:
     def __init__(self, pipeline):
         self.pipeline = pipeline
 
     def detect(self, legal_name, top=3):
-        # do the prediction
-        elf_probabilities = pandas.Series(
-            {
-                res["label"][0:4]: res["score"]
-                for res in self.pipeline(legal_name, top_k=top)
-            }
+        # same scores as detect_batch, long names are truncated in both
+        return (
+            pandas.Series(self.probabilities([legal_name])[0], index=self.labels)
+            .sort_values(ascending=False)
+            .head(top)
+        )
+
+    def probabilities(self, legal_names, batch_size=64, num_threads=None):
+        """
+        Probabilities of all ELF Codes (see labels) for many legal names.
+
+        :param num_threads: number of threads torch uses for the batches
+            (default: torch's current setting)
+        """
+        import torch
+
+        model = self.pipeline.model
+
+        def score_batch(inputs):
+            logits = model(**inputs.to(model.device)).logits
+            if _uses_sigmoid(model.config):
+                return torch.sigmoid(logits).cpu().numpy()
+            return torch.softmax(logits, dim=-1).cpu().numpy()
+
+        previous_num_threads = torch.get_num_threads()
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        try:
+            with torch.inference_mode():
+                codes, probabilities = _length_bucketed_probabilities(
+                    self.pipeline.tokenizer,
+                    model.config.num_labels,
+                    legal_names,
+                    batch_size,
+                    score_batch,
+                    return_tensors="pt",
+                )
+        finally:
+            torch.set_num_threads(previous_num_threads)
+        return probabilities[codes]
+
+    @property
+    def labels(self):
+        return _labels(self.pipeline.model.config)
+
+    def detect_batch(
+        self, legal_names, top=3, batch_size=64, num_threads=None
+    ) -> pandas.DataFrame:
+        """
+        Detect ELF Codes for many legal names, see probabilities.
+
+        :return: see lenu.util.top_elf_codes
+        """
+        return top_elf_codes(
+            self.probabilities(legal_names, batch_size, num_threads),
+            self.labels,
+            top=top,
+        )
+
+
+class ONNXELFDetectionModel:
+    """
+    Runs a model exported by export_onnx with onnxruntime, with the same
+    interface as ELFDetectionModel.
+    """
+
+    def __init__(self, session, tokenizer, config):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.config = config
+
+    def detect(self, legal_name, top=3):
+        return (
+            pandas.Series(self.probabilities([legal_name])[0], index=self.labels)
+            .sort_values(ascending=False)
+            .head(top)
+        )
+
+    def probabilities(self, legal_names, batch_size=64):
+        """
+        Probabilities of all ELF Codes (see labels) for many legal names.
+        """
+        input_names = [i.name for i in self.session.get_inputs()]
+
+        def score_batch(inputs):
+            (logits,) = self.session.run(
+                None, {name: inputs[name].astype(numpy.int64) for name in input_names}
+            )
+            if _uses_sigmoid(self.config):
+                return 1 / (1 + numpy.exp(-logits))
+            exp = numpy.exp(logits - logits.max(axis=-1, keepdims=True))
+            return exp / exp.sum(axis=-1, keepdims=True)
+
+        codes, probabilities = _length_bucketed_probabilities(
+            self.tokenizer,
+            self.config.num_labels,
+            legal_names,
+            batch_size,
+            score_batch,
+            return_tensors="np",
+        )
+        return probabilities[codes]
+
+    @property
+    def labels(self):
+        return _labels(self.config)
+
+    def detect_batch(self, legal_names, top=3, batch_size=64) -> pandas.DataFrame:
+        """
+        Detect ELF Codes for many legal names, see probabilities.
+
+        :return: see lenu.util.top_elf_codes
+        """
+        return top_elf_codes(
+            self.probabilities(legal_names, batch_size), self.labels, top=top
         )
-        return elf_probabilities
 
 
 def get_model_from_huggingface(repo_name):
-    pipe = pipeline(model=repo_name)
+    from huggingface_hub import snapshot_download
+    from transformers import pipeline
+
+    # use the local copy of a previously downloaded model without contacting the Hub
+    try:
+        pipe = pipeline(
+            "text-classification",
+            model=snapshot_download(repo_name, local_files_only=True),
+        )
+    except OSError:
+        # not (completely) downloaded yet
+        pipe = pipeline("text-classification", model=repo_name)
     return ELFDetectionModel(pipe)
+
+
+def onnx_export_dir(models_dir: Path, repo_name) -> Path:
+    return models_dir.joinpath(ONNX_EXPORT_PREFIX + repo_name.replace("/", "--"))
+
+
+def list_onnx_exports(models_dir: Path):
+    return list(
+        sorted(
+            json.loads(info_file.read_text())["model"]
+            for info_file in models_dir.glob(
+                f"{ONNX_EXPORT_PREFIX}*/{ONNX_EXPORT_INFO}"
+            )
+        )
+    )
+
+
+def load_onnx_model(export_dir: Path, num_threads=None) -> ONNXELFDetectionModel:
+    """
+    Load a model exported by export_onnx. Requires onnxruntime.
+
+    :param num_threads: number of threads onnxruntime uses (default: all cores)
+    """
+    import onnxruntime  # type: ignore
+    from transformers import AutoConfig, AutoTokenizer
+
+    options = onnxruntime.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    session = onnxruntime.InferenceSession(
+        str(export_dir.joinpath("model.onnx")),
+        options,
+        providers=["CPUExecutionProvider"],
+    )
+    return ONNXELFDetectionModel(
+        session,
+        AutoTokenizer.from_pretrained(export_dir),
+        AutoConfig.from_pretrained(export_dir),
+    )
+
+
+def compare_models(reference, model, legal_names) -> dict:
+    """
+    Drift of a model (e.g. an ONNX export) against a reference model.
+    """
+    expected = reference.probabilities(legal_names)
+    actual = model.probabilities(legal_names)
+    diff = numpy.abs(expected - actual)
+    return {
+        "legal_names": len(legal_names),
+        "max_abs_score_diff": float(diff.max()) if len(legal_names) else 0.0,
+        "mean_abs_score_diff": float(diff.mean()) if len(legal_names) else 0.0,
+        "top1_agreement": float(
+            numpy.mean(expected.argmax(axis=1) == actual.argmax(axis=1))
+        )
+        if len(legal_names)
+        else 1.0,
+    }
+
+
+def _logits_module(model, input_names):
+    import torch
+
+    class LogitsModule(torch.nn.Module):
+        # positional inputs and a single output, as needed by torch.onnx.export
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).logits
+
+    return LogitsModule()
+
+
+def export_onnx(repo_name, models_dir: Path, quantize=False, legal_names=None):
+    """
+    Export a Hugging Face model to ONNX (optionally with dynamic int8 quantization
+    of the weights) into onnx_export_dir(models_dir, repo_name), together with its
+    tokenizer and config. Requires onnx and onnxruntime.
+
+    :param legal_names: names for the drift check against the PyTorch model
+        (default: SAMPLE_LEGAL_NAMES)
+    :return: export info, including the drift (see compare_models)
+    """
+    import onnxruntime  # type: ignore # noqa: F401
+    import torch
+
+    reference = get_model_from_huggingface(repo_name)
+    model, tokenizer = reference.pipeline.model, reference.pipeline.tokenizer
+    model.eval()
+
+    target_dir = onnx_export_dir(models_dir, repo_name)
+    tmp_dir = target_dir.with_name(target_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    dummy = tokenizer(SAMPLE_LEGAL_NAMES[:2], padding=True, return_tensors="pt")
+    # inputs in the order of the model's forward signature
+    input_names = [
+        name for name in inspect.signature(model.forward).parameters if name in dummy
+    ]
+    fp32_file = tmp_dir.joinpath("model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _logits_module(model, input_names).eval(),
+            tuple(dummy[name] for name in input_names),
+            str(fp32_file),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "logits": {0: "batch"},
+            },
+            opset_version=14,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+        quantize_dynamic(
+            fp32_file, tmp_dir.joinpath("model.onnx"), weight_type=QuantType.QInt8
+        )
+        fp32_file.unlink()
+    else:
+        fp32_file.rename(tmp_dir.joinpath("model.onnx"))
+    tokenizer.save_pretrained(tmp_dir)
+    model.config.save_pretrained(tmp_dir)
+
+    info = {
+        "model": repo_name,
+        "quantized": quantize,
+        "drift": compare_models(
+            reference,
+            load_onnx_model(tmp_dir),
+            SAMPLE_LEGAL_NAMES if legal_names is None else legal_names,
+        ),
+    }
+    tmp_dir.joinpath(ONNX_EXPORT_INFO).write_text(json.dumps(info, indent=2))
+
+    shutil.rmtree(target_dir, ignore_errors=True)
+    tmp_dir.rename(target_dir)
+    return info
@@ -0,0 +1,180 @@
+"""
+Wall time, CPU time and peak memory (RSS) of the stages of training and
+detection.
+
+Library code marks its stages with profile_stage, which does nothing unless a
+Profiler is active:
+
+    profiler = Profiler()
+    with profiler.activate():
+        model_repo.train_pipeline("DE", data_repo)
+    print(profiler.to_json())
+
+Stages opened within other stages of the same thread are reported as
+"outer/inner", repeated stages (e.g. per chunk or request) are aggregated. Only
+the current process is profiled.
+"""
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# the active Profiler, see Profiler.activate
+_active: Optional["Profiler"] = None
+
+
+def _read_peak_rss() -> Optional[int]:
+    """
+    :return: peak RSS of the process in bytes since the last _reset_peak_rss
+    """
+    try:
+        with open("/proc/self/status") as f:
+            match = re.search(r"VmHWM:\s+(\d+) kB", f.read())
+        if match:
+            return int(match.group(1)) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak of the whole process lifetime, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_peak_rss() -> bool:
+    # supported by Linux >= 4.0, the peak is set to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_bytes: Optional[int] = None
+
+    def record_peak(self, peak):
+        if peak is not None:
+            self.peak_rss_bytes = max(self.peak_rss_bytes or 0, peak)
+
+    def to_dict(self):
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "wall_s": self.wall_s,
+            "cpu_s": self.cpu_s,
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self._stages: Dict[str, _Stage] = {}
+        # open stages of all threads, they all see the peak RSS of the process
+        self._open: List[_Stage] = []
+        # open stages of the current thread, for the nesting of stages
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset_supported = True
+
+    @contextmanager
+    def activate(self):
+        """
+        Record the stages of library code (see profile_stage) in this profiler.
+        """
+        global _active
+        previous, _active = _active, self
+        try:
+            yield self
+        finally:
+            _active = previous
+
+    def _thread_stages(self) -> List[_Stage]:
+        if not hasattr(self._local, "stages"):
+            self._local.stages = []
+        return self._local.stages
+
+    def _update_open_peaks(self):
+        peak = _read_peak_rss()
+        for stage in self._open:
+            stage.record_peak(peak)
+
+    @contextmanager
+    def stage(self, name):
+        thread_stages = self._thread_stages()
+        with self._lock:
+            path = "/".join([s.name for s in thread_stages[-1:]] + [name])
+            stage = self._stages.setdefault(path, _Stage(path))
+            # the peak is reset for this stage, the outer stages keep theirs
+            self._update_open_peaks()
+            self._open.append(stage)
+            thread_stages.append(stage)
+            if self._reset_supported:
+                self._reset_supported = _reset_peak_rss()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            with self._lock:
+                stage.calls += 1
+                stage.wall_s += time.perf_counter() - wall
+                stage.cpu_s += time.process_time() - cpu
+                self._update_open_peaks()
+                self._open.remove(stage)
+                thread_stages.pop()
+
+    def report(self) -> dict:
+        return {
+            "stages": [stage.to_dict() for stage in self._stages.values()],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2) + "\n"
+
+    def to_prometheus(self) -> str:
+        metrics = [
+            ("calls", "calls_total", "counter", "Number of times a stage was run"),
+            ("wall_s", "wall_seconds", "gauge", "Wall time spent in a stage"),
+            ("cpu_s", "cpu_seconds", "gauge", "CPU time of the process in a stage"),
+            ("peak_rss_bytes", "peak_rss_bytes", "gauge", "Peak RSS during a stage"),
+        ]
+        lines = []
+        for key, metric, metric_type, help in metrics:
+            lines.append(f"# HELP lenu_stage_{metric} {help}")
+            lines.append(f"# TYPE lenu_stage_{metric} {metric_type}")
+            for stage in self.report()["stages"]:
+                if stage[key] is not None:
+                    label = stage["stage"].replace("\\", "\\\\").replace('"', '\\"')
+                    lines.append(f'lenu_stage_{metric}{{stage="{label}"}} {stage[key]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path, format: str = "json"):
+        """
+        :param format: "json" or "prometheus" (text exposition format)
+        """
+        content = self.to_prometheus() if format == "prometheus" else self.to_json()
+        Path(path).write_text(content)
+
+
+@contextmanager
+def profile_stage(name):
+    """
+    Record a stage in the active Profiler, if any.
+    """
+    profiler = _active
+    if profiler is None:
+        yield None
+    else:
+        with profiler.stage(name) as stage:
+            yield stage
@@ -0,0 +1,271 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+import numpy
+import pandas  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# number of recent requests and batches the latency and batch size metrics are
+# computed from
+METRICS_WINDOW = 1000
+
+
+class ModelMetrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.legal_names = 0
+        self.batches = 0
+        self._latencies: deque = deque(maxlen=window)
+        self._batch_sizes: deque = deque(maxlen=window)
+
+    def record_batch(self, batch_size, latencies):
+        with self._lock:
+            self.requests += len(latencies)
+            self.legal_names += batch_size
+            self.batches += 1
+            self._batch_sizes.append(batch_size)
+            self._latencies.extend(latencies)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = numpy.array(self._latencies) * 1000
+            batch_sizes = numpy.array(self._batch_sizes)
+            res = {
+                "requests": self.requests,
+                "legal_names": self.legal_names,
+                "batches": self.batches,
+            }
+        if len(latencies):
+            res["latency_ms"] = {
+                f"p{p}": float(numpy.percentile(latencies, p)) for p in (50, 95, 99)
+            }
+            res["latency_ms"]["max"] = float(latencies.max())
+            res["batch_size"] = {
+                "mean": float(batch_sizes.mean()),
+                "max": int(batch_sizes.max()),
+            }
+        return res
+
+
+class MicroBatcher:
+    """
+    Runs the detection requests for one model in a background thread and
+    combines concurrent requests into batches: a batch starts with the oldest
+    waiting request and is closed as soon as it has max_batch_size legal names,
+    or max_latency seconds after that request has been submitted.
+
+    The model needs a detect_batch(legal_names, top) method, see
+    lenu.ml.pipelines.ELFDetectionModel and lenu.modelhub.ELFDetectionModel.
+    """
+
+    def __init__(self, model, max_batch_size=64, max_latency=0.01):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = ModelMetrics()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, legal_names, top=3) -> Future:
+        """
+        :return: future of the result of detect_batch for the legal names
+        """
+        future: Future = Future()
+        self._queue.put((list(legal_names), top, future, time.perf_counter()))
+        return future
+
+    def detect_batch(self, legal_names, top=3, timeout=None) -> pandas.DataFrame:
+        return self.submit(legal_names, top).result(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        request = self._queue.get()
+        if request is None:
+            return None
+
+        batch = [request]
+        batch_size = len(request[0])
+        # the first request may have waited for the previous batch already
+        deadline = request[3] + self.max_latency
+        while batch_size < self.max_batch_size:
+            try:
+                request = self._queue.get(
+                    timeout=max(deadline - time.perf_counter(), 0)
+                )
+            except queue.Empty:
+                break
+            if request is None:
+                # finish this batch first, stop afterwards
+                self._queue.put(None)
+                break
+            batch.append(request)
+            batch_size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            legal_names = [name for request in batch for name in request[0]]
+            try:
+                res = self.model.detect_batch(
+                    legal_names, top=max(request[1] for request in batch)
+                )
+            except Exception as e:
+                logger.exception("Detection failed")
+                for request in batch:
+                    request[2].set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            start = 0
+            for names, top, future, submitted in batch:
+                future.set_result(
+                    res.iloc[start : start + len(names), : 2 * top].reset_index(
+                        drop=True
+                    )
+                )
+                start += len(names)
+            self.metrics.record_batch(
+                len(legal_names), [done - request[3] for request in batch]
+            )
+
+
+class DetectionRequestHandler(BaseHTTPRequestHandler):
+    server: "DetectionServer"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(
+                200,
+                {
+                    jurisdiction: batcher.metrics.snapshot()
+                    for jurisdiction, batcher in self.server.batchers.items()
+                },
+            )
+        elif self.path == "/health":
+            self._send_json(200, {"models": sorted(self.server.batchers)})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/detect":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        try:
+            request = json.loads(
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            )
+            jurisdiction = request["jurisdiction"]
+            legal_names = request.get("legal_names", [request.get("legal_name")])
+            top = int(request.get("top", 3))
+            if (
+                not isinstance(legal_names, list)
+                or not legal_names
+                or not all(isinstance(name, str) for name in legal_names)
+                or top < 1
+            ):
+                raise ValueError()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._send_json(
+                400,
+                {
+                    "error": 'Expected JSON like {"jurisdiction": "DE", '
+                    '"legal_names": ["Hans Müller KG"], "top": 3}'
+                },
+            )
+            return
+
+        batcher = self.server.batchers.get(jurisdiction)
+        if batcher is None:
+            self._send_json(404, {"error": f"No model for {jurisdiction}"})
+            return
+
+        try:
+            res = batcher.detect_batch(
+                legal_names, top, timeout=self.server.request_timeout
+            )
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self._send_json(
+            200,
+            {
+                "jurisdiction": jurisdiction,
+                "results": [
+                    {
+                        "legal_name": legal_name,
+                        "elf_codes": self.server.elf_codes(res.iloc[i]),
+                    }
+                    for i, legal_name in enumerate(legal_names)
+                ],
+            },
+        )
+
+
+class DetectionServer(ThreadingHTTPServer):
+    """
+    HTTP server for ELF detection with one MicroBatcher per jurisdiction (or model).
+
+    POST /detect with {"jurisdiction": "DE", "legal_names": [...], "top": 3}
+    GET /metrics for request latencies and batch sizes per jurisdiction
+    GET /health for the available jurisdictions
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address,
+        batchers: Dict[str, MicroBatcher],
+        elf_local_names: Dict[str, str],
+        request_timeout=60,
+    ):
+        super().__init__(server_address, DetectionRequestHandler)
+        self.batchers = batchers
+        self.elf_local_names = elf_local_names
+        self.request_timeout = request_timeout
+
+    def elf_codes(self, row):
+        # one row of detect_batch: ELF Code 1, Score 1, ELF Code 2, ...
+        return [
+            {
+                "elf_code": elf_code,
+                "local_name": self.elf_local_names.get(elf_code),
+                "score": float(score),
+            }
+            for elf_code, score in zip(row.iloc[0::2], row.iloc[1::2])
+        ]
+
+    def server_close(self):
+        super().server_close()
+        for batcher in self.batchers.values():
+            batcher.close()
@@ -0,0 +1,127 @@
+import json
+
+import pandas  # type: ignore
+from typer.testing import CliRunner
+
+from lenu.console import app, load_elf_model
+from lenu.data.elf_codes import ELFAbbreviations
+from lenu.data.lei import COL_ELF, COL_LAST_UPDATE, COL_LEGALNAME
+from lenu.ml.pipelines import ELFDetectionModel, ModelRepo
+from lenu.modelhub import ONNX_EXPORT_INFO, onnx_export_dir
+
+ELF_ABBREVIATIONS = ELFAbbreviations(
+    pandas.DataFrame(
+        [
+            {"Jurisdiction": "DE", "ELF Code": "2HBR", "Abbreviation": "GmbH"},
+            {"Jurisdiction": "DE", "ELF Code": "8Z6G", "Abbreviation": "KG"},
+        ]
+    )
+)
+
+LEI_DATA = pandas.DataFrame(
+    [
+        ["Hallo GmbH", "2HBR", "2023-01-01T00:00:00Z"],
+        ["Müller Bau GmbH", "2HBR", "2023-01-02T00:00:00Z"],
+        ["Meier Handel GmbH", "2HBR", "2023-01-03T00:00:00Z"],
+        ["Müller GmbH & Co. KG", "8Z6G", "2023-01-04T00:00:00Z"],
+        ["Schulz Bau KG", "8Z6G", "2023-01-05T00:00:00Z"],
+        ["Wagner Handel KG", "8Z6G", "2023-01-06T00:00:00Z"],
+    ],
+    columns=[COL_LEGALNAME, COL_ELF, COL_LAST_UPDATE],
+)
+
+
+class ELFCodeListStub:
+    def get_inactive_elf_codes(self):
+        return []
+
+    def get_abbreviations(self):
+        return ELF_ABBREVIATIONS
+
+
+class TestELFBatch:
+    def test_elf_batch(self, tmp_path):
+        models_dir = tmp_path.joinpath("models")
+        models_dir.mkdir()
+        model_repo = ModelRepo(models_dir)
+        model_repo.train_and_store("DE", LEI_DATA, ELFCodeListStub(), ELF_ABBREVIATIONS)
+        input_file = tmp_path.joinpath("names.csv")
+        input_file.write_text(
+            'Name\nBäcker Süß GmbH\n""\nZöllner KG\n', encoding="utf-8"
+        )
+        output_file = tmp_path.joinpath("results.csv")
+
+        result = CliRunner(mix_stderr=False).invoke(
+            app,
+            [
+                "elf-batch",
+                "DE",
+                str(input_file),
+                str(output_file),
+                "--top=2",
+                "--chunksize=2",
+                f"--models-dir={models_dir}",
+            ],
+        )
+
+        assert result.exit_code == 0, result.stderr
+        assert "Using locally trained ELF Detection model: DE" in result.stderr
+        res = pandas.read_csv(output_file, encoding="utf-8", keep_default_na=False)
+        assert list(res.columns) == [
+            "Name",
+            "ELF Code 1",
+            "Score 1",
+            "ELF Code 2",
+            "Score 2",
+        ]
+        assert list(res["Name"]) == ["Bäcker Süß GmbH", "", "Zöllner KG"]
+        assert res["ELF Code 1"][0] == "2HBR"
+        assert res["ELF Code 1"][2] == "8Z6G"
+
+        expected = model_repo.get_model("DE").detect_batch(list(res["Name"]), top=2)
+        pandas.testing.assert_frame_equal(
+            res.drop(columns="Name"), expected, check_dtype=False
+        )
+
+
+class TestLoadELFModel:
+    def test_local_model_before_onnx_export(self, tmp_path, monkeypatch):
+        model_repo = ModelRepo(tmp_path)
+        model_repo.train_and_store("DE", LEI_DATA, ELFCodeListStub(), ELF_ABBREVIATIONS)
+        export_dir = onnx_export_dir(tmp_path, "Sociovestix/lenu_DE")
+        export_dir.mkdir()
+        export_dir.joinpath(ONNX_EXPORT_INFO).write_text(
+            json.dumps({"model": "Sociovestix/lenu_DE"})
+        )
+        loaded = []
+
+        def load_onnx_model(export_dir):
+            loaded.append(export_dir)
+            return "ONNX model"
+
+        monkeypatch.setattr("lenu.console.load_onnx_model", load_onnx_model)
+
+        assert isinstance(load_elf_model("DE", model_repo), ELFDetectionModel)
+        assert loaded == []
+
+        # without a local model of that name, the ONNX export is used
+        assert load_elf_model("Sociovestix/lenu_DE", model_repo) == "ONNX model"
+        assert loaded == [export_dir]
+
+
+class TestTrain:
+    def test_update_and_out_of_core(self, tmp_path):
+        result = CliRunner(mix_stderr=False).invoke(
+            app,
+            [
+                "train",
+                "DE",
+                "--update",
+                "--out-of-core",
+                f"--data-dir={tmp_path}",
+                f"--models-dir={tmp_path}",
+            ],
+        )
+
+        assert result.exit_code == 2
+        assert "--update can not be combined with --out-of-core" in result.stderr
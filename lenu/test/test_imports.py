@@ -0,0 +1,33 @@
+import re
+import subprocess
+import sys
+
+# cumulative import time of lenu.console in seconds, it took about 4 seconds
+# when torch and scikit-learn were imported at module level
+CONSOLE_IMPORT_BUDGET = 2.0
+
+HEAVY_MODULES = ["torch", "transformers", "huggingface_hub", "sklearn", "scipy"]
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+class TestImports:
+    def test_console_does_not_import_heavy_modules(self):
+        result = run_python(
+            "import sys, lenu.console; "
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        )
+        assert result.stdout.strip() == ""
+
+    def test_console_import_time(self):
+        result = run_python("import lenu.console")
+        # "import time: <self us> | <cumulative us> | lenu.console"
+        cumulative_us = re.search(r"\|\s*(\d+) \| lenu\.console$", result.stderr, re.M)
+        assert int(cumulative_us.group(1)) / 1e6 < CONSOLE_IMPORT_BUDGET
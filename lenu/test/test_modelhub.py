@@ -0,0 +1,291 @@
+import json
+import time
+
+import numpy
+import pytest  # type: ignore
+import requests
+
+from lenu.modelhub import (
+    MODEL_MANIFEST,
+    ONNX_EXPORT_INFO,
+    ELFDetectionModel,
+    ModelManifest,
+    ONNXELFDetectionModel,
+    compare_models,
+    export_onnx,
+    get_lenu_models_from_huggingface_cache,
+    list_onnx_exports,
+    load_onnx_model,
+    onnx_export_dir,
+)
+
+ELF_CODES = ["2HBR", "8Z6G", "6QQB"]
+WORDS = ["hans", "müller", "gmbh", "kg", "ag", "bau", "handel", "und", "co"]
+
+
+def tiny_model(model_dir):
+    """
+    Randomly initialized text classification model with a word-level
+    vocabulary and at most 16 tokens per name, stored in model_dir.
+    """
+    pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    model_dir.mkdir(exist_ok=True)
+    vocab_file = model_dir.joinpath("vocab.txt")
+    vocab_file.write_text(
+        "\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS) + "\n"
+    )
+    tokenizer = transformers.BertTokenizerFast(
+        vocab_file=str(vocab_file), model_max_length=16
+    )
+    config = transformers.BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=16,
+        num_hidden_layers=1,
+        num_attention_heads=2,
+        intermediate_size=16,
+        max_position_embeddings=16,
+        id2label={i: f"{code} (label)" for i, code in enumerate(ELF_CODES)},
+        label2id={f"{code} (label)": i for i, code in enumerate(ELF_CODES)},
+    )
+    transformers.set_seed(0)
+    model = transformers.BertForSequenceClassification(config).eval()
+    tokenizer.save_pretrained(model_dir)
+    model.save_pretrained(model_dir)
+    return transformers.pipeline(
+        "text-classification", model=model, tokenizer=tokenizer
+    )
+
+
+class TestELFDetectionModel:
+    def test_detect_batch_equals_detect(self, tmp_path):
+        model = ELFDetectionModel(tiny_model(tmp_path.joinpath("model")))
+        legal_names = [
+            "Hans Müller GmbH",
+            "Bau und Handel KG",
+            "Hans Müller GmbH",
+            # longer than the model's maximum length, truncated in both cases
+            " ".join(WORDS * 4),
+            "",
+        ]
+
+        results = model.detect_batch(legal_names, top=2, batch_size=2)
+
+        assert model.labels == ELF_CODES
+        for legal_name, (_, result) in zip(legal_names, results.iterrows()):
+            expected = model.detect(legal_name, top=2)
+            assert list(expected.index) == [result["ELF Code 1"], result["ELF Code 2"]]
+            numpy.testing.assert_allclose(
+                expected.values, [result["Score 1"], result["Score 2"]], rtol=1e-5
+            )
+
+
+class ProbabilitiesStub:
+    def __init__(self, probabilities):
+        self._probabilities = numpy.array(probabilities)
+
+    def probabilities(self, legal_names):
+        return self._probabilities[: len(legal_names)]
+
+
+class SessionStub:
+    """
+    Computes the logits with the PyTorch model instead of onnxruntime.
+    """
+
+    class Input:
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+
+    def get_inputs(self):
+        return [self.Input("input_ids"), self.Input("attention_mask")]
+
+    def run(self, output_names, inputs):
+        import torch
+
+        self.calls.append(inputs)
+        with torch.no_grad():
+            logits = self.model(
+                **{name: torch.from_numpy(value) for name, value in inputs.items()}
+            ).logits
+        return [logits.numpy()]
+
+
+class TestCompareModels:
+    def test_compare_models(self):
+        reference = ProbabilitiesStub([[0.7, 0.2, 0.1], [0.1, 0.5, 0.4]])
+        model = ProbabilitiesStub([[0.6, 0.3, 0.1], [0.1, 0.4, 0.5]])
+
+        drift = compare_models(reference, model, ["A GmbH", "B KG"])
+
+        assert drift["legal_names"] == 2
+        assert drift["max_abs_score_diff"] == pytest.approx(0.1)
+        assert drift["mean_abs_score_diff"] == pytest.approx(0.4 / 6)
+        assert drift["top1_agreement"] == 0.5
+
+    def test_no_legal_names(self):
+        model = ProbabilitiesStub(numpy.empty((0, 3)))
+
+        assert compare_models(model, model, []) == {
+            "legal_names": 0,
+            "max_abs_score_diff": 0.0,
+            "mean_abs_score_diff": 0.0,
+            "top1_agreement": 1.0,
+        }
+
+
+class TestONNXExport:
+    def test_list_onnx_exports(self, tmp_path):
+        for repo_name in ["Sociovestix/lenu_DE", "Sociovestix/lenu_AT"]:
+            export_dir = onnx_export_dir(tmp_path, repo_name)
+            export_dir.mkdir()
+            export_dir.joinpath(ONNX_EXPORT_INFO).write_text(
+                json.dumps({"model": repo_name, "quantized": False})
+            )
+        # an export without info (e.g. interrupted) is not listed
+        onnx_export_dir(tmp_path, "Sociovestix/lenu_FR").mkdir()
+
+        assert list_onnx_exports(tmp_path) == [
+            "Sociovestix/lenu_AT",
+            "Sociovestix/lenu_DE",
+        ]
+        assert onnx_export_dir(tmp_path, "Sociovestix/lenu_DE").name == (
+            "onnx_Sociovestix--lenu_DE"
+        )
+
+    def test_onnx_model_with_session_stub(self, tmp_path):
+        pipeline = tiny_model(tmp_path.joinpath("model"))
+        reference = ELFDetectionModel(pipeline)
+        session = SessionStub(pipeline.model)
+        model = ONNXELFDetectionModel(
+            session, pipeline.tokenizer, pipeline.model.config
+        )
+        legal_names = ["Hans Müller GmbH", "Bau und Handel KG", " ".join(WORDS * 4)]
+
+        drift = compare_models(reference, model, legal_names)
+        results = model.detect_batch(legal_names, top=2)
+
+        assert drift["max_abs_score_diff"] < 1e-5
+        assert drift["top1_agreement"] == 1.0
+        assert all(value.dtype == numpy.int64 for value in session.calls[0].values())
+        assert list(results["ELF Code 1"]) == [
+            model.detect(legal_name, top=1).index[0] for legal_name in legal_names
+        ]
+
+    def test_export_and_load(self, tmp_path, monkeypatch):
+        pytest.importorskip("onnx")
+        pytest.importorskip("onnxruntime")
+        reference = ELFDetectionModel(tiny_model(tmp_path.joinpath("model")))
+        monkeypatch.setattr(
+            "lenu.modelhub.get_model_from_huggingface", lambda repo_name: reference
+        )
+        legal_names = ["Hans Müller GmbH", "Bau und Handel KG", "Müller AG"]
+
+        info = export_onnx("Sociovestix/lenu_DE", tmp_path, legal_names=legal_names)
+        model = load_onnx_model(onnx_export_dir(tmp_path, "Sociovestix/lenu_DE"))
+
+        assert list_onnx_exports(tmp_path) == ["Sociovestix/lenu_DE"]
+        assert info["drift"]["legal_names"] == 3
+        assert info["drift"]["max_abs_score_diff"] < 1e-4
+        assert model.labels == ELF_CODES
+        numpy.testing.assert_allclose(
+            model.probabilities(legal_names),
+            reference.probabilities(legal_names),
+            atol=1e-4,
+        )
+
+
+def huggingface_cache(cache_dir, repo_ids):
+    # the layout of the Hugging Face cache, with one file per model
+    for repo_id in repo_ids:
+        repo_dir = cache_dir.joinpath("models--" + repo_id.replace("/", "--"))
+        snapshot_dir = repo_dir.joinpath("snapshots", "abc123")
+        snapshot_dir.mkdir(parents=True)
+        snapshot_dir.joinpath("config.json").write_text("{}")
+        repo_dir.joinpath("refs").mkdir()
+        repo_dir.joinpath("refs", "main").write_text("abc123")
+    return cache_dir
+
+
+class TestModelManifest:
+    @pytest.fixture
+    def unreachable(self, monkeypatch):
+        def get_available_lenu_models_from_huggingface():
+            raise requests.ConnectionError("no network")
+
+        monkeypatch.setattr(
+            "lenu.modelhub.get_available_lenu_models_from_huggingface",
+            get_available_lenu_models_from_huggingface,
+        )
+
+    def test_refresh(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(
+            "lenu.modelhub.get_available_lenu_models_from_huggingface",
+            lambda: ["Sociovestix/lenu_AT", "Sociovestix/lenu_DE"],
+        )
+        manifest = ModelManifest(tmp_path)
+
+        assert manifest.expired()
+        assert manifest.models() == ["Sociovestix/lenu_AT", "Sociovestix/lenu_DE"]
+        assert not manifest.expired()
+        assert manifest.cached_models() == manifest.models()
+
+        # the models directory is not writable, the list is used anyway
+        manifest = ModelManifest(tmp_path.joinpath("missing"))
+        assert manifest.refresh() == ["Sociovestix/lenu_AT", "Sociovestix/lenu_DE"]
+        assert manifest.expired()
+
+    @pytest.mark.parametrize(
+        "content",
+        ["{", "[]", "{}", '{"models": ["Sociovestix/lenu_DE"]}', '{"fetched_at": 1}'],
+    )
+    def test_invalid_manifest(self, tmp_path, unreachable, monkeypatch, content):
+        tmp_path.joinpath(MODEL_MANIFEST).write_text(content)
+        monkeypatch.setattr(
+            "lenu.modelhub.get_lenu_models_from_huggingface_cache", lambda: []
+        )
+        manifest = ModelManifest(tmp_path)
+
+        assert manifest.expired()
+        assert manifest.cached_models() == []
+        assert manifest.models() == []
+
+    def test_outdated_manifest(self, tmp_path, unreachable):
+        tmp_path.joinpath(MODEL_MANIFEST).write_text(
+            json.dumps(
+                {
+                    "fetched_at": time.time() - 2 * 24 * 3600,
+                    "models": ["Sociovestix/lenu_DE"],
+                }
+            )
+        )
+
+        assert ModelManifest(tmp_path).models() == ["Sociovestix/lenu_DE"]
+
+    def test_offline_first_run(self, tmp_path, unreachable, monkeypatch):
+        cache_dir = huggingface_cache(
+            tmp_path.joinpath("hub"), ["Sociovestix/lenu_DE", "someone/other_model"]
+        )
+        monkeypatch.setattr(
+            "lenu.modelhub.get_lenu_models_from_huggingface_cache",
+            lambda: get_lenu_models_from_huggingface_cache(cache_dir),
+        )
+
+        # a model already downloaded can be used without the manifest
+        assert ModelManifest(tmp_path).models() == ["Sociovestix/lenu_DE"]
+
+    def test_models_from_huggingface_cache(self, tmp_path):
+        cache_dir = huggingface_cache(
+            tmp_path, ["Sociovestix/lenu_DE", "Sociovestix/lenu_AT", "someone/other"]
+        )
+
+        assert get_lenu_models_from_huggingface_cache(cache_dir) == [
+            "Sociovestix/lenu_AT",
+            "Sociovestix/lenu_DE",
+        ]
+        assert get_lenu_models_from_huggingface_cache(tmp_path.joinpath("x")) == []
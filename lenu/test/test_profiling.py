@@ -0,0 +1,53 @@
+import json
+import threading
+
+from lenu.profiling import Profiler, profile_stage
+
+
+class TestProfiler:
+    def test_nested_and_repeated_stages(self):
+        profiler = Profiler()
+        with profiler.activate():
+            with profile_stage("train"):
+                for _ in range(3):
+                    with profile_stage("fit"):
+                        data = bytearray(10_000_000)
+        del data
+        # no profiler active
+        with profile_stage("predict") as stage:
+            assert stage is None
+
+        stages = {s["stage"]: s for s in json.loads(profiler.to_json())["stages"]}
+        assert list(stages) == ["train", "train/fit"]
+        assert stages["train/fit"]["calls"] == 3
+        assert stages["train"]["wall_s"] >= stages["train/fit"]["wall_s"]
+        assert stages["train"]["peak_rss_bytes"] >= 10_000_000
+
+        prometheus = profiler.to_prometheus()
+        assert 'lenu_stage_calls_total{stage="train/fit"} 3' in prometheus
+        assert "# TYPE lenu_stage_wall_seconds gauge" in prometheus
+
+    def test_stages_of_concurrent_threads(self):
+        profiler = Profiler()
+        # both threads are in their predict stage at the same time
+        barrier = threading.Barrier(2)
+
+        def predict():
+            with profile_stage("predict"):
+                barrier.wait(5)
+                with profile_stage("batch"):
+                    barrier.wait(5)
+
+        with profiler.activate():
+            with profile_stage("serve"):
+                threads = [threading.Thread(target=predict) for _ in range(2)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+        stages = {s["stage"]: s for s in profiler.report()["stages"]}
+        # not "predict/predict", nor nested into the stage of the main thread
+        assert list(stages) == ["serve", "predict", "predict/batch"]
+        assert stages["predict"]["calls"] == 2
+        assert stages["predict/batch"]["calls"] == 2
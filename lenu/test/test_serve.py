@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pandas  # type: ignore
+import pytest  # type: ignore
+
+from lenu.serve import DetectionServer, MicroBatcher
+
+
+class RecordingModel:
+    def __init__(self):
+        self.batches = []
+
+    def detect_batch(self, legal_names, top=3):
+        self.batches.append(list(legal_names))
+        columns = {}
+        for k in range(top):
+            columns[f"ELF Code {k + 1}"] = [f"{name}-{k}" for name in legal_names]
+            columns[f"Score {k + 1}"] = [1.0 / (k + 1)] * len(legal_names)
+        return pandas.DataFrame(columns)
+
+
+class BlockingModel(RecordingModel):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def detect_batch(self, legal_names, top=3):
+        self.release.wait(5)
+        return super().detect_batch(legal_names, top)
+
+
+@pytest.fixture
+def server():
+    server = DetectionServer(
+        ("127.0.0.1", 0),
+        {"DE": MicroBatcher(RecordingModel(), max_latency=0.01)},
+        {"a-0": "Gesellschaft mit beschränkter Haftung"},
+    )
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body):
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server.server_address[1]}/detect",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+class TestMicroBatcher:
+    def test_concurrent_requests_are_batched(self):
+        model = RecordingModel()
+        batcher = MicroBatcher(model, max_batch_size=4, max_latency=0.5)
+
+        futures = [batcher.submit(["a"], top=1)]
+        futures += [batcher.submit([name], top=2) for name in "bcde"]
+        futures += [batcher.submit(["f", "g"], top=1)]
+        results = [f.result(5) for f in futures]
+        batcher.close()
+
+        # a batch is closed when full, or when max_latency has passed
+        assert model.batches == [["a", "b", "c", "d"], ["e", "f", "g"]]
+        assert list(results[0].columns) == ["ELF Code 1", "Score 1"]
+        assert list(results[2].iloc[0]) == ["c-0", 1.0, "c-1", 0.5]
+        assert list(results[5]["ELF Code 1"]) == ["f-0", "g-0"]
+
+        metrics = batcher.metrics.snapshot()
+        assert metrics["requests"] == 6
+        assert metrics["batch_size"] == {"mean": 3.5, "max": 4}
+
+    def test_deadline_from_submit_time(self):
+        model = BlockingModel()
+        batcher = MicroBatcher(model, max_batch_size=2, max_latency=0.5)
+
+        # a full batch, the model is called at once
+        first = batcher.submit(["a", "b"], top=1)
+        # waits while the model is busy with the first batch
+        time.sleep(0.1)
+        second = batcher.submit(["c"], top=1)
+        time.sleep(0.6)
+        model.release.set()
+        first.result(5)
+        released = time.perf_counter()
+        second.result(5)
+        batcher.close()
+
+        # max_latency has passed already, the batch is not kept open any longer
+        assert time.perf_counter() - released < 0.3
+        assert model.batches == [["a", "b"], ["c"]]
+
+
+class TestDetectionServer:
+    def test_detect(self, server):
+        status, body = post(
+            server, {"jurisdiction": "DE", "legal_names": ["a", "b"], "top": 1}
+        )
+
+        assert status == 200
+        assert body["results"][0] == {
+            "legal_name": "a",
+            "elf_codes": [
+                {
+                    "elf_code": "a-0",
+                    "local_name": "Gesellschaft mit beschränkter Haftung",
+                    "score": 1.0,
+                }
+            ],
+        }
+        assert body["results"][1]["elf_codes"][0]["elf_code"] == "b-0"
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            {"jurisdiction": "DE", "legal_names": []},
+            {"jurisdiction": "DE", "legal_names": "a"},
+            {"jurisdiction": "DE", "legal_names": ["a", None]},
+            {"jurisdiction": "DE", "legal_names": ["a"], "top": 0},
+            {"legal_names": ["a"]},
+        ],
+    )
+    def test_bad_request(self, server, body):
+        status, response = post(server, body)
+
+        assert status == 400
+        assert "error" in response
@@ -1,6 +1,8 @@
 import logging
 from logging import Handler, LogRecord
 
+import numpy
+import pandas  # type: ignore
 from click import echo
 
 
@@ -25,3 +27,24 @@ def typer_log_config(enable_logging: bool = False, loglevel: str = "INFO"):
         echo_handler = TyperEchoHandler()
         echo_handler.setFormatter(formatter)
         logger.addHandler(echo_handler)
+
+
+def top_elf_codes(probabilities, elf_codes, top=3) -> pandas.DataFrame:
+    """
+    Best scoring ELF Codes per row of a (names x ELF Codes) probability matrix.
+
+    :return: DataFrame with columns "ELF Code 1", "Score 1", ..., "ELF Code {top}",
+        "Score {top}", one row per name
+    """
+    probabilities = numpy.asarray(probabilities)
+    elf_codes = numpy.asarray(elf_codes, dtype=object)
+    top = min(top, probabilities.shape[1])
+
+    best = numpy.argsort(-probabilities, axis=1, kind="stable")[:, :top]
+    scores = numpy.take_along_axis(probabilities, best, axis=1)
+
+    columns = {}
+    for k in range(top):
+        columns[f"ELF Code {k + 1}"] = elf_codes[best[:, k]]
+        columns[f"Score {k + 1}"] = scores[:, k]
+    return pandas.DataFrame(columns)